@@ -1,4 +1,5 @@
 import pymysql
+from tools.migrate import migrate
 
 timeout = 10
 
@@ -13,6 +14,8 @@ connection = pymysql.connect(
     port=15095,
     user="avnadmin",
     write_timeout=timeout,
+    # migrate() runs DDL and records each step as it goes
+    autocommit=True,
 )
 
 try:
@@ -20,44 +23,8 @@ try:
     cursor.execute("USE testdb")
     
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            username VARCHAR(255) PRIMARY KEY,
-            role ENUM('admin', 'user') NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            ip_port TEXT NOT NULL,
-            queue_url TEXT NOT NULL,
-            token TEXT NOT NULL
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS subscriptions (
-            event_type VARCHAR(255) NOT NULL,
-            command TEXT NOT NULL,
-            username VARCHAR(255) NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-            PRIMARY KEY (event_type, username),
-            FOREIGN KEY (username) REFERENCES users(username) ON DELETE CASCADE
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS acl_function (
-            function_name VARCHAR(255) PRIMARY KEY,
-            function_path TEXT NOT NULL
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS event_acl_mapping (
-            event_type VARCHAR(255) NOT NULL,
-            function_name VARCHAR(255) NOT NULL,
-            PRIMARY KEY (event_type, function_name),
-            FOREIGN KEY (function_name) REFERENCES acl_function(function_name) ON DELETE CASCADE
-        )
-    """)
+    # The tables and their indexes come from the versioned migrations
+    migrate(connection)
 
     cursor.execute("SHOW TABLES")
     print(cursor.fetchall(), "\n")
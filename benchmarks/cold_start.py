@@ -0,0 +1,118 @@
+"""
+Cold-start profile of the Lambda packages.
+
+Each run imports a package's handler module in a fresh interpreter, as Lambda's
+init phase does, under `python -X importtime`. Reported are the median import
+time without priming, the median init time with priming (startup.PRIME_ON_INIT:
+clients built, data loaded) and the top-level modules that cost the most to
+import over the whole primed init. Run from the repository root:
+
+    python -m benchmarks.cold_start --runs 10 --top 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List
+
+from local_stack.harness import MASTER_DIR, USER_QUEUE_DIR
+
+PACKAGES = {
+    "master": (MASTER_DIR, "master_lambda"),
+    "user_queue": (USER_QUEUE_DIR, "user_lambda"),
+}
+
+# Times the import of the entry module; with priming on, that includes startup.register's prime()
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+__import__(sys.argv[1])
+print(json.dumps({"init_ms": (time.perf_counter() - started) * 1000}))
+"""
+
+
+def parse_importtime(stderr: str) -> List[tuple]:
+    """(module, self_us, cumulative_us, depth) for each line of `-X importtime` output."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def run_once(directory, entry: str, prime: bool) -> Dict:
+    env = {
+        **os.environ,
+        # As in Lambda: skips the .env lookup and enables priming by default
+        "AWS_LAMBDA_FUNCTION_NAME": f"cold-start-{entry}",
+        "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "us-east-1"),
+        "PRIME_ON_INIT": "1" if prime else "0",
+    }
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD, entry], cwd=str(directory),
+                             env=env, capture_output=True, text=True, check=True)
+    modules = parse_importtime(process.stderr)
+    entry_import = next(m for m in modules if m[0] == entry)
+    return {
+        "init_ms": json.loads(process.stdout.strip().splitlines()[-1])["init_ms"],
+        "import_ms": entry_import[2] / 1000,
+        "modules": modules,
+    }
+
+
+def profile(name: str, runs: int, top: int) -> Dict:
+    directory, entry = PACKAGES[name]
+    plain = [run_once(directory, entry, prime=False) for _ in range(runs)]
+    primed = [run_once(directory, entry, prime=True) for _ in range(runs)]
+    # Self time per top-level package (botocore, urllib3, ...), median over the runs
+    by_package: Dict[str, List[float]] = defaultdict(list)
+    for result in primed:
+        totals: Dict[str, int] = defaultdict(int)
+        for module, self_us, _, _ in result["modules"]:
+            # The entry module's own time is mostly prime() itself, reported as the init time
+            if module != entry:
+                totals[module.split(".")[0]] += self_us
+        for package, us in totals.items():
+            by_package[package].append(us / 1000)
+    heaviest = sorted(((statistics.median(v), k) for k, v in by_package.items()), reverse=True)[:top]
+    return {
+        "package": name,
+        "runs": runs,
+        "import_ms": statistics.median(r["import_ms"] for r in plain),
+        "primed_init_ms": statistics.median(r["init_ms"] for r in primed),
+        "heaviest_imports_ms": {package: ms for ms, package in heaviest},
+    }
+
+
+def report(results: List[Dict]):
+    for result in results:
+        print(f"{result['package']}: import {result['import_ms']:.1f} ms, "
+              f"init with priming {result['primed_init_ms']:.1f} ms (median of {result['runs']})")
+        print(f"  {'module':<24}{'self ms':>10}")
+        for package, ms in result["heaviest_imports_ms"].items():
+            print(f"  {package:<24}{ms:>10.1f}")
+        print()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Profile the import and init time of the Lambda packages.")
+    parser.add_argument("--package", choices=sorted(PACKAGES), action="append",
+                        help="Package to profile (repeatable; default: all)")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per package and mode")
+    parser.add_argument("--top", type=int, default=10, help="Heaviest top-level modules to list")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = [profile(name, args.runs, args.top) for name in (args.package or sorted(PACKAGES))]
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,290 @@
+"""
+End-to-end throughput and latency benchmark of the event pipeline.
+
+Synthetic events are published to a LocalSQS ingest queue and flow through the
+master Lambda, the user-queue Lambda and an in-process user_service, all backed
+by a SQLite stand-in for MySQL. Run from the repository root:
+
+    python -m benchmarks.pipeline_bench --events 500 --users 20 --event-types 4 --acl-ratio 0.5
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from local_stack import LocalSQS, Pipeline, SQLiteDatabase, UserServiceServer
+
+BENCH_TOKEN = "bench-token"
+QUEUE_PREFIX = "https://sqs.us-east-1.amazonaws.com/000000000000"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of values (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class StageTracker:
+    """
+    LocalSQS listener that timestamps each event as it crosses a queue.
+
+    Ingest messages mark the master stage (sent -> deleted), user queue messages
+    mark fan-out (ingest sent -> user queue sent) and delivery (user queue sent
+    -> deleted after the user_service call). Events are matched on `bench_seq`.
+    """
+
+    def __init__(self, ingest_queue_url: str):
+        self.ingest_queue_url = ingest_queue_url
+        self.ingest_sent: Dict[int, float] = {}
+        self.ingest_done: Dict[int, float] = {}
+        self.fanout: List[float] = []
+        self.delivery: List[float] = []
+        self.last_delivery: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, action: str, queue_url: str, message):
+        now = time.time()
+        seq = json.loads(message.body).get("bench_seq")
+        if seq is None:
+            return
+        with self._lock:
+            if queue_url == self.ingest_queue_url:
+                if action == "sent":
+                    self.ingest_sent[seq] = message.sent_at
+                else:
+                    self.ingest_done[seq] = now
+            elif action == "sent":
+                self.fanout.append(message.sent_at - self.ingest_sent[seq])
+            else:
+                self.delivery.append(now - message.sent_at)
+                self.last_delivery[seq] = max(now, self.last_delivery.get(seq, 0.0))
+
+    def master(self) -> List[float]:
+        return [self.ingest_done[s] - self.ingest_sent[s] for s in self.ingest_done]
+
+    def end_to_end(self) -> List[float]:
+        return [
+            self.last_delivery.get(seq, done) - self.ingest_sent[seq]
+            for seq, done in self.ingest_done.items()
+        ]
+
+
+def seed(database: SQLiteDatabase, args, ip_port: str, workdir: str) -> Dict[str, List[str]]:
+    """Create users, subscriptions, ACL bindings and the strategy file. Returns the scenario."""
+    rng = random.Random(args.seed)
+    users = [f"bench.user{i}" for i in range(args.users)]
+    event_types = [f"bench_event_{i}" for i in range(args.event_types)]
+    strategies = [f"bench_strat_{i}" for i in range(args.strategies)]
+
+    database.executemany(
+        "INSERT INTO users (username, role, ip_port, queue_url, token) VALUES (%s, %s, %s, %s, %s)",
+        [(u, "user", ip_port, f"{QUEUE_PREFIX}/{u.replace('.', '-')}.fifo", BENCH_TOKEN) for u in users],
+    )
+
+    # A --filter-ratio share of subscriptions only want events of one strategy
+    subscriptions = []
+    for i, event_type in enumerate(event_types):
+        for j in range(min(args.subscribers, len(users))):
+            strategy_filter = None
+            if args.filter_ratio and rng.random() < args.filter_ratio:
+                strategy_filter = json.dumps({"strategy": rng.choice(strategies)})
+            subscriptions.append((event_type, args.command, users[(i + j) % len(users)], strategy_filter))
+    database.executemany(
+        "INSERT INTO subscriptions (event_type, command, username, filter_expression) VALUES (%s, %s, %s, %s)",
+        subscriptions,
+    )
+
+    guarded = event_types[:round(args.acl_ratio * len(event_types))]
+    if guarded:
+        database.executemany(
+            "INSERT INTO acl_function (function_name, function_path) VALUES (%s, %s)",
+            [("admin_tag_check", "acl_checks.admin_tag_check")],
+        )
+        database.executemany(
+            "INSERT INTO event_acl_mapping (event_type, function_name) VALUES (%s, %s)",
+            [(event_type, "admin_tag_check") for event_type in guarded],
+        )
+
+    strategy_data = {
+        strategy: {"users": {u: ["admin"] if rng.random() < args.admin_ratio else [] for u in users}}
+        for strategy in strategies
+    }
+    strategy_path = os.path.join(workdir, "all_strategy_details.json")
+    with open(strategy_path, "w") as f:
+        json.dump(strategy_data, f)
+    os.environ["STRATEGY_JSON_FILEPATH"] = strategy_path
+
+    return {"users": users, "event_types": event_types, "strategies": strategies}
+
+
+def publish(sqs: LocalSQS, queue_url: str, scenario, args):
+    """Send events the way EventService.send_to_sqs does, optionally rate limited."""
+    rng = random.Random(args.seed + 1)
+    padding = "x" * args.payload_bytes
+    interval = 1.0 / args.rate if args.rate else 0.0
+    started = time.monotonic()
+    for seq in range(args.events):
+        event = {
+            "event_type": scenario["event_types"][seq % len(scenario["event_types"])],
+            "strategy": rng.choice(scenario["strategies"]),
+            "date": "2025-01-01",
+            "bench_seq": seq,
+            "payload": padding,
+        }
+        if rng.random() < args.high_priority_ratio:
+            event["priority"] = "high"
+        body = json.dumps(event)
+        sqs.send_message(
+            QueueUrl=queue_url,
+            MessageBody=body,
+            MessageGroupId=event["event_type"],
+            MessageDeduplicationId=hashlib.md5(json.dumps(event, sort_keys=True).encode("utf-8")).hexdigest(),
+        )
+        if interval:
+            delay = started + (seq + 1) * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def run(args) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="pipeline-bench-")
+    token_path = os.path.join(workdir, "user_service.token")
+    with open(token_path, "w") as f:
+        f.write(BENCH_TOKEN)
+    os.environ["USER_SERVICE_TOKEN_PATH"] = token_path
+    # Read by the Lambdas' lanes module when the Pipeline loads them
+    os.environ["MESSAGE_GROUP_STRATEGY"] = args.group_strategy
+    os.environ["PRIORITY_LANES"] = "true" if args.high_priority_ratio > 0 else "false"
+
+    database = SQLiteDatabase(os.path.join(workdir, "bench.sqlite3"))
+    user_service = UserServiceServer(database)
+    sink = sys.stdout if args.verbose else open(os.devnull, "w")
+
+    with contextlib.redirect_stdout(sink):
+        scenario = seed(database, args, user_service.ip_port, workdir)
+        user_service.start()
+
+        sqs = LocalSQS()
+        pipeline = Pipeline(sqs=sqs, batch_size=args.batch_size, database=database)
+        tracker = StageTracker(pipeline.ingest_queue_url)
+        sqs.listeners.append(tracker)
+        for username in scenario["users"]:
+            pipeline.add_user_queue(f"{QUEUE_PREFIX}/{username.replace('.', '-')}.fifo",
+                                    priority_lanes=args.high_priority_ratio > 0)
+
+        if args.routing_snapshot:
+            pipeline.enable_routing_snapshot(os.path.join(workdir, "routing.json.gz"))
+
+        database.reset_stats()
+        user_service.requests.clear()
+        pipeline.start()
+        started = time.time()
+        publish(sqs, pipeline.ingest_queue_url, scenario, args)
+        drained = pipeline.drain(timeout=args.timeout)
+        finished = max([started] + list(tracker.ingest_done.values()) + list(tracker.last_delivery.values()))
+        pipeline.stop()
+        user_service.stop()
+
+    events = max(1, len(tracker.ingest_done))
+    handler_requests = [r for r in user_service.requests if r[0] == "/"]
+    elapsed = max(finished - started, 1e-9)
+    ms = lambda values: [v * 1000.0 for v in values]
+    stages = {
+        "master": ms(tracker.master()),
+        "fanout": ms(tracker.fanout),
+        "delivery": ms(tracker.delivery),
+        "main_handler": ms([r[2] for r in handler_requests]),
+        "end_to_end": ms(tracker.end_to_end()),
+    }
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "verbose")},
+        "completed": drained,
+        "events": len(tracker.ingest_done),
+        "deliveries": len(tracker.delivery),
+        "elapsed_seconds": elapsed,
+        "events_per_second": len(tracker.ingest_done) / elapsed,
+        "deliveries_per_second": len(tracker.delivery) / elapsed,
+        "stages_ms": {
+            name: {"count": len(values), "p50": percentile(values, 50),
+                   "p95": percentile(values, 95), "p99": percentile(values, 99)}
+            for name, values in stages.items()
+        },
+        "per_event": {
+            "db_queries": {label: n / events for label, n in sorted(database.queries.items())},
+            "db_connections": {label: n / events for label, n in sorted(database.connections.items())},
+            "sqs_calls": {op: n / events for op, n in sorted(sqs.stats.items())},
+            "http_calls": len(user_service.requests) / events,
+            "http_errors": sum(1 for r in handler_requests if r[1] >= 400) / events,
+        },
+        "lambda_errors": len(pipeline.errors()),
+    }
+
+
+def report(result: Dict):
+    config = result["config"]
+    print(f"events={result['events']} users={config['users']} subscribers/type={config['subscribers']} "
+          f"event_types={config['event_types']} acl_ratio={config['acl_ratio']} "
+          f"payload={config['payload_bytes']}B batch={config['batch_size']} groups={config['group_strategy']}")
+    if not result["completed"]:
+        print("WARNING: pipeline did not drain before the timeout")
+    print(f"throughput: {result['events_per_second']:.1f} events/s, "
+          f"{result['deliveries_per_second']:.1f} deliveries/s over {result['elapsed_seconds']:.2f}s")
+    print(f"\n{'stage':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in result["stages_ms"].items():
+        print(f"{name:<14}{stats['count']:>8}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['p99']:>10.2f}")
+    per_event = result["per_event"]
+    print("\nper event:")
+    for kind in ("db_queries", "db_connections", "sqs_calls"):
+        print(f"  {kind}: " + ", ".join(f"{k}={v:.2f}" for k, v in per_event[kind].items()))
+    print(f"  http_calls: {per_event['http_calls']:.2f} (errors {per_event['http_errors']:.2f})")
+    if result["lambda_errors"]:
+        print(f"\nlambda invocation errors: {result['lambda_errors']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the event pipeline on local SQS/SQLite stand-ins.")
+    parser.add_argument("--events", type=int, default=200, help="Number of events to publish")
+    parser.add_argument("--users", type=int, default=10, help="Number of registered users")
+    parser.add_argument("--subscribers", type=int, default=5, help="Subscribers per event type")
+    parser.add_argument("--event-types", type=int, default=3, help="Number of distinct event types")
+    parser.add_argument("--strategies", type=int, default=5, help="Number of distinct strategies")
+    parser.add_argument("--acl-ratio", type=float, default=0.0, help="Fraction of event types guarded by admin_tag_check")
+    parser.add_argument("--admin-ratio", type=float, default=0.5, help="Fraction of users tagged admin per strategy")
+    parser.add_argument("--payload-bytes", type=int, default=256, help="Size of the padding field in each event")
+    parser.add_argument("--batch-size", type=int, default=10, help="Records per Lambda invocation (1-10)")
+    parser.add_argument("--rate", type=float, default=0.0, help="Publish rate in events/s (0 = as fast as possible)")
+    parser.add_argument("--group-strategy", default="user",
+                        choices=("user", "user_event_type", "user_strategy", "sharded"),
+                        help="MESSAGE_GROUP_STRATEGY for the fan-out")
+    parser.add_argument("--high-priority-ratio", type=float, default=0.0,
+                        help="Fraction of events marked high priority (> 0 enables priority lanes)")
+    parser.add_argument("--filter-ratio", type=float, default=0.0,
+                        help="Fraction of subscriptions filtered to a single strategy")
+    parser.add_argument("--routing-snapshot", action="store_true",
+                        help="Route the master Lambda from a routing snapshot instead of MySQL")
+    parser.add_argument("--command", default="true <strategy> <date>", help="Subscription command template")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Seconds to wait for the pipeline to drain")
+    parser.add_argument("--seed", type=int, default=7, help="Random seed for the scenario")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Keep the services' stdout logging")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = run(args)
+    report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
@@ -1,27 +1,64 @@
-import requests
+import csv
 import json
-import asyncpg
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import pymysql
+import requests
+from requests.adapters import HTTPAdapter
 
 
 # HPC Service Configuration
 HPC_SERVICE_URL = "https://<root_ip>:<port>"
 HPC_AUTH_TOKEN = "MY_SECRET_TOKEN"
 
-# DB Configuration
-connection = pymysql.connect(
-    host=os.getenv("MYSQL_HOST"),
-    user=os.getenv("MYSQL_USER"),
-    password=os.getenv("MYSQL_PASSWORD"),
-    database=os.getenv("MYSQL_DATABASE"),
-    port=int(os.getenv("MYSQL_PORT", 3306)),
-    cursorclass=pymysql.cursors.DictCursor,
-    autocommit=True
-)
+# user_service speaks plain HTTP, like the delivery Lambda uses it
+USER_SERVICE_SCHEME = os.getenv("USER_SERVICE_SCHEME", "http")
+
+# Bulk mode: users handled at once (and pooled HTTP connections)
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", 16))
+HTTP_TIMEOUT = float(os.getenv("CLI_HTTP_TIMEOUT", 30))
 
+# Optional bulk file columns, each a JSON option of the subscription
+OPTION_COLUMNS = ("filter", "resources", "result_cache")
+# An option that was not given: the stored one is kept
+KEEP = object()
 
-def register_user(user):
+_connection = None
+
+
+def get_connection():
+    """
+    Returns the DB connection, connecting on first use
+    """
+
+    global _connection
+    if _connection is None:
+        _connection = pymysql.connect(
+            host=os.getenv("MYSQL_HOST"),
+            user=os.getenv("MYSQL_USER"),
+            password=os.getenv("MYSQL_PASSWORD"),
+            database=os.getenv("MYSQL_DATABASE"),
+            port=int(os.getenv("MYSQL_PORT", 3306)),
+            cursorclass=pymysql.cursors.DictCursor,
+            autocommit=True
+        )
+    return _connection
+
+
+def new_session(pool_size=BULK_CONCURRENCY):
+    """
+    Returns an HTTP session keeping up to pool_size connections per host alive
+    """
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def register_user(user, session=requests):
     """
     Registers a new user service via HPC
     """
@@ -33,7 +70,7 @@ def register_user(user):
     }
     data = {"user": user}
 
-    response = requests.post(url, headers=headers, json=data)
+    response = session.post(url, headers=headers, json=data, timeout=HTTP_TIMEOUT)
 
     if response.status_code == 200:
         return response.json()  # returns ip, port, token, queue_url
@@ -41,46 +78,104 @@ def register_user(user):
         raise Exception(f"Failed to register user: {response.text}")
 
 
-async def add_user_to_db(username, ip_port, token, queue_url):
+def add_users_to_db(users):
+    """
+    Adds users to the db in one statement; users are (username, ip_port, token, queue_url) tuples
+    """
+
+    print(f"Adding {len(users)} user(s) to db: {[user[0] for user in users]}")
+    query_user = "INSERT INTO users (username, role, ip_port, token, queue_url) VALUES (%s, 'user', %s, %s, %s)"
+    with get_connection().cursor() as cursor:
+        cursor.executemany(query_user, users)
+
+
+def add_user_to_db(username, ip_port, token, queue_url):
     """
     Adds user to the db
     """
 
-    print(f"Adding user to db, username: {username}, ip_port: {ip_port}, token: {token}, queue_url: {queue_url}")
-    query_user = "INSERT INTO users (username, ip_port, token, queue_url) VALUES ($1, $2, $3, $4)"
-    with connection.cursor() as cursor:
-        cursor.execute(query_user, username, ip_port, token, queue_url)
+    add_users_to_db([(username, ip_port, token, queue_url)])
 
 
-async def get_user_event_details(user, event_type):
+def get_user_event_details(user, event_type):
     """
     Fetches user event from the db
     """
 
     print(f"Fetching user event details for: {user} of event: {event_type}")
-    query_subscriptions = "SELECT * FROM subscriptions WHERE username = $1 AND event_type = $2"
-    with connection.cursor() as cursor:
-        result = cursor.execute(query_subscriptions, user, event_type)
+    query_subscriptions = "SELECT * FROM subscriptions WHERE username = %s AND event_type = %s"
+    with get_connection().cursor() as cursor:
+        cursor.execute(query_subscriptions, (user, event_type))
+        return cursor.fetchone()
 
-    return result[0] if result else None
 
-
-async def get_user_service_details(user):
+def get_user_service_details(user):
     """
     Fetches user's service details from the db
     """
 
     print(f"Fetching user service details for: {user}")
-    query_user = "SELECT * FROM users WHERE username = $1"
-    with connection.cursor() as cursor:
-        result = cursor.execute(query_user, user)
+    query_user = "SELECT * FROM users WHERE username = %s"
+    with get_connection().cursor() as cursor:
+        cursor.execute(query_user, (user,))
+        return cursor.fetchone()
+
+
+def register_new_user(username):
+    """
+    Registers a user via HPC and adds it to the db; returns (ip_port, token)
+    """
+
+    user_service = register_user(username)
+    user_ip, user_port, user_token, queue_url = user_service["ip"], user_service["port"], user_service["token"], user_service["queue_url"]
+    ip_port = f"{user_ip}:{user_port}"
 
-    return result[0] if result else None
+    # Add this user to db - users table
+    add_user_to_db(username, ip_port, user_token, queue_url)
+    return ip_port, user_token
 
 
-def subscribe_event(username, event_type, cmd):
+def user_service_post(ip_port, token, path, data, session=requests):
     """
-    Subscribes an event for a user
+    POSTs JSON to a user's user_service
+    """
+
+    url = f"{USER_SERVICE_SCHEME}://{ip_port}{path}"
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json"
+    }
+    return session.post(url, headers=headers, json=data, timeout=HTTP_TIMEOUT)
+
+
+def canonical_option(expression):
+    """
+    A filter, resources or result cache policy as user_service stores it (compact JSON,
+    sorted keys), or None for none; user_service validates it
+    """
+
+    if isinstance(expression, str):
+        expression = json.loads(expression) if expression.strip() else None
+    if not expression:
+        return None
+    return json.dumps(expression, sort_keys=True, separators=(",", ":"))
+
+
+def request_options(filter_expression, resources, result_cache):
+    """
+    The filter, resources and result_cache of a subscription request, from their
+    stored form (None removes one); KEEP ones are left out, so user_service keeps them
+    """
+
+    options = zip(OPTION_COLUMNS, (filter_expression, resources, result_cache))
+    return {key: json.loads(value or "null") for key, value in options if value is not KEEP}
+
+
+def subscribe_event(username, event_type, cmd, filter_expression=None, resources=None, result_cache=None):
+    """
+    Subscribes an event for a user, optionally only for events matching a filter (JSON),
+    with the resources its command uses (JSON, e.g. '{"cpu_slots": 4, "memory_mb": 8192}')
+    and a result cache policy (JSON, e.g. '{"ttl_seconds": 86400}')
     """
 
     user_event_details = get_user_event_details(username, event_type)
@@ -92,24 +187,15 @@ def subscribe_event(username, event_type, cmd):
 
     # If user does not exist, register them
     if user_service_details is None:
-        user_service = register_user(username)
-        user_ip, user_port, user_token, queue_url = user_service["ip"], user_service["port"], user_service["token"], user_service["queue_url"]
-
-        ip_port = f"{user_ip}:{user_port}"
-
-        # Add this user to db - users table
-        add_user_to_db(username, ip_port, user_token, queue_url)
+        ip_port, user_token = register_new_user(username)
     else:
         ip_port, user_token = user_service_details["ip_port"], user_service_details["token"]
 
-    url = f"https://{ip_port}/subscribe"
-    headers = {
-        "Authorization": f"Bearer {user_token}",
-        "Content-Type": "application/json"
-    }
-    data = {"event_type": event_type, "cmd": cmd}
-
-    response = requests.post(url, headers=headers, json=data)
+    data = {"username": username, "event_type": event_type, "command": cmd,
+            "filter": json.loads(canonical_option(filter_expression) or "null"),
+            "resources": json.loads(canonical_option(resources) or "null"),
+            "result_cache": json.loads(canonical_option(result_cache) or "null")}
+    response = user_service_post(ip_port, user_token, "/subscribe", data)
 
     if response.status_code == 200:
         print(f"Successfully subscribed {username} to {event_type}.")
@@ -118,9 +204,10 @@ def subscribe_event(username, event_type, cmd):
         raise Exception(f"Failed to subscribe user: {response.text}")
 
 
-def edit_event(username, event_type, cmd):
+def edit_event(username, event_type, cmd, filter_expression=None, resources=None, result_cache=None):
     """
-    Edits an event for a user
+    Edits an event for a user. A filter, resources or result cache policy that is
+    given replaces the stored one ('null' removes it); None keeps it
     """
 
     user_event_details = get_user_event_details(username, event_type)
@@ -131,14 +218,11 @@ def edit_event(username, event_type, cmd):
     user_service_details = get_user_service_details(username)
     ip_port, token = user_service_details["ip_port"], user_service_details["token"]
 
-    url = f"https://{ip_port}/subscribe"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-    data = {"event_type": event_type, "cmd": cmd}
-
-    response = requests.post(url, headers=headers, json=data)
+    data = {"username": username, "event_type": event_type, "command": cmd, **request_options(
+        KEEP if filter_expression is None else canonical_option(filter_expression),
+        KEEP if resources is None else canonical_option(resources),
+        KEEP if result_cache is None else canonical_option(result_cache))}
+    response = user_service_post(ip_port, token, "/subscribe", data)
 
     if response.status_code == 200:
         print(f"Successfully updated {username} subscription to {event_type}.")
@@ -159,14 +243,8 @@ def unsubscribe_event(username, event_type):
     user_service_details = get_user_service_details(username)
     ip_port, token = user_service_details["ip_port"], user_service_details["token"]
 
-    url = f"https://{ip_port}/unsubscribe"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-    data = {"event_type": event_type}
-
-    response = requests.post(url, headers=headers, json=data)
+    data = {"username": username, "event_type": event_type}
+    response = user_service_post(ip_port, token, "/unsubscribe", data)
 
     if response.status_code == 200:
         print(f"Successfully unsubscribed {username} from {event_type}.")
@@ -185,12 +263,12 @@ def list_subscriptions(user):
 
     ip_port, token = user_service_details["ip_port"], user_service_details["token"]
 
-    url = f"https://{ip_port}/list-subscriptions"
+    url = f"{USER_SERVICE_SCHEME}://{ip_port}/list-subscriptions"
     headers = {
         "Authorization": f"Bearer {token}"
     }
 
-    response = requests.get(url, headers=headers)
+    response = requests.get(url, headers=headers, params={"username": user}, timeout=HTTP_TIMEOUT)
 
     if response.status_code == 200:
         subscriptions = response.json()
@@ -199,6 +277,176 @@ def list_subscriptions(user):
         raise Exception(f"Failed to fetch subscriptions: {response.text}")
 
 
+def load_rows(path):
+    """
+    Reads (user, event_type, cmd[, filter][, resources][, result_cache]) rows from a CSV file (with a header
+    row) or a YAML list. A filter, resources or result_cache are JSON text in CSV and a mapping or JSON text in YAML;
+    an empty one removes it, and one the file does not have is KEEP (the stored one stays).
+
+    Returns:
+        dict: username -> {event_type: (cmd, filter, resources, result_cache)}
+    """
+
+    with open(path, newline="") as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml  # only needed for YAML input
+            rows = yaml.safe_load(f) or []
+        else:
+            rows = list(csv.DictReader(f))
+
+    desired = {}
+    for number, row in enumerate(rows, start=1):
+        user, event_type, cmd = (str(row.get(key) or "").strip() for key in ("user", "event_type", "cmd"))
+        if not user or not event_type or not cmd:
+            raise Exception(f"Row {number}: user, event_type and cmd are required, got {row}")
+        commands = desired.setdefault(user, {})
+        if event_type in commands:
+            raise Exception(f"Row {number}: duplicate subscription for user: {user} of event: {event_type}")
+        options = []
+        for key in OPTION_COLUMNS:
+            try:
+                options.append(canonical_option(row[key]) if key in row else KEEP)
+            except ValueError as e:
+                raise Exception(f"Row {number}: invalid {key}: {e}")
+        commands[event_type] = (cmd, *options)
+    return desired
+
+
+def fetch_current_state(usernames):
+    """
+    Fetches the users and their subscriptions in one query.
+
+    Returns:
+        tuple: (users, subscriptions) - username -> {"ip_port", "token"} for registered users,
+               and username -> {event_type: (command, filter, resources, result_cache)}
+    """
+
+    usernames = list(usernames)
+    if not usernames:
+        return {}, {}
+    placeholders = ", ".join(["%s"] * len(usernames))
+    query = f"""
+        SELECT u.username, u.ip_port, u.token, s.event_type, s.command, s.filter_expression, s.resources, s.result_cache
+        FROM users u LEFT JOIN subscriptions s ON s.username = u.username
+        WHERE u.username IN ({placeholders})
+    """
+    with get_connection().cursor() as cursor:
+        cursor.execute(query, usernames)
+        rows = cursor.fetchall()
+
+    users, subscriptions = {}, {}
+    for row in rows:
+        users[row["username"]] = {"ip_port": row["ip_port"], "token": row["token"]}
+        commands = subscriptions.setdefault(row["username"], {})
+        if row["event_type"] is not None:
+            commands[row["event_type"]] = (row["command"], row["filter_expression"], row["resources"],
+                                           row["result_cache"])
+    return users, subscriptions
+
+
+def plan_changes(desired, current, prune=False):
+    """
+    Diffs the desired subscriptions against the current ones, comparing only what the file has (not KEEP).
+
+    Args:
+        desired (dict): username -> {event_type: (cmd, filter, resources, result_cache)}, from load_rows
+        current (dict): username -> {event_type: (command, filter, resources, result_cache)}, from fetch_current_state
+        prune (bool): Also remove subscriptions of the listed users that are not in the file
+
+    Returns:
+        dict: username -> {"upserts": [(event_type, cmd, filter, resources, result_cache)], "deletes": [event_type]},
+              only users with changes
+    """
+
+    plan = {}
+    for username, commands in desired.items():
+        existing = current.get(username, {})
+        upserts = [(event_type, *wanted) for event_type, wanted in commands.items()
+                   if _differs(wanted, existing.get(event_type))]
+        deletes = [event_type for event_type in existing if event_type not in commands] if prune else []
+        if upserts or deletes:
+            plan[username] = {"upserts": upserts, "deletes": deletes}
+    return plan
+
+
+def _differs(wanted, stored):
+    """
+    Whether a subscription needs an upsert: it is new, or a value the file has differs
+    """
+
+    return stored is None or any(value is not KEEP and value != current for value, current in zip(wanted, stored))
+
+
+def bulk_apply(path, prune=False, dry_run=False, concurrency=BULK_CONCURRENCY):
+    """
+    Applies a CSV/YAML file of subscriptions: one diff query, then one request
+    (and one DB transaction) per changed user, users handled concurrently.
+
+    Returns:
+        dict: username -> None if applied, else the error
+    """
+
+    desired = load_rows(path)
+    users, current = fetch_current_state(desired)
+    plan = plan_changes(desired, current, prune)
+    new_users = [username for username in plan if username not in users]
+
+    for username, changes in sorted(plan.items()):
+        upserts = ", ".join(upsert[0] for upsert in changes["upserts"]) or "-"
+        deletes = ", ".join(changes["deletes"]) or "-"
+        print(f"{username}{' (new user)' if username in new_users else ''}: upsert [{upserts}] delete [{deletes}]")
+    print(f"{len(plan)} of {len(desired)} user(s) have changes, {len(new_users)} to register.")
+    if dry_run or not plan:
+        return {}
+
+    results = {}
+    with new_session(concurrency) as session, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Register new users concurrently, then add them to the db in one write
+        registered = []
+        for username, outcome in zip(new_users, executor.map(lambda u: _try(register_user, u, session), new_users)):
+            if isinstance(outcome, Exception):
+                results[username] = outcome
+                continue
+            ip_port = f"{outcome['ip']}:{outcome['port']}"
+            users[username] = {"ip_port": ip_port, "token": outcome["token"]}
+            registered.append((username, ip_port, outcome["token"], outcome["queue_url"]))
+        if registered:
+            add_users_to_db(registered)
+
+        def apply_user(username):
+            user, changes = users[username], plan[username]
+            data = {
+                "username": username,
+                "upserts": [{"event_type": event_type, "command": cmd, **request_options(*options)}
+                            for event_type, cmd, *options in changes["upserts"]],
+                "deletes": changes["deletes"],
+            }
+            response = user_service_post(user["ip_port"], user["token"], "/subscriptions/bulk", data, session)
+            if response.status_code != 200:
+                raise Exception(f"Failed to update subscriptions: {response.text}")
+
+        pending = [username for username in plan if username in users]
+        for username, outcome in zip(pending, executor.map(lambda u: _try(apply_user, u), pending)):
+            results[username] = outcome
+
+    failed = {username: error for username, error in results.items() if error is not None}
+    for username, error in sorted(failed.items()):
+        print(f"Failed for {username}: {error}")
+    print(f"Applied changes for {len(results) - len(failed)} user(s), {len(failed)} failed.")
+    return results
+
+
+def _try(func, *args):
+    """
+    Calls func and returns its result, or the exception it raised
+    """
+
+    try:
+        return func(*args)
+    except Exception as e:
+        return e
+
+
 if __name__ == "__main__":
     """
     CLI Execution
@@ -207,14 +455,25 @@ if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="Subscribe, Unsubscribe, Edit, or Get Info on event subscriptions.")
-    parser.add_argument("action", choices=["subscribe", "unsubscribe", "edit", "info"], help="Action to perform")
-    parser.add_argument("user", help="Username")
+    parser.add_argument("action", choices=["subscribe", "unsubscribe", "edit", "info", "bulk"], help="Action to perform")
+    parser.add_argument("user", nargs="?", help="Username (not used by bulk)")
     parser.add_argument("--event_type", help="Event type (Required for subscribe, unsubscribe, edit)", required=False)
     parser.add_argument("--cmd", help="Command to execute for the event (Required for subscribe/edit)", required=False)
+    parser.add_argument("--filter", help="JSON filter on event fields, e.g. '{\"strategy\": \"s1\"}' (subscribe/edit; edit keeps the current one unless given, 'null' removes it)", required=False)
+    parser.add_argument("--resources", help="JSON resources of the command, e.g. '{\"cpu_slots\": 4, \"memory_mb\": 8192, \"priority\": 1}' (subscribe/edit, as --filter)", required=False)
+    parser.add_argument("--result-cache", help="JSON result cache policy of a deterministic command, e.g. '{\"ttl_seconds\": 86400, \"inputs\": [\"/data/<date>.csv\"]}' (subscribe/edit, as --filter)", required=False)
+    parser.add_argument("--file", help="CSV or YAML of user, event_type, cmd rows (Required for bulk)", required=False)
+    parser.add_argument("--prune", action="store_true", help="bulk: remove listed users' subscriptions missing from the file")
+    parser.add_argument("--dry-run", action="store_true", help="bulk: print the changes without applying them")
+    parser.add_argument("--concurrency", type=int, default=BULK_CONCURRENCY, help="bulk: users handled at once")
 
     args = parser.parse_args()
 
-    if not args.user:
+    if args.action == "bulk":
+        if not args.file:
+            print("Error: --file is required for action: bulk")
+            exit(1)
+    elif not args.user:
         print("Error: User is required.")
         exit(1)
 
@@ -228,11 +487,11 @@ if __name__ == "__main__":
 
     try:
         if args.action in ["subscribe"]:
-            subscribe_event(args.user, args.event_type, args.cmd)
+            subscribe_event(args.user, args.event_type, args.cmd, args.filter, args.resources, args.result_cache)
             print(f"\nSubscribed Successfully!")
 
         elif args.action == "edit":
-            edit_event(args.user, args.event_type, args.cmd)
+            edit_event(args.user, args.event_type, args.cmd, args.filter, args.resources, args.result_cache)
             print(f"\nEdited Successfully!")
 
         elif args.action == "unsubscribe":
@@ -242,6 +501,10 @@ if __name__ == "__main__":
         elif args.action == "info":
             list_subscriptions(args.user)
 
+        elif args.action == "bulk":
+            results = bulk_apply(args.file, args.prune, args.dry_run, args.concurrency)
+            if any(error is not None for error in results.values()):
+                exit(1)
+
     except Exception as e:
         print(f"Error trying to perform action: {args.action} error: {e}")
-
@@ -1,5 +1,7 @@
+import uuid
+from typing import Optional
 from fastapi import FastAPI, HTTPException
-from fastapi import Depends
+from fastapi import Depends, Header
 from ..models import *
 from ..services.event_service import EventService
 
@@ -24,22 +26,30 @@ async def health_check():
 
 
 @app.post("/events/")
-async def create_event(event: BaseEvent, event_service: EventService = Depends(get_event_service)):
+async def create_event(event: BaseEvent, event_service: EventService = Depends(get_event_service),
+                       x_trace_id: Optional[str] = Header(None),
+                       idempotency_key: Optional[str] = Header(None, max_length=128)):
     """
     Endpoint to receive events.
+
+    Assigns the trace ID (or keeps the caller's X-Trace-Id) that follows the event
+    through fan-out, delivery and command execution, and returns it. An
+    Idempotency-Key header overrides the key computed from the event, e.g. to
+    deliberately re-run an event that was already sent.
     """
+    trace_id = x_trace_id or uuid.uuid4().hex
     # event_type = event.event_type
     # event_model = EVENT_TYPE_MAPPING.get(event_type)
 
     # if event_model:
-    print("Event input", event)
+    print("Event input", event, "trace_id", trace_id)
 
     # if event_service.process_event(event):
     #     return {"message": "Event received and processed"}
     # else:
     #     raise HTTPException(status_code=500, detail="Event processing failed")
     try:
-        event_service.process_event(event)
-        return {"message": "Event received and processed"}
+        event_service.process_event(event, trace_id, idempotency_key)
+        return {"message": "Event received and processed", "trace_id": trace_id}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -9,6 +10,9 @@ AWS_REGION = os.environ.get("AWS_REGION", "ap-south-1")
 SQS_QUEUE_URL = os.environ.get("SQS_QUEUE_URL", "https://sqs.ap-south-1.amazonaws.com/428590250375/Testing.fifo")
 EVENT_NETTING_SERVICE_URL = os.environ.get("EVENT_NETTING_SERVICE_URL", "http://localhost:8000/netting/")
 EVENT_NETTING_REQUIRED = os.environ.get("EVENT_NETTING_REQUIRED", "False").lower() == "true"  # Default to False if not set
+# Fields that identify a distinct event, per event type, e.g. {"event_a": ["strategy", "date"]}.
+# Event types not listed are keyed on the whole event minus its timestamp.
+IDEMPOTENCY_KEY_FIELDS = json.loads(os.environ.get("IDEMPOTENCY_KEY_FIELDS", "{}"))
 
 # Check for required variables
 # required_vars = ["AWS_REGION", "SQS_QUEUE_URL"]
@@ -3,7 +3,9 @@ import json
 import requests
 from ..config import AWS_REGION, SQS_QUEUE_URL, EVENT_NETTING_SERVICE_URL, EVENT_NETTING_REQUIRED
 from ..models import BaseEvent
-import hashlib
+from .idempotency import idempotency_key as compute_idempotency_key
+import time
+import uuid
 
 class EventService:
     """
@@ -15,14 +17,21 @@ class EventService:
             "sqs", AWS_REGION
         )
 
-    def send_to_sqs(self, event_data: BaseEvent):
+    def send_to_sqs(self, event_data: BaseEvent, trace_id: str = None, idempotency_key: str = None):
         """
         Sends an event to the SQS queue.
+
+        The trace ID and the ingest timestamp travel as message attributes, so
+        every later hop (fan-out, delivery, command execution) can be correlated.
+        The idempotency key (the caller's, or one computed from the event's key
+        fields) is the deduplication ID here and travels along the same way.
         """
+        trace_id = trace_id or uuid.uuid4().hex
         try:
             # Create a JSON-serializable version of the event data
             event_json = event_data.model_dump()
             event_json["timestamp"] = event_json["timestamp"].isoformat()
+            idempotency_key = idempotency_key or compute_idempotency_key(event_json)
             
             message_body = json.dumps(event_json)
             
@@ -30,9 +39,14 @@ class EventService:
                 QueueUrl=SQS_QUEUE_URL,
                 MessageBody=message_body,
                 MessageGroupId=event_data.event_type,
-                MessageDeduplicationId=hashlib.md5(json.dumps(event_json, sort_keys=True).encode('utf-8')).hexdigest()
+                MessageDeduplicationId=idempotency_key,
+                MessageAttributes={
+                    "trace_id": {"DataType": "String", "StringValue": trace_id},
+                    "trace_hops": {"DataType": "String", "StringValue": f"ingest={int(time.time() * 1000)}"},
+                    "idempotency_key": {"DataType": "String", "StringValue": idempotency_key},
+                },
             )
-            print(f"Sent event to SQS: {response['MessageId']}")
+            print(f"Sent event to SQS: {response['MessageId']} trace_id: {trace_id} idempotency_key: {idempotency_key}")
             return True
         except Exception as e:
             print(f"Error sending to SQS: {e}")
@@ -56,12 +70,12 @@ class EventService:
             print(f"Error sending to event netting service: {e}")
             return False
 
-    def process_event(self, event: BaseEvent):
+    def process_event(self, event: BaseEvent, trace_id: str = None, idempotency_key: str = None):
         """
         Processes an event: sends it to SQS and optionally to the event netting service.
         """
         print(f"Processing event: {event.event_type}")
-        sqs_success = self.send_to_sqs(event)
+        sqs_success = self.send_to_sqs(event, trace_id, idempotency_key)
 
         if EVENT_NETTING_REQUIRED:
             netting_success = self.send_to_event_netting(event)
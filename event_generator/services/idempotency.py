@@ -0,0 +1,28 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+from ..config import IDEMPOTENCY_KEY_FIELDS
+
+# Set at ingest, never part of an event's identity
+VOLATILE_FIELDS = ("timestamp",)
+
+
+def idempotency_key(event_json: Dict[str, Any], key_fields: Optional[Dict[str, List[str]]] = None) -> str:
+    """
+    The idempotency key of an event: events with the same key are the same event.
+
+    The key hashes the event type and the fields declared for it in
+    IDEMPOTENCY_KEY_FIELDS (missing fields count as null), or the whole event
+    without its timestamp when nothing is declared. It doubles as the SQS
+    MessageDeduplicationId, so it stays within the 128 character limit.
+    """
+    key_fields = IDEMPOTENCY_KEY_FIELDS if key_fields is None else key_fields
+    event_type = event_json.get("event_type")
+    fields = key_fields.get(event_type)
+    if fields:
+        identity = {field: event_json.get(field) for field in fields}
+    else:
+        identity = {k: v for k, v in event_json.items() if k not in VOLATILE_FIELDS}
+    identity["event_type"] = event_type
+    canonical = json.dumps(identity, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
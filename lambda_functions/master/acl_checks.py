@@ -1,14 +1,21 @@
+import functools
 import json
+import os
 
-STRATEGY_JSON_FILEPATH = "all_strategy_details.json"
-with open(STRATEGY_JSON_FILEPATH) as f:
-    strategy_data = json.load(f)
+STRATEGY_JSON_FILEPATH = os.getenv("STRATEGY_JSON_FILEPATH", "all_strategy_details.json")
+
+
+@functools.lru_cache(maxsize=None)
+def strategy_data():
+    """The strategy details, read on first use (not at import) and kept for the container."""
+    with open(STRATEGY_JSON_FILEPATH) as f:
+        return json.load(f)
 
 def admin_tag_check(username: str, event_json) -> bool:
     if "strategy" not in event_json:
         return False
     strategy = event_json['strategy']
-    strat_details = strategy_data[strategy]
+    strat_details = strategy_data()[strategy]
     strategy_users = strat_details.get("users", {})
     # print(strategy_users, username)
     if strategy_users:
@@ -1,8 +1,46 @@
-import pymysql
 import os
-from dotenv import load_dotenv
+import threading
+from instrumentation import logger, metrics
+from filters import FilterIndex
+
+# A function's configuration is its environment; outside Lambda, MYSQL_* may come from a .env file
+if not os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# None: pymysql.connect. pymysql is imported on first connect, so invocations that
+# never query MySQL (e.g. routed from the routing snapshot) do not load it.
+_connection_factory = None
+_local = threading.local()
+
+
+def _pymysql():
+    import pymysql
+    return pymysql
+
+
+def set_connection_factory(factory):
+    """
+    Open connections through factory instead of pymysql.connect.
+
+    Used by local_stack to back the Lambda with SQLite. Pass None to restore pymysql.
+    """
+    global _connection_factory
+    _connection_factory = factory
+
+
+def shared() -> "Database":
+    """
+    The Database of the calling thread, kept open across warm invocations.
+
+    Lambda runs one invocation at a time per container; the local harness runs
+    several pollers in one process, hence one per thread.
+    """
+    db = getattr(_local, "db", None)
+    if db is None:
+        db = _local.db = Database()
+    return db
 
-load_dotenv()
 
 class Database:
     """Asynchronous MySQL DB Handler."""
@@ -11,8 +49,28 @@ class Database:
         self.connection = None
 
     def init(self):
-        """Initialize MySQL connection."""
-        self.connection = pymysql.connect(
+        """
+        Prepare the MySQL connection for an invocation. It is opened on first query,
+        so invocations routed from the routing snapshot never connect; a connection
+        kept from an earlier invocation is pinged (and reopened if it dropped).
+        """
+        if self.connection is not None:
+            try:
+                self.connection.ping(reconnect=True)
+            except Exception as e:
+                logger.warning("Dropping stale MySQL connection: %s", e)
+                self.close()
+
+    def _cursor(self):
+        if self.connection is None:
+            self._connect()
+        return self.connection.cursor()
+
+    def _connect(self):
+        """Open the MySQL connection."""
+        pymysql = _pymysql()
+        metrics.incr("db_connects")
+        self.connection = (_connection_factory or pymysql.connect)(
             host=os.getenv('MYSQL_HOST'),
             user=os.getenv('MYSQL_USER'),
             password=os.getenv('MYSQL_PASSWORD'),
@@ -26,6 +84,7 @@ class Database:
             autocommit=True
         )
 
+    @metrics.timed("db.get_event_acl_functions")
     def get_event_acl_functions(self, event_type: str):
         """Fetch all access check functions for given event_type."""
         query = """
@@ -34,44 +93,45 @@ class Database:
         JOIN event_acl_mapping e ON f.function_name = e.function_name
         WHERE event_type = %s
         """
-        with self.connection.cursor() as cursor:
+        with self._cursor() as cursor:
             cursor.execute(query, (event_type,))
             functions = cursor.fetchall()
             return functions
 
-    def get_subscribers(self, event_type: str):
-        """Fetch all users who have subscribed to event_type."""
+    @metrics.timed("db.get_subscriber_index")
+    def get_subscriber_index(self, event_type: str) -> FilterIndex:
+        """Fetch the subscribers of event_type with their filters, indexed for matching events."""
         query = """
-        SELECT username
+        SELECT username, filter_expression
         FROM subscriptions
         WHERE event_type = %s
         """
-        with self.connection.cursor() as cursor:
+        with self._cursor() as cursor:
             cursor.execute(query, (event_type,))
             rows = cursor.fetchall()
-            usernames = [row['username'] for row in rows]
-            return usernames
+            return FilterIndex((row['username'], row['filter_expression']) for row in rows)
 
-    def get_user_queue_url(self, username: str):
-        """Fetch queue URL for a given username."""
-        query = """
-        SELECT queue_url
+    @metrics.timed("db.get_user_queue_urls")
+    def get_user_queue_urls(self, usernames):
+        """Fetch the queue URLs of several users in one query: username -> queue_url."""
+        usernames = list(usernames)
+        if not usernames:
+            return {}
+        placeholders = ", ".join(["%s"] * len(usernames))
+        query = f"""
+        SELECT username, queue_url
         FROM users
-        WHERE username = %s
+        WHERE username IN ({placeholders})
         """
-        with self.connection.cursor() as cursor:
-            cursor.execute(query, (username,))
-            rows = cursor.fetchall()
-
-            if len(rows) == 1:
-                return rows[0]['queue_url']
-            elif len(rows) > 1:
-                raise Exception(f"Multiple entries found for {username}")
-            else:
-                return None
+        with self._cursor() as cursor:
+            cursor.execute(query, usernames)
+            return {row['username']: row['queue_url'] for row in cursor.fetchall()}
 
     def close(self):
         """Close MySQL connection."""
         if self.connection:
-            self.connection.close()
+            try:
+                self.connection.close()
+            finally:
+                self.connection = None
 
@@ -0,0 +1,135 @@
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from instrumentation import logger
+
+# Subscription filters: a JSON object of payload field -> condition, all of which must hold.
+#   {"strategy": "s1"}                          equality (short for {"eq": "s1"})
+#   {"exchange": {"in": ["NSE", "BSE"]}}        membership
+#   {"symbol": {"prefix": "NIFTY"}}             string prefix
+# A subscription without a filter receives every event of its event_type.
+OPERATORS = ("eq", "in", "prefix")
+
+Conditions = Dict[str, Tuple[str, Any]]
+
+
+def _scalar(value) -> bool:
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+def parse_filter(expression) -> Optional[Conditions]:
+    """
+    Validates a filter (JSON text or an already decoded object).
+
+    Returns:
+        dict: field -> (operator, operand), or None for "no filter"
+
+    Raises:
+        ValueError: If the filter is malformed
+    """
+    if expression is None or expression == "" or expression == {}:
+        return None
+    if isinstance(expression, str):
+        expression = json.loads(expression)
+    if not isinstance(expression, dict):
+        raise ValueError("a filter is a JSON object of field conditions")
+    conditions = {}
+    for field, condition in expression.items():
+        if not isinstance(condition, dict):
+            condition = {"eq": condition}
+        if len(condition) != 1 or next(iter(condition)) not in OPERATORS:
+            raise ValueError(f"{field}: expected one of {', '.join(OPERATORS)}")
+        (operator, operand), = condition.items()
+        if operator == "eq" and not _scalar(operand):
+            raise ValueError(f"{field}: eq takes a string, number, boolean or null")
+        if operator == "in":
+            if not isinstance(operand, list) or not operand or not all(_scalar(v) for v in operand):
+                raise ValueError(f"{field}: in takes a non-empty list of scalars")
+            operand = frozenset(operand)
+        if operator == "prefix" and not (isinstance(operand, str) and operand):
+            raise ValueError(f"{field}: prefix takes a non-empty string")
+        conditions[field] = (operator, operand)
+    return conditions
+
+
+def _holds(condition: Tuple[str, Any], value) -> bool:
+    operator, operand = condition
+    if operator == "eq":
+        return value == operand
+    if operator == "in":
+        return _scalar(value) and value in operand
+    return isinstance(value, str) and value.startswith(operand)
+
+
+def matches(conditions: Optional[Conditions], event: Dict[str, Any]) -> bool:
+    """Whether an event satisfies every condition (an absent field satisfies none)."""
+    if not conditions:
+        return True
+    return all(field in event and _holds(condition, event[field]) for field, condition in conditions.items())
+
+
+class FilterIndex:
+    """
+    The subscribers of one event type, indexed by their filters.
+
+    Each filter is indexed under one of its conditions: equality and membership
+    under (field, value), prefixes under field -> prefix. Matching an event looks
+    up its field values, adds the unfiltered subscribers, and checks the rest of
+    the conditions only for the candidates found, so the cost follows the
+    matching subscribers rather than all of them.
+    """
+
+    __slots__ = ("unfiltered", "filters", "exact", "exact_fields", "prefixes", "prefix_lengths", "order")
+
+    def __init__(self, subscribers: Iterable[Tuple[str, Optional[str]]]):
+        self.unfiltered: List[str] = []
+        self.filters: Dict[str, Conditions] = {}
+        self.exact: Dict[Tuple[str, Any], set] = {}
+        self.exact_fields: set = set()
+        self.prefixes: Dict[str, Dict[str, set]] = {}
+        self.prefix_lengths: Dict[str, List[int]] = {}
+        self.order: Dict[str, int] = {}
+        for username, expression in subscribers:
+            self.order[username] = len(self.order)
+            try:
+                conditions = parse_filter(expression)
+            except ValueError as e:
+                # Deliver rather than silently drop events for a filter that no longer parses
+                logger.warning("Ignoring invalid filter of %s: %s", username, e)
+                conditions = None
+            if not conditions:
+                self.unfiltered.append(username)
+                continue
+            self.filters[username] = conditions
+            # Prefer an exact condition as the index key: its lookup is a single dict hit
+            field, (operator, operand) = min(conditions.items(), key=lambda item: item[1][0] == "prefix")
+            if operator == "prefix":
+                self.prefixes.setdefault(field, {}).setdefault(operand, set()).add(username)
+                self.prefix_lengths[field] = sorted({len(prefix) for prefix in self.prefixes[field]})
+                continue
+            self.exact_fields.add(field)
+            for value in (operand if operator == "in" else (operand,)):
+                self.exact.setdefault((field, value), set()).add(username)
+
+    def match(self, event: Dict[str, Any]) -> List[str]:
+        """The subscribers whose filters the event satisfies, in subscription order."""
+        if not self.filters:
+            return list(self.unfiltered)
+        candidates = set()
+        for field in self.exact_fields:
+            value = event.get(field)
+            if field in event and _scalar(value):
+                candidates.update(self.exact.get((field, value), ()))
+        for field, by_prefix in self.prefixes.items():
+            value = event.get(field)
+            if isinstance(value, str):
+                # One lookup per distinct prefix length, however many subscribers share it
+                for length in self.prefix_lengths[field]:
+                    if length > len(value):
+                        break
+                    candidates.update(by_prefix.get(value[:length], ()))
+        matched = self.unfiltered + [u for u in candidates if matches(self.filters[u], event)]
+        matched.sort(key=self.order.__getitem__)
+        return matched
+
+    def __len__(self):
+        return len(self.order)
@@ -0,0 +1,110 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Payload dumps are logged at DEBUG, so the default level keeps them out of CloudWatch
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "EventHandlingService")
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# CloudWatch accepts at most 100 values per metric in one EMF document
+MAX_VALUES_PER_METRIC = 100
+
+logger = logging.getLogger("event_handling")
+logger.setLevel(LOG_LEVEL)
+if not logging.getLogger().handlers:
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s")
+
+
+class Metrics:
+    """
+    Counters and timings for one Lambda invocation, emitted as CloudWatch EMF.
+
+    Timings are recorded in milliseconds with `timer()` / `timed()`, counters
+    with `incr()` and point-in-time values (the last one wins) with `gauge()`.
+    `flush()` prints a single Embedded Metric Format line, which CloudWatch turns
+    into metrics without any API calls, and resets the state.
+    """
+
+    def __init__(self, namespace: str, dimensions: Dict[str, str]):
+        self.namespace = namespace
+        self.dimensions = dict(dimensions)
+        self._counters: Dict[str, float] = {}
+        self._timings: Dict[str, List[float]] = {}
+        self._gauges: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value_ms: float):
+        with self._lock:
+            values = self._timings.setdefault(name, [])
+            if len(values) < MAX_VALUES_PER_METRIC:
+                values.append(round(value_ms, 3))
+
+    def gauge(self, name: str, value: float, unit: str = "None"):
+        with self._lock:
+            self._gauges[name] = (round(value, 3), unit)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Time the enclosed block as `name` (milliseconds)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000.0)
+
+    def timed(self, name: str):
+        """Decorator form of timer()."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def emf(self, timestamp_ms: Optional[int] = None) -> Dict:
+        """Build the EMF document for everything recorded since the last flush."""
+        with self._lock:
+            definitions = [{"Name": name, "Unit": "Milliseconds"} for name in self._timings]
+            definitions += [{"Name": name, "Unit": "Count"} for name in self._counters]
+            definitions += [{"Name": name, "Unit": unit} for name, (_, unit) in self._gauges.items()]
+            document = {
+                "_aws": {
+                    "Timestamp": timestamp_ms or int(time.time() * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": self.namespace,
+                        "Dimensions": [list(self.dimensions)],
+                        "Metrics": definitions,
+                    }],
+                },
+                **self.dimensions,
+            }
+            document.update({name: values for name, values in self._timings.items()})
+            document.update(self._counters)
+            document.update({name: value for name, (value, _) in self._gauges.items()})
+        return document
+
+    def flush(self):
+        """Print the EMF line (if anything was recorded) and reset."""
+        if METRICS_ENABLED and (self._timings or self._counters or self._gauges):
+            print(json.dumps(self.emf()))
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+            self._gauges.clear()
+
+
+metrics = Metrics(METRICS_NAMESPACE, {"Service": "master"})
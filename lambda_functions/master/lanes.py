@@ -0,0 +1,74 @@
+import hashlib
+import os
+import zlib
+from typing import Any, Dict
+
+# How fan-out messages are grouped in the user FIFO queues. Messages in one group
+# are delivered strictly in order, different groups in parallel:
+#   user             - one group per user (every event of a user is serialized)
+#   user_event_type  - one group per (user, event_type)
+#   user_strategy    - one group per (user, strategy)
+#   sharded          - event types hashed into MESSAGE_GROUP_SHARDS groups per user
+MESSAGE_GROUP_STRATEGY = os.getenv("MESSAGE_GROUP_STRATEGY", "user")
+MESSAGE_GROUP_SHARDS = int(os.getenv("MESSAGE_GROUP_SHARDS", 8))
+
+# Priority lanes: high-priority events go to a second queue per user, "<name>-high.fifo"
+PRIORITY_LANES = os.getenv("PRIORITY_LANES", "false").lower() == "true"
+HIGH_PRIORITY_EVENT_TYPES = frozenset(t.strip() for t in os.getenv("HIGH_PRIORITY_EVENT_TYPES", "").split(",") if t.strip())
+# High-lane messages the user-queue Lambda serves per low-lane message
+HIGH_LANE_WEIGHT = int(os.getenv("HIGH_LANE_WEIGHT", 3))
+
+HIGH = "high"
+LOW = "low"
+HIGH_LANE_SUFFIX = "-high"
+
+# SQS limit on MessageGroupId length
+MAX_GROUP_ID_LENGTH = 128
+
+
+def message_group_id(username: str, event_data: Dict[str, Any], strategy: str = MESSAGE_GROUP_STRATEGY) -> str:
+    """
+    The FIFO MessageGroupId of an event in a user's queue.
+
+    Raises:
+        ValueError: For an unknown strategy
+    """
+    if strategy == "user":
+        group_id = username
+    elif strategy == "user_event_type":
+        group_id = f"{username}:{event_data.get('event_type')}"
+    elif strategy == "user_strategy":
+        group_id = f"{username}:{event_data.get('strategy')}"
+    elif strategy == "sharded":
+        shard = zlib.crc32(str(event_data.get("event_type")).encode("utf-8")) % MESSAGE_GROUP_SHARDS
+        group_id = f"{username}:{shard}"
+    else:
+        raise ValueError(f"Unknown MESSAGE_GROUP_STRATEGY: {strategy}")
+    if len(group_id) > MAX_GROUP_ID_LENGTH:
+        group_id = hashlib.sha256(group_id.encode("utf-8")).hexdigest()
+    return group_id
+
+
+def event_priority(event_data: Dict[str, Any]) -> str:
+    """HIGH for events marked "priority": "high" or of a HIGH_PRIORITY_EVENT_TYPES type."""
+    if event_data.get("priority") == HIGH or event_data.get("event_type") in HIGH_PRIORITY_EVENT_TYPES:
+        return HIGH
+    return LOW
+
+
+def lane_queue_url(queue_url: str, priority: str) -> str:
+    """The user's queue for the priority lane ("<name>.fifo" -> "<name>-high.fifo")."""
+    if not PRIORITY_LANES or priority != HIGH or is_high_lane(queue_url):
+        return queue_url
+    return queue_url[:-len(".fifo")] + HIGH_LANE_SUFFIX + ".fifo"
+
+
+def is_high_lane(queue_url: str) -> bool:
+    return queue_url.endswith(HIGH_LANE_SUFFIX + ".fifo")
+
+
+def base_queue_url(queue_url: str) -> str:
+    """The user's low-lane queue URL, as stored in the users table."""
+    if is_high_lane(queue_url):
+        return queue_url[:-len(HIGH_LANE_SUFFIX + ".fifo")] + ".fifo"
+    return queue_url
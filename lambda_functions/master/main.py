@@ -1,10 +1,14 @@
 import asyncio
 import json
-from db import Database
+import db as database
 from processor import process_event
 from sqs_service import SQSService
+from instrumentation import logger, metrics
+from budget import Budget
+from records import process_records
+from sqs_record import SQSRecord
 
-async def main(event_json):
+async def main(event_json, context=None):
     """
     event_json example:
     {
@@ -12,10 +16,7 @@ async def main(event_json):
         {
           "messageId": "19dd0b57-b21e-4ac1-bd88-01bbb068cb78",
           "receiptHandle": "MessageReceiptHandle",
-          "body": {
-            "event_type": "test2"
-            "strategy": "test_strat_ut"
-           },
+          "body": "{\\"event_type\\": \\"test2\\", \\"strategy\\": \\"test_strat_ut\\"}",
           "attributes": {
             "ApproximateReceiveCount": "1",
             "SentTimestamp": "1523232000000",
@@ -30,18 +31,31 @@ async def main(event_json):
         }
       ]
     }
+
+    Records are processed concurrently (in order within a FIFO message group); returns
+    the messageIds of the records that failed, which stay in the queue. With the Lambda
+    context, records that no longer fit in the remaining time are not started: they
+    are released (visible again right away) and returned with the failed ones.
     """
-    # Setup DB connection
-    db = Database()
+    # The container's DB connection, kept across warm invocations
+    db = database.shared()
     db.init()
 
-    try:
-        for record in event_json['Records']:
+    async def handle(record):
+        with metrics.timer("record"):
             await process_event(record, db)
-            # delete record from queue
-            delete_record_from_queue(record)
-    finally:
-        db.close()
+        metrics.incr("records")
+        # delete record from queue
+        await asyncio.get_running_loop().run_in_executor(None, delete_record_from_queue, record)
+
+    records = [SQSRecord(record) for record in event_json['Records']]
+    budget = Budget(context)
+    failed = await process_records(records, handle, budget=budget)
+    if budget.left:
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(None, release_record, record) for record in budget.left))
+    budget.report(len(records))
+    return failed
 
 
 def delete_record_from_queue(record):
@@ -56,7 +70,13 @@ def delete_record_from_queue(record):
     try:
         sqs_service.delete_message(receipt_handle)
     except Exception as e:
-        print(f"Error deleting message: {str(e)}")
+        logger.error("Error deleting message: %s", e, exc_info=True)
+
+
+def release_record(record):
+    """ makes a record left for a later invocation visible again now, rather than after its visibility timeout """
+    sqs_service = SQSService(queue_url=get_queue_url(record['eventSourceARN']), region_name="us-east-1")
+    sqs_service.change_visibility(record['receiptHandle'], 0)
 
 
 def get_queue_url(queue_arn):
@@ -68,12 +88,12 @@ def get_queue_url(queue_arn):
     # Construct queue URL
     queue_url = f"https://sqs.{region}.amazonaws.com/{account_id}/{queue_name}"
 
-    print(f"Queue URL: {queue_url}")
+    logger.debug("Queue URL: %s", queue_url)
     return queue_url
 
 
 # Synchronous wrapper
-def run_main(event_json):
-    asyncio.run(main(event_json))
+def run_main(event_json, context=None):
+    return asyncio.run(main(event_json, context))
 
 
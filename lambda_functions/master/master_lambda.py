@@ -1,5 +1,9 @@
-import json
+import os
+import routing
+import startup
+from instrumentation import logger, metrics
 from main import run_main
+from sqs_service import get_sqs_client
 
 def lambda_handler(event, context):
     """
@@ -9,10 +13,7 @@ def lambda_handler(event, context):
         {
           "messageId": "19dd0b57-b21e-4ac1-bd88-01bbb068cb78",
           "receiptHandle": "MessageReceiptHandle",
-          "body": {
-            "event_type": "test2"
-            "strategy": "test_strat_ut"
-           },
+          "body": "{\\"event_type\\": \\"test2\\", \\"strategy\\": \\"test_strat_ut\\"}",
           "attributes": {
             "ApproximateReceiveCount": "1",
             "SentTimestamp": "1523232000000",
@@ -28,11 +29,33 @@ def lambda_handler(event, context):
       ]
     }
     """
-    print(event)
-    run_main(event)
-    
+    logger.debug("event: %s", event)
+    try:
+        with metrics.timer("invocation"):
+            failed = run_main(event, context)
+    finally:
+        metrics.flush()
+
+    # Only the failed records are redelivered (needs ReportBatchItemFailures on the mapping)
     return {
         'statusCode': 200,
-        'body': 'Messages processed successfully.'
+        'body': 'Messages processed successfully.',
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed],
     }
 
+
+def prime():
+    """Cold-start work, done at init: the SQS client, the routing snapshot and the ACL strategy data."""
+    import acl_checks
+    get_sqs_client()
+    routing.current()
+    if os.path.exists(acl_checks.STRATEGY_JSON_FILEPATH):
+        acl_checks.strategy_data()
+
+
+def restore():
+    # The snapshot's routing table may be old by now: check the version marker on the next event
+    routing.expire()
+
+
+startup.register(prime, restore)
@@ -1,10 +1,23 @@
+import asyncio
+import functools
 import importlib
-import traceback
+import os
+from concurrent.futures import ThreadPoolExecutor
 from db import Database
-from typing import Dict, Any, List
 from sqs_service import SQSService
+from instrumentation import logger, metrics
+from tracing import add_hop, trace_attributes, trace_from_record
+from idempotency import idempotency_attributes, idempotency_key_from_record
+from failures import forwarded_attributes, handle_failure, retry_attempt, retry_destination
+from lanes import HIGH, event_priority, lane_queue_url, message_group_id
+from sqs_record import SQSRecord
+import routing
 
-async def process_event(event_json: Dict[str, Any], db: Database):
+# SQS sends of one event's fan-out in flight at once (boto3 clients are thread-safe)
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", 16))
+_fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_CONCURRENCY, thread_name_prefix="fanout")
+
+async def process_event(event_json: SQSRecord, db: Database):
     """
     Main processor to filter authorized users based on event and strategy JSON.
     {
@@ -12,10 +25,7 @@ async def process_event(event_json: Dict[str, Any], db: Database):
         {
           "messageId": "19dd0b57-b21e-4ac1-bd88-01bbb068cb78",
           "receiptHandle": "MessageReceiptHandle",
-          "body": {
-            "event_type": "test2"
-            "strategy": "test_strat_ut"
-           },
+          "body": "{\\"event_type\\": \\"test2\\", \\"strategy\\": \\"test_strat_ut\\"}",
           "attributes": {
             "ApproximateReceiveCount": "1",
             "SentTimestamp": "1523232000000",
@@ -31,64 +41,139 @@ async def process_event(event_json: Dict[str, Any], db: Database):
       ]
     }
 
+
+    The body is parsed once (event_json.body) and forwarded as the text it arrived in.
     """
-    event_data = event_json["body"]
+    event_data = event_json.body
+    if not isinstance(event_data, dict):
+        raise ValueError("event body is not a JSON object")
     event_type = event_data.get("event_type")
     if not event_type:
         raise ValueError("event_type missing in event data")
 
-    # Fetch users who have subscribed to the event
-    subscribers = db.get_subscribers(event_type)
-    print(f"subscribers: {subscribers}")
+    trace_id, hops = trace_from_record(event_json)
+    hops = add_hop(hops, "master_in")
+    logger.debug("trace_id=%s event_type=%s", trace_id, event_type)
+
+    # Route from the in-memory snapshot when one is configured, else query MySQL
+    routes = routing.current()
+    if routes is not None:
+        metrics.incr("routed_from_snapshot")
+        db = routes
+
+    # A retry of a failed fan-out: the user was authorized on the first attempt
+    destination = retry_destination(event_json)
+    if destination:
+        await fan_out([destination], event_json, db, trace_id, hops)
+        return [destination]
+
+    # Fetch users who have subscribed to the event and whose filters it satisfies
+    subscriber_index = db.get_subscriber_index(event_type)
+    with metrics.timer("filter.match"):
+        subscribers = subscriber_index.match(event_data)
+    metrics.incr("filtered_out", len(subscriber_index) - len(subscribers))
+    logger.debug("subscribers: %s", subscribers)
     # Fetch required access checks
     acl_check_funcs = db.get_event_acl_functions(event_type)
-    print(f"[INFO] Acl check functions for event '{event_type}': {acl_check_funcs}")
+    logger.debug("Acl check functions for event '%s': %s", event_type, acl_check_funcs)
     
     authorized_users = []
 
-    for user in subscribers:
-        if await check_user_event_access(user, event_data, acl_check_funcs):
-            authorized_users.append(user)
+    with metrics.timer("acl.check"):
+        for user in subscribers:
+            if await check_user_event_access(user, event_data, acl_check_funcs):
+                authorized_users.append(user)
+    metrics.incr("subscribers", len(subscribers))
+    metrics.incr("authorized_users", len(authorized_users))
 
-    print(f"[RESULT] Authorized users: {authorized_users}")
+    logger.debug("Authorized users for %s (trace_id=%s): %s", event_type, trace_id, authorized_users)
 
     # add event to user queues
-    # TODO: call this function in parallel instead of using for loop
-    for user in authorized_users:
-        await send_event_to_user_queue(user, event_json, db)
+    await fan_out(authorized_users, event_json, db, trace_id, hops)
 
     return authorized_users
 
+async def fan_out(usernames, event_json, db, trace_id, hops):
+    """
+    sends the event to every user's queue in parallel; the queue URLs are looked up
+    in one query first, on this thread (the DB connection is not shared with the senders)
+    """
+    if not usernames:
+        return []
+    try:
+        queue_urls = db.get_user_queue_urls(usernames)
+    except Exception as e:
+        logger.error("Could not fetch user queue urls: %s", e, exc_info=True)
+        queue_urls = {}
+        lookup_error = f"{type(e).__name__}: {e}"
+    else:
+        lookup_error = None
+    loop = asyncio.get_running_loop()
+    with metrics.timer("fanout"):
+        return await asyncio.gather(*(
+            loop.run_in_executor(_fanout_executor, send_event_to_user_queue,
+                                 user, queue_urls.get(user), event_json, trace_id, hops, lookup_error)
+            for user in usernames
+        ))
+
+@functools.lru_cache(maxsize=None)
+def resolve_acl_function(func_path):
+    """Imports an ACL function by dotted path, once per container."""
+    module_name, func_name = func_path.rsplit('.', 1)
+    module = importlib.import_module(module_name)  # Import module dynamically
+    return getattr(module, func_name)  # Get function from module
+
 async def check_user_event_access(user, event_data, acl_functions):
     """Dynamically fetch and execute all ACL functions for an event."""
     for acl_func in acl_functions:
-        func_path = acl_func["function_path"]
-        module_name, func_name = func_path.rsplit('.', 1)
-
-        module = importlib.import_module(module_name)  # Import module dynamically
-        acl_function = getattr(module, func_name)  # Get function from module
+        acl_function = resolve_acl_function(acl_func["function_path"])
 
         if not acl_function(user, event_data):
             return False
 
     return True  # All checks passed
 
-async def send_event_to_user_queue(username, event_json, db):
-    """ send events to user queues """
+def send_event_to_user_queue(username, queue_url, event_json, trace_id, hops, lookup_error=None):
+    """
+    send events to user queues (high-priority lane if enabled), carrying the trace context as message attributes;
+    a failed send is retried for this user alone, with backoff, and dead-lettered once retries run out
+    """
+    permanent = False
     try:
-        queue_url = db.get_user_queue_url(username)
-        print(f"for {username} queue_url: {queue_url}")
+        event_data = event_json.body
+        priority = event_priority(event_data)
+        if lookup_error:
+            raise LookupError(lookup_error)
+        if not queue_url:
+            permanent = True
+            raise LookupError(f"no queue_url for user {username}")
+        queue_url = lane_queue_url(queue_url, priority)
+        logger.debug("for %s queue_url: %s", username, queue_url)
         region_name = "us-east-1"
         sqs_service = SQSService(queue_url=queue_url, region_name=region_name)
         
-        # For FIFO queues, messages with the same MessageGroupId are processed in order
+        # For FIFO queues, messages with the same MessageGroupId are processed in order;
+        # MESSAGE_GROUP_STRATEGY decides which events of a user share a group.
+        # The ingest idempotency key (when present) is the deduplication ID in every user queue.
+        idempotency_key = idempotency_key_from_record(event_json)
+        # The master does not change the event: forward the received text, not a re-encoding
         message_id = sqs_service.send_message(
-                        message_body=event_json['body'],
-                        # TODO: check this
-                        message_group_id=f"{username}_test_group",  # Required for FIFO queues
+                        message_body=event_json.raw_body,
+                        message_group_id=message_group_id(username, event_data),
+                        deduplication_id=idempotency_key,
+                        message_attributes={**trace_attributes(trace_id, add_hop(hops, "master_out")),
+                                            **idempotency_attributes(idempotency_key)},
                     )
         if message_id:
-            print(f"Test message sent successfully with ID: {message_id}")
+            logger.debug("Sent to %s with message ID %s", username, message_id)
+            if priority == HIGH:
+                metrics.incr("high_priority_fanout")
+            return True
+        reason = f"send to {queue_url} failed"
     except Exception as e:
-        print(f"Some issue in sending event to user queue: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
+        reason = f"{type(e).__name__}: {e}"
+        logger.error("Could not send event to the queue of %s: %s", username, e, exc_info=True)
+    metrics.incr("fanout_failures")
+    handle_failure("fanout", username, event_json.raw_body, forwarded_attributes(event_json),
+                   retry_attempt(event_json), reason, permanent)
+    return False
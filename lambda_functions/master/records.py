@@ -0,0 +1,65 @@
+import asyncio
+import os
+import time
+import traceback
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from budget import Budget
+from instrumentation import logger, metrics
+
+# Message groups processed at the same time within one invocation
+RECORD_CONCURRENCY = int(os.getenv("RECORD_CONCURRENCY", 10))
+
+
+def message_groups(records: List[Dict[str, Any]]) -> "OrderedDict[str, List[Dict[str, Any]]]":
+    """
+    Splits a batch into its FIFO message groups, keeping each group's order.
+
+    Records without a MessageGroupId (standard queues, e.g. the retry queue) are
+    unordered, so each one is a group of its own.
+    """
+    groups: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+    for record in records:
+        group_id = (record.get("attributes") or {}).get("MessageGroupId") or f"record:{record['messageId']}"
+        groups.setdefault(group_id, []).append(record)
+    return groups
+
+
+async def process_records(records: List[Dict[str, Any]], handle: Callable[[Dict[str, Any]], Awaitable[None]],
+                          concurrency: int = RECORD_CONCURRENCY, budget: Optional[Budget] = None) -> List[str]:
+    """
+    Runs handle on every record: message groups concurrently, the records of a group in order.
+
+    A record whose handler raises fails alone, except that in a FIFO group the
+    records after it fail with it unprocessed, so the group is redelivered in order.
+    With a budget, a record is only started while there is time for it; the rest
+    of its group is left unprocessed (budget.leave) and returned as failed too.
+
+    Returns:
+        list: The messageIds of the failed records, for the response's batchItemFailures
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    failed: List[str] = []
+
+    async def run_group(group: List[Dict[str, Any]]):
+        async with semaphore:
+            for position, record in enumerate(group):
+                if budget is not None and not budget.can_start():
+                    budget.leave(group[position:])
+                    failed.extend(r["messageId"] for r in group[position:])
+                    return
+                started = time.perf_counter()
+                try:
+                    await handle(record)
+                except Exception as e:
+                    metrics.incr("record_failures")
+                    logger.error("Record %s failed: %s\n%s", record["messageId"], e, traceback.format_exc())
+                    skipped = group[position:]
+                    metrics.incr("records_held_back", len(skipped) - 1)
+                    failed.extend(r["messageId"] for r in skipped)
+                    return
+                if budget is not None:
+                    budget.record_done((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(run_group(group) for group in message_groups(records).values()))
+    return failed
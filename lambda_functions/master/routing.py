@@ -0,0 +1,125 @@
+import gzip
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from instrumentation import logger, metrics
+from filters import FilterIndex
+
+# Routing snapshot written by tools/build_routing_snapshot.py: a local path (bundled
+# with the function or on EFS) or s3://bucket/key. Unset, routing queries MySQL.
+ROUTING_SNAPSHOT_PATH = os.getenv("ROUTING_SNAPSHOT_PATH")
+# How often a warm container checks the version marker ("<snapshot>.version")
+ROUTING_SNAPSHOT_CHECK_SECONDS = float(os.getenv("ROUTING_SNAPSHOT_CHECK_SECONDS", 30))
+
+SNAPSHOT_FORMAT = 1
+VERSION_SUFFIX = ".version"
+
+
+class RoutingTable:
+    """
+    The routing data of the master Lambda, in memory: event_type -> subscribers
+    (and their filters), username -> queue_url and event_type -> ACL functions.
+
+    Answers the same lookups as db.Database, so the processor can use either.
+    Each event type's FilterIndex is built on first use and kept.
+    """
+
+    __slots__ = ("version", "built_at", "subscribers", "filters", "queue_urls", "acl_functions", "_indexes")
+
+    def __init__(self, snapshot: Dict[str, Any]):
+        if snapshot.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported routing snapshot format: {snapshot.get('format')}")
+        self.version = snapshot["version"]
+        self.built_at = snapshot.get("built_at")
+        self.subscribers = {event_type: tuple(users) for event_type, users in snapshot["subscriptions"].items()}
+        # Optional, so snapshots from before subscription filters still load
+        self.filters = snapshot.get("filters", {})
+        self.queue_urls = snapshot["users"]
+        self.acl_functions = {
+            event_type: [{"function_name": name, "function_path": path} for name, path in functions]
+            for event_type, functions in snapshot["acl"].items()
+        }
+        self._indexes: Dict[str, FilterIndex] = {}
+
+    def get_subscriber_index(self, event_type: str) -> FilterIndex:
+        index = self._indexes.get(event_type)
+        if index is None:
+            filters = self.filters.get(event_type, {})
+            index = FilterIndex((username, filters.get(username)) for username in self.subscribers.get(event_type, ()))
+            self._indexes[event_type] = index
+        return index
+
+    def get_event_acl_functions(self, event_type: str) -> List[Dict[str, str]]:
+        return self.acl_functions.get(event_type, [])
+
+    def get_user_queue_urls(self, usernames) -> Dict[str, str]:
+        return {username: self.queue_urls[username] for username in usernames if username in self.queue_urls}
+
+
+def _split_s3(path: str) -> Tuple[str, str]:
+    bucket, _, key = path[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def _read(path: str) -> bytes:
+    if path.startswith("s3://"):
+        import boto3
+        bucket, key = _split_s3(path)
+        return boto3.client("s3").get_object(Bucket=bucket, Key=key)["Body"].read()
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def load_snapshot(path: str) -> RoutingTable:
+    """Reads and parses a routing snapshot (gzipped JSON)."""
+    return RoutingTable(json.loads(gzip.decompress(_read(path))))
+
+
+_table: Optional[RoutingTable] = None
+# Never checked: the first call reads the snapshot whatever the monotonic clock says
+_checked_at = float("-inf")
+
+
+def current(path: Optional[str] = None) -> Optional[RoutingTable]:
+    """
+    The routing table of this container, or None to route through MySQL.
+
+    Loaded at cold start, then the version marker is re-read at most every
+    ROUTING_SNAPSHOT_CHECK_SECONDS and the snapshot reloaded when it changed.
+    If the snapshot cannot be read, the table already loaded keeps serving; without
+    one, events route through MySQL until the next check, so an unreadable snapshot
+    is not fetched again for every event.
+    """
+    global _table, _checked_at
+    path = path or ROUTING_SNAPSHOT_PATH
+    if not path:
+        return None
+    now = time.monotonic()
+    if now - _checked_at < ROUTING_SNAPSHOT_CHECK_SECONDS:
+        return _table
+    _checked_at = now
+    try:
+        version = _read(path + VERSION_SUFFIX).decode("utf-8").strip()
+        if _table is None or version != _table.version:
+            with metrics.timer("routing.load"):
+                _table = load_snapshot(path)
+            metrics.incr("routing_snapshot_loads")
+            logger.info("Loaded routing snapshot %s built at %s", _table.version, _table.built_at)
+    except Exception as e:
+        metrics.incr("routing_snapshot_errors")
+        logger.error("Could not refresh routing snapshot %s: %s", path, e)
+    return _table
+
+
+def expire():
+    """Makes the next call to current() re-read the version marker (e.g. after a SnapStart restore)."""
+    global _checked_at
+    _checked_at = float("-inf")
+
+
+def reset():
+    """Forgets the loaded table (the next call to current() loads again)."""
+    global _table, _checked_at
+    _table = None
+    _checked_at = float("-inf")
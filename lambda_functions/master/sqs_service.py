@@ -1,8 +1,51 @@
-import boto3
 import json
 import hashlib
-from typing import Dict, Any, Optional
+import threading
+from typing import Dict, Any, Optional, Union
 from botocore.exceptions import ClientError
+from instrumentation import logger, metrics
+
+# SQS clients are expensive to build, so they are shared by every SQSService.
+# They come from a botocore session: the boto3 layer adds import time and nothing the
+# Lambdas use (a boto3 client is this same botocore client).
+_clients: Dict[str, Any] = {}
+_client_override = None
+_session = None
+_lock = threading.Lock()
+
+
+def get_sqs_client(region_name: str = 'us-east-1'):
+    """Return the shared SQS client for region_name, creating it on first use."""
+    if _client_override is not None:
+        return _client_override
+    client = _clients.get(region_name)
+    if client is None:
+        # Creating clients from one session is not thread-safe (the fan-out sends from threads)
+        with _lock:
+            client = _clients.get(region_name)
+            if client is None:
+                client = _clients[region_name] = _botocore_session().create_client('sqs', region_name=region_name)
+    return client
+
+
+def _botocore_session():
+    global _session
+    if _session is None:
+        import botocore.session
+        _session = botocore.session.get_session()
+    return _session
+
+
+def set_sqs_client(client):
+    """
+    Route every SQSService through the given client instead of boto3.
+
+    Used by local_stack to run the Lambdas against an in-process SQS stand-in.
+    Pass None to go back to boto3 clients.
+    """
+    global _client_override
+    _client_override = client
+
 
 class SQSService:
     def __init__(self, queue_url: str, region_name: str = 'us-east-1'):
@@ -10,57 +53,63 @@ class SQSService:
         Initialize the SQS service.
         
         Args:
-            queue_url (str): The URL of the SQS queue
+            queue_url (str): The URL of the SQS queue (FIFO for events; the retry queue is standard)
             region_name (str): AWS region name (default: 'us-east-1')
         """
-        if not queue_url.endswith('.fifo'):
-            raise ValueError("Queue URL must end with .fifo for FIFO queues")
-            
         self.queue_url = queue_url
-        self.sqs = boto3.client('sqs', region_name=region_name)
+        self.fifo = queue_url.endswith('.fifo')
+        self.sqs = get_sqs_client(region_name)
 
+    @metrics.timed("sqs.send")
     def send_message(self, 
-                     message_body: Dict[str, Any], 
+                     message_body: Union[Dict[str, Any], str], 
                      message_group_id: str,
                      deduplication_id: Optional[str] = None,
-                     delay_seconds: int = 0) -> Optional[str]:
+                     delay_seconds: int = 0,
+                     message_attributes: Optional[Dict[str, Dict[str, str]]] = None) -> Optional[str]:
         """
         Send a message to the FIFO SQS queue.
         
         Args:
-            message_body (dict): The message to send
+            message_body (dict or str): The message to send; a str is sent as is (already encoded JSON)
             message_group_id (str): Message group ID (required for FIFO)
             deduplication_id (str, optional): Custom deduplication ID
             delay_seconds (int): Delay delivery of the message
+            message_attributes (dict, optional): SQS MessageAttributes (e.g. trace context)
             
         Returns:
             Optional[str]: MessageId if successful, None if failed
         """
         try:
             # Prepare message parameters
+            encoded = isinstance(message_body, str)
             message_params = {
                 'QueueUrl': self.queue_url,
-                'MessageBody': json.dumps(message_body),
-                'MessageGroupId': message_group_id,
+                'MessageBody': message_body if encoded else json.dumps(message_body),
                 'DelaySeconds': delay_seconds
             }
+            if message_attributes:
+                message_params['MessageAttributes'] = message_attributes
             
-            # Add deduplication ID (required unless content-based deduplication is enabled)
-            if deduplication_id:
-                message_params['MessageDeduplicationId'] = deduplication_id
-            else:
-                # Generate a UUID if no deduplication ID is provided
-                # Create MD5 hash of the message body for deduplication
-                message_hash = hashlib.md5(json.dumps(message_body, sort_keys=True).encode('utf-8')).hexdigest()
-                message_params['MessageDeduplicationId'] = message_hash
+            # Group and deduplication ID only apply to FIFO queues
+            if self.fifo:
+                message_params['MessageGroupId'] = message_group_id
+                # Add deduplication ID (required unless content-based deduplication is enabled)
+                if deduplication_id:
+                    message_params['MessageDeduplicationId'] = deduplication_id
+                else:
+                    # Create MD5 hash of the message body for deduplication
+                    canonical = message_body if encoded else json.dumps(message_body, sort_keys=True)
+                    message_hash = hashlib.md5(canonical.encode('utf-8')).hexdigest()
+                    message_params['MessageDeduplicationId'] = message_hash
 
             response = self.sqs.send_message(**message_params)
             message_id = response.get('MessageId')
-            print(f"Message sent successfully. MessageId: {message_id}")
+            logger.debug("Message sent to %s. MessageId: %s", self.queue_url, message_id)
             return message_id
             
         except ClientError as e:
-            print(f"Failed to send message: {str(e)}")
+            logger.error("Failed to send message to %s: %s", self.queue_url, e)
             return None
 
     def receive_messages(self, max_messages: int = 1, wait_time_seconds: int = 20) -> list:
@@ -83,12 +132,13 @@ class SQSService:
                 MessageAttributeNames=['All']
             )
             messages = response.get('Messages', [])
-            print(f"Received {len(messages)} messages")
+            logger.debug("Received %d messages from %s", len(messages), self.queue_url)
             return messages
         except ClientError as e:
-            print(f"Failed to receive messages: {str(e)}")
+            logger.error("Failed to receive messages from %s: %s", self.queue_url, e)
             return []
 
+    @metrics.timed("sqs.delete")
     def delete_message(self, receipt_handle: str) -> bool:
         """
         Delete a message from the queue after processing.
@@ -104,9 +154,31 @@ class SQSService:
                 QueueUrl=self.queue_url,
                 ReceiptHandle=receipt_handle
             )
-            print("Message deleted successfully")
+            logger.debug("Message deleted from %s", self.queue_url)
             return True
         except ClientError as e:
-            print(f"Failed to delete message: {str(e)}")
+            logger.error("Failed to delete message from %s: %s", self.queue_url, e)
             return False
 
+    @metrics.timed("sqs.change_visibility")
+    def change_visibility(self, receipt_handle: str, visibility_timeout: int) -> bool:
+        """
+        Hide a received message for another visibility_timeout seconds (0 makes it visible now).
+
+        Args:
+            receipt_handle (str): The receipt handle of the message
+            visibility_timeout (int): Seconds from now, at most 12 hours
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            self.sqs.change_message_visibility(
+                QueueUrl=self.queue_url,
+                ReceiptHandle=receipt_handle,
+                VisibilityTimeout=visibility_timeout
+            )
+            return True
+        except ClientError as e:
+            logger.error("Failed to change message visibility in %s: %s", self.queue_url, e)
+            return False
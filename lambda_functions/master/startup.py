@@ -0,0 +1,60 @@
+import os
+import random
+import time
+from typing import Callable, Optional
+from instrumentation import logger, metrics
+
+# Warm the container up during Lambda's init phase (module import) instead of in the
+# first invocation: build the clients and load the data every invocation needs.
+# On by default in Lambda, off elsewhere (local runs, the harness).
+PRIME_ON_INIT = os.getenv("PRIME_ON_INIT", "1" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "0") == "1"
+
+
+def _snapshot_hooks():
+    """SnapStart's runtime hooks, or None when not running with SnapStart."""
+    try:
+        from snapshot_restore_py import register_after_restore, register_before_snapshot
+    except ImportError:
+        return None
+    return register_before_snapshot, register_after_restore
+
+
+def register(prime: Callable[[], None], restore: Optional[Callable[[], None]] = None):
+    """
+    Runs prime once, at init. With SnapStart it runs before the snapshot is taken,
+    so every restored container starts primed, and restore runs after each restore.
+
+    Args:
+        prime: Loads and builds what the handler needs (no network connections:
+            they would not survive a snapshot)
+        restore: Refreshes state that must not be shared by restored containers
+    """
+    hooks = _snapshot_hooks()
+    if hooks is not None:
+        register_before_snapshot, register_after_restore = hooks
+        register_before_snapshot(lambda: _run(prime))
+        register_after_restore(lambda: _after_restore(restore))
+        return
+    if PRIME_ON_INIT:
+        _run(prime)
+
+
+def _run(prime: Callable[[], None]):
+    started = time.perf_counter()
+    try:
+        prime()
+    except Exception as e:
+        # Only an optimization: whatever failed is done by the first invocation instead
+        logger.warning("Priming failed: %s", e)
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    metrics.observe("init.prime", elapsed_ms)
+    logger.info("Primed in %.1f ms", elapsed_ms)
+
+
+def _after_restore(restore: Optional[Callable[[], None]]):
+    # Every container restored from one snapshot would otherwise draw the same
+    # "random" retry and backpressure jitter
+    random.seed()
+    if restore is not None:
+        restore()
@@ -1,22 +1,47 @@
 import requests
+from instrumentation import logger, metrics
+
+# The subscriber an event is delivered for: user_service takes it as the payload's
+# "username", so the queued event text is posted unchanged
+USERNAME_HEADER = "X-Event-Username"
+
+# Shared by every call, so deliveries and health checks reuse their connections to a
+# node within and across warm invocations instead of connecting per request
+_session = requests.Session()
 
 class ApiClient:
-    """API Client for POST requests."""
+    """API Client for user_service requests."""
 
     @staticmethod
-    def post_request(ip_port, token, payload):
+    @metrics.timed("http.deliver")
+    def post_request(ip_port, token, payload, extra_headers=None):
         """Make a POST request with Bearer token authentication."""
         url = f"http://{ip_port}"
         headers = {
             "Authorization": f"Bearer {token}",
+            **(extra_headers or {}),
         }
-        print(payload)
+        logger.debug("payload: %s", payload)
         try:
-            response = requests.post(url, data=payload, headers=headers)
-            print(response.text)
+            response = _session.post(url, data=payload, headers=headers)
+            logger.debug("response: %s", response.text)
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
-            print(f"Error during POST request: {e}")
+            logger.warning("Error during POST request to %s: %s", ip_port, e)
             return None
 
+
+    @staticmethod
+    @metrics.timed("http.health")
+    def get_health(ip_port, token, timeout):
+        """GET /health of a user_service; returns the JSON or None if it could not be checked."""
+        url = f"http://{ip_port}/health"
+        headers = {"Authorization": f"Bearer {token}"}
+        try:
+            response = _session.get(url, headers=headers, timeout=timeout)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.warning("Error during health check of %s: %s", ip_port, e)
+            return None
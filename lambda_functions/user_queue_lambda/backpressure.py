@@ -0,0 +1,44 @@
+import os
+import random
+import time
+from typing import Dict, Tuple
+from api_client import ApiClient
+from instrumentation import logger, metrics
+
+# Ask user_service (GET /health) whether its node is saturated before posting to it
+BACKPRESSURE_ENABLED = os.getenv("BACKPRESSURE_ENABLED", "true").lower() == "true"
+# One health check per node per this many seconds, shared by every record of a warm container
+HEALTH_CACHE_SECONDS = float(os.getenv("HEALTH_CACHE_SECONDS", 2))
+HEALTH_TIMEOUT_SECONDS = float(os.getenv("HEALTH_TIMEOUT_SECONDS", 1))
+# Deferred records become visible again after about this long (jittered +-50%)
+BACKPRESSURE_DELAY_SECONDS = int(os.getenv("BACKPRESSURE_DELAY_SECONDS", 30))
+
+# ip_port -> (checked_at, saturated); lives as long as the Lambda container
+_health_cache: Dict[str, Tuple[float, bool]] = {}
+
+
+def node_saturated(ip_port: str, token: str) -> bool:
+    """
+    Whether the user's node reported itself saturated, at most HEALTH_CACHE_SECONDS ago.
+
+    A node that cannot be checked counts as not saturated: the POST that follows
+    will fail (and be retried) if it is really down.
+    """
+    if not BACKPRESSURE_ENABLED:
+        return False
+    now = time.monotonic()
+    cached = _health_cache.get(ip_port)
+    if cached and now - cached[0] < HEALTH_CACHE_SECONDS:
+        return cached[1]
+    health = ApiClient.get_health(ip_port, token, HEALTH_TIMEOUT_SECONDS)
+    saturated = bool(health) and health.get("status") == "saturated"
+    if saturated:
+        metrics.incr("saturated_nodes")
+        logger.warning("user_service at %s is saturated: %s", ip_port, health.get("reasons"))
+    _health_cache[ip_port] = (now, saturated)
+    return saturated
+
+
+def defer_seconds() -> int:
+    """Visibility timeout for a deferred record, jittered so deferred batches do not return together."""
+    return max(1, int(BACKPRESSURE_DELAY_SECONDS * random.uniform(0.5, 1.5)))
@@ -0,0 +1,81 @@
+import math
+import os
+import time
+from typing import Any, Iterable, List, Optional
+from instrumentation import metrics
+
+# Time left unused at the end of an invocation, for the deletes and the metrics flush
+TIME_SAFETY_MARGIN_MS = int(os.getenv("TIME_SAFETY_MARGIN_MS", 3000))
+# Share of the invocation time a batch should take, for the recommended batch size
+TARGET_BATCH_TIME_RATIO = float(os.getenv("TARGET_BATCH_TIME_RATIO", 0.5))
+# Largest batch size to recommend (the event source mapping allows 10 for FIFO queues)
+MAX_RECOMMENDED_BATCH_SIZE = int(os.getenv("MAX_RECOMMENDED_BATCH_SIZE", 10))
+# Weight of the newest record in the container's running average of the per-record time
+RECORD_TIME_SMOOTHING = 0.2
+
+# Per-record time averaged over this container's invocations, so a warm container
+# can budget its first record too
+_record_ms: Optional[float] = None
+
+
+class Budget:
+    """
+    The time budget of one invocation, from context.get_remaining_time_in_millis().
+
+    Before each record the handler asks can_start(): a record is only taken on if
+    it is expected to finish (at the container's average per-record time) with
+    TIME_SAFETY_MARGIN_MS to spare. The records left over (leave()) are returned as
+    batch item failures, so one slow batch does not run into the timeout and have
+    every record retried. report() emits the observed cost and the recommended sizing.
+    Without a context (local runs) the budget is unlimited.
+    """
+
+    def __init__(self, context: Any = None, margin_ms: Optional[int] = None):
+        self.context = context
+        self.margin_ms = TIME_SAFETY_MARGIN_MS if margin_ms is None else margin_ms
+        self.started = time.perf_counter()
+        self.available_ms = self.remaining_ms()
+        self.records = 0
+        self.left: List[Any] = []
+
+    def remaining_ms(self) -> float:
+        if self.context is None:
+            return math.inf
+        return self.context.get_remaining_time_in_millis()
+
+    def can_start(self) -> bool:
+        """Whether one more record fits in the time left."""
+        return self.remaining_ms() - self.margin_ms >= (_record_ms or 0)
+
+    def leave(self, records: Iterable[Any]):
+        """Records not started for lack of time, for a later invocation."""
+        self.left.extend(records)
+
+    def record_done(self, elapsed_ms: float):
+        """Accounts one processed record that took elapsed_ms."""
+        global _record_ms
+        self.records += 1
+        _record_ms = elapsed_ms if _record_ms is None else \
+            RECORD_TIME_SMOOTHING * elapsed_ms + (1 - RECORD_TIME_SMOOTHING) * _record_ms
+
+    def report(self, batch_size: int):
+        """
+        Emits this batch's sizing metrics:
+            batch.size, batch.stopped_early: records received / left for a later invocation
+            batch.records_per_second: throughput of this container
+            batch.recommended_size: records per batch that use TARGET_BATCH_TIME_RATIO of the time
+        With the queue's arrival rate (NumberOfMessagesSent per second), the event
+        source mapping's maximum concurrency to keep up is arrival rate / records_per_second.
+        """
+        metrics.gauge("batch.size", batch_size, "Count")
+        if self.left:
+            metrics.incr("batch.stopped_early", len(self.left))
+        elapsed_ms = (time.perf_counter() - self.started) * 1000
+        if not self.records or elapsed_ms <= 0:
+            return
+        # Wall time per record, so records processed concurrently count once
+        per_record_ms = elapsed_ms / self.records
+        metrics.gauge("batch.records_per_second", 1000 / per_record_ms, "Count/Second")
+        if math.isfinite(self.available_ms):
+            recommended = int(TARGET_BATCH_TIME_RATIO * (self.available_ms - self.margin_ms) / per_record_ms)
+            metrics.gauge("batch.recommended_size", max(1, min(MAX_RECOMMENDED_BATCH_SIZE, recommended)), "Count")
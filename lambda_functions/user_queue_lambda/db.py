@@ -1,8 +1,44 @@
-import pymysql
 import os
-from dotenv import load_dotenv
+import threading
+from instrumentation import logger, metrics
+
+# A function's configuration is its environment; outside Lambda, MYSQL_* may come from a .env file
+if not os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# None: pymysql.connect (pymysql is imported on first connect)
+_connection_factory = None
+_local = threading.local()
+
+
+def _pymysql():
+    import pymysql
+    return pymysql
+
+
+def set_connection_factory(factory):
+    """
+    Open connections through factory instead of pymysql.connect.
+
+    Used by local_stack to back the Lambda with SQLite. Pass None to restore pymysql.
+    """
+    global _connection_factory
+    _connection_factory = factory
+
+
+def shared() -> "Database":
+    """
+    The Database of the calling thread, kept open across warm invocations.
+
+    Lambda runs one invocation at a time per container; the local harness runs
+    several pollers in one process, hence one per thread.
+    """
+    db = getattr(_local, "db", None)
+    if db is None:
+        db = _local.db = Database()
+    return db
 
-load_dotenv()
 
 class Database:
     """MySQL DB Handler."""
@@ -11,9 +47,21 @@ class Database:
         self.connection = None
 
     def init(self):
-        """Initialize MySQL connection."""
+        """
+        Initialize MySQL connection, or check the one kept from an earlier invocation
+        (pinged, and reopened if it dropped).
+        """
+        pymysql = _pymysql()
+        if self.connection is not None:
+            try:
+                self.connection.ping(reconnect=True)
+                return
+            except Exception as e:
+                logger.warning("Dropping stale MySQL connection: %s", e)
+                self.close()
         try:
-            self.connection = pymysql.connect(
+            metrics.incr("db_connects")
+            self.connection = (_connection_factory or pymysql.connect)(
                 host=os.getenv('MYSQL_HOST'),
                 user=os.getenv('MYSQL_USER'),
                 password=os.getenv('MYSQL_PASSWORD'),
@@ -23,15 +71,18 @@ class Database:
                 cursorclass=pymysql.cursors.DictCursor,
                 connect_timeout=10,
                 read_timeout=10,
-                write_timeout=10
+                write_timeout=10,
+                # Read-only use: without autocommit a kept connection would read from a stale snapshot
+                autocommit=True
             )
         except pymysql.MySQLError as e:
-            print(f"Error connecting to MySQL: {e}")
+            logger.error("Error connecting to MySQL: %s", e)
             raise
 
+    @metrics.timed("db.fetch_user_by_queue_url")
     def fetch_user_by_queue_url(self, queue_url):
         """
-        Fetch user details using queue_url.
+        Fetch user details using queue_url (through the indexed queue_url_hash, see tools/migrate.py).
         
         Args:
             queue_url (str): The queue_url to filter user records.
@@ -42,18 +93,21 @@ class Database:
         try:
             with self.connection.cursor() as cursor:
                 query = """
-                SELECT username, ip_port, token 
-                FROM users 
-                WHERE queue_url = %s
+                SELECT username, ip_port, token
+                FROM users
+                WHERE queue_url_hash = SHA2(%s, 256) AND queue_url = %s
                 """
-                cursor.execute(query, (queue_url,))
+                cursor.execute(query, (queue_url, queue_url))
                 result = cursor.fetchone()
                 return result
-        except pymysql.MySQLError as e:
-            print(f"Error querying database: {e}")
+        except _pymysql().MySQLError as e:
+            logger.error("Error querying database: %s", e, exc_info=True)
             return None
     
     def close(self):
         """Close MySQL connection."""
         if self.connection:
-            self.connection.close()
+            try:
+                self.connection.close()
+            finally:
+                self.connection = None
@@ -0,0 +1,139 @@
+import json
+import os
+import random
+import time
+from typing import Any, Dict, Optional, Union
+from instrumentation import logger, metrics
+from sqs_service import get_sqs_client
+
+# Standard (non-FIFO) queue consumed by this Lambda: FIFO queues cannot delay single
+# messages, so per-destination retries go here with a jittered DelaySeconds.
+# Unset, failures behave as before (fan-out drops, delivery leaves the record queued).
+RETRY_QUEUE_URL = os.getenv("RETRY_QUEUE_URL")
+# Standard queue that receives events which exhausted their retries
+DLQ_URL = os.getenv("DLQ_URL")
+MAX_RETRY_ATTEMPTS = int(os.getenv("MAX_RETRY_ATTEMPTS", 5))
+RETRY_BASE_DELAY_SECONDS = int(os.getenv("RETRY_BASE_DELAY_SECONDS", 2))
+# SQS caps DelaySeconds at 15 minutes
+RETRY_MAX_DELAY_SECONDS = min(int(os.getenv("RETRY_MAX_DELAY_SECONDS", 900)), 900)
+
+# Message attributes describing a retry / dead-lettered event
+ATTEMPT_ATTRIBUTE = "retry_attempt"
+DESTINATION_ATTRIBUTE = "retry_destination"
+STAGE_ATTRIBUTE = "failure_stage"
+REASON_ATTRIBUTE = "failure_reason"
+FAILED_AT_ATTRIBUTE = "failed_at"
+REPLAY_QUEUE_ATTRIBUTE = "replay_queue_url"
+FAILURE_ATTRIBUTES = (ATTEMPT_ATTRIBUTE, DESTINATION_ATTRIBUTE, STAGE_ATTRIBUTE, REASON_ATTRIBUTE,
+                      FAILED_AT_ATTRIBUTE, REPLAY_QUEUE_ATTRIBUTE)
+
+# Event types whose order within a FIFO message group does not matter. A failed
+# delivery of one goes to the retry queue, so the rest of its group moves on; any
+# other failed delivery is retried in place, ahead of the rest of its group.
+UNORDERED_EVENT_TYPES = {name.strip() for name in os.getenv("UNORDERED_EVENT_TYPES", "").split(",") if name.strip()}
+
+# SQS message attribute values are limited in practice; keep reasons short
+MAX_REASON_LENGTH = 1024
+
+
+def backoff_seconds(attempt: int) -> int:
+    """
+    Delay before retry number `attempt` (1-based): "full jitter" exponential backoff.
+
+    Retries of events that failed together are spread over the whole window
+    instead of arriving at the destination in the same second.
+    """
+    ceiling = min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1))
+    return max(1, int(random.uniform(0, ceiling)))
+
+
+def _attribute(record: Dict[str, Any], name: str) -> Optional[str]:
+    return ((record.get("messageAttributes") or {}).get(name) or {}).get("stringValue")
+
+
+def retry_attempt(record: Dict[str, Any]) -> int:
+    """Retries already made for a Lambda SQS record (0 for a first delivery)."""
+    return int(_attribute(record, ATTEMPT_ATTRIBUTE) or 0)
+
+
+def receive_count(record: Dict[str, Any]) -> int:
+    """Times SQS has handed out a Lambda SQS record, this time included."""
+    return int((record.get("attributes") or {}).get("ApproximateReceiveCount") or 1)
+
+
+def retry_destination(record: Dict[str, Any]) -> Optional[str]:
+    """The destination a retry record is meant for (None unless it came from the retry queue)."""
+    return _attribute(record, DESTINATION_ATTRIBUTE)
+
+
+def forwarded_attributes(record: Dict[str, Any]) -> Dict[str, Dict[str, str]]:
+    """The record's message attributes in boto3 format, without the failure bookkeeping."""
+    return {
+        name: {"DataType": value.get("dataType", "String"), "StringValue": value.get("stringValue")}
+        for name, value in (record.get("messageAttributes") or {}).items()
+        if name not in FAILURE_ATTRIBUTES and value.get("stringValue") is not None
+    }
+
+
+def _string(value) -> Dict[str, str]:
+    return {"DataType": "String", "StringValue": str(value)}
+
+
+def handle_failure(stage: str, destination: str, body: Union[Dict[str, Any], str],
+                   attributes: Dict[str, Dict[str, str]], attempt: int, reason: str,
+                   permanent: bool = False) -> Optional[str]:
+    """
+    Schedules another attempt for one destination, or dead-letters the event.
+
+    Args:
+        stage (str): "fanout" or "delivery"
+        destination (str): What failed - a username (fan-out) or user queue URL (delivery)
+        body (dict or str): The event, or its JSON text (forwarded as is)
+        attributes (dict): Message attributes to carry along (boto3 format)
+        attempt (int): Retries already made
+        reason (str): Why it failed
+        permanent (bool): Retrying cannot help (e.g. unknown user); dead-letter right away
+
+    Returns:
+        Optional[str]: "retried" or "dead_lettered", or None if the event could not be handed off
+    """
+    reason = reason[:MAX_REASON_LENGTH]
+    if not isinstance(body, str):
+        body = json.dumps(body)
+    sqs = get_sqs_client()
+    try:
+        if not permanent and attempt < MAX_RETRY_ATTEMPTS and RETRY_QUEUE_URL:
+            delay = backoff_seconds(attempt + 1)
+            sqs.send_message(
+                QueueUrl=RETRY_QUEUE_URL,
+                MessageBody=body,
+                DelaySeconds=delay,
+                MessageAttributes={
+                    **attributes,
+                    ATTEMPT_ATTRIBUTE: _string(attempt + 1),
+                    DESTINATION_ATTRIBUTE: _string(destination),
+                    STAGE_ATTRIBUTE: _string(stage),
+                    REASON_ATTRIBUTE: _string(reason),
+                },
+            )
+            metrics.incr(f"{stage}_retries")
+            logger.warning("%s to %s failed (%s); retry %d in %ds", stage, destination, reason, attempt + 1, delay)
+            return "retried"
+        if DLQ_URL:
+            dlq_attributes = {
+                **attributes,
+                ATTEMPT_ATTRIBUTE: _string(attempt),
+                DESTINATION_ATTRIBUTE: _string(destination),
+                STAGE_ATTRIBUTE: _string(stage),
+                REASON_ATTRIBUTE: _string(reason),
+                FAILED_AT_ATTRIBUTE: _string(int(time.time() * 1000)),
+            }
+            if RETRY_QUEUE_URL:
+                dlq_attributes[REPLAY_QUEUE_ATTRIBUTE] = _string(RETRY_QUEUE_URL)
+            sqs.send_message(QueueUrl=DLQ_URL, MessageBody=body, MessageAttributes=dlq_attributes)
+            metrics.incr(f"{stage}_dead_lettered")
+            logger.error("%s to %s dead-lettered after %d retries: %s", stage, destination, attempt, reason)
+            return "dead_lettered"
+    except Exception as e:
+        logger.error("Could not hand off failed %s to %s: %s", stage, destination, e)
+    return None
@@ -0,0 +1,21 @@
+from typing import Any, Dict, Optional
+
+# SQS message attribute / HTTP header carrying the idempotency key set at ingest
+IDEMPOTENCY_KEY_ATTRIBUTE = "idempotency_key"
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+
+
+def idempotency_key_from_record(record: Dict[str, Any]) -> Optional[str]:
+    """The idempotency key of a Lambda SQS record (None for events published without one)."""
+    attributes = record.get("messageAttributes") or {}
+    return (attributes.get(IDEMPOTENCY_KEY_ATTRIBUTE) or {}).get("stringValue")
+
+
+def idempotency_attributes(key: Optional[str]) -> Dict[str, Dict[str, str]]:
+    """SQS MessageAttributes (boto3 format) carrying the idempotency key."""
+    return {IDEMPOTENCY_KEY_ATTRIBUTE: {"DataType": "String", "StringValue": key}} if key else {}
+
+
+def idempotency_headers(key: Optional[str]) -> Dict[str, str]:
+    """HTTP headers carrying the idempotency key."""
+    return {IDEMPOTENCY_KEY_HEADER: key} if key else {}
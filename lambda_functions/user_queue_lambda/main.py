@@ -1,38 +1,199 @@
-import json
-from db import Database
-from api_client import ApiClient
+import time
+import db as database
+from api_client import USERNAME_HEADER, ApiClient
 from sqs_service import SQSService
+from instrumentation import logger, metrics
+from tracing import add_hop, trace_from_record, trace_headers
+from idempotency import idempotency_headers, idempotency_key_from_record
+from failures import (MAX_RETRY_ATTEMPTS, UNORDERED_EVENT_TYPES, backoff_seconds, forwarded_attributes,
+                      handle_failure, receive_count, retry_attempt, retry_destination)
+from lanes import HIGH, HIGH_LANE_WEIGHT, PRIORITY_LANES, base_queue_url, is_high_lane, lane_queue_url
+from backpressure import defer_seconds, node_saturated
+from sqs_record import SQSRecord, wrap
+from budget import Budget
 
-def main(event):
-    db = Database()
+def main(event, context=None):
+    """
+    delivers a batch of user-queue records; returns the messageIds of the records
+    held back (the handler's batchItemFailures): deferred because the user's node is
+    saturated, or, with the Lambda context, left for the next invocation when the
+    remaining time runs out
+    """
+    # The container's DB connection, kept across warm invocations
+    db = database.shared()
     db.init()
-    try:
-        for record in event['Records']:
-            queue_url = get_queue_url(record['eventSourceARN'])
-            user = db.fetch_user_by_queue_url(queue_url)
-
-            if user:
-                ip_port = user["ip_port"]
-                token = user["token"]
-                print(f"Fetched user details: {user}")
-
-                # Example payload for the POST request
-                payload = record['body']
-                payload['username'] = user['username']
-                payload = json.dumps(payload)
-                api_client = ApiClient()
-                response = api_client.post_request(ip_port, token, payload)
-
-                if response:
-                    print("POST Response:", response)
-                    # delete record from queue
-                    delete_record_from_queue(record, queue_url)
-                else:
-                    print("Failed to get a response.")
-            else:
-                print(f"No user found with queue_url: {queue_url}")
-    finally:
-        db.close()
+    budget = Budget(context)
+    held_back = []
+    records = [SQSRecord(record) for record in event['Records']]
+    if PRIORITY_LANES and records and not retry_destination(records[0]):
+        queue_url = get_queue_url(records[0]['eventSourceARN'])
+        if not is_high_lane(queue_url):
+            # Weighted consumption: serve waiting high-priority events ahead of this low-lane batch
+            for record in receive_high_lane_records(queue_url, HIGH_LANE_WEIGHT * len(records)):
+                metrics.incr("high_lane_records")
+                # Not part of the batch: hiding or releasing it is enough
+                if not take_record(record, db, budget, held_back):
+                    held_back.append(None)
+    for record in records:
+        if not take_record(record, db, budget, held_back):
+            held_back.append(record['messageId'])
+    budget.report(len(records))
+    return [message_id for message_id in held_back if message_id]
+
+
+def take_record(record, db, budget, held_back):
+    """
+    delivers a record unless it has to be held back; returns False if it was.
+    Once one record is held back, so is the rest of the batch, keeping FIFO order:
+    deferred after a saturated node, released (visible again now) when out of time.
+    """
+    if held_back and not budget.left:
+        defer_record(record)
+        return False
+    if budget.left or not budget.can_start():
+        budget.leave([record])
+        release_record(record)
+        return False
+    started = time.perf_counter()
+    if not deliver_record(record, db):
+        return False
+    budget.record_done((time.perf_counter() - started) * 1000)
+    return True
+
+
+def deliver_record(record, db):
+    """
+    posts one queued event to the user's user_service and deletes it once delivered.
+    A failed delivery stays in its FIFO queue, hidden for a backoff (see retry_in_place), so
+    the events behind it in its message group keep waiting; events of UNORDERED_EVENT_TYPES,
+    and records from the retry queue, move to the retry queue (with backoff) instead.
+    Once retries run out, the event goes to the DLQ. A record that cannot be handed off
+    (no retry queue or DLQ configured, or the send failed) stays in its queue, backing off.
+    Returns False if the record was held back in its queue: deferred, without posting,
+    because the user's node reports itself saturated, or backing off after a failure.
+    The event is posted as the text it was queued as; the username travels in a header.
+    """
+    record = wrap(record)
+    metrics.incr("records")
+    trace_id, hops = trace_from_record(record)
+    hops = add_hop(hops, "delivery_in")
+    queue_url = get_queue_url(record['eventSourceARN'])
+    # Records from the retry queue name the user queue they were taken from
+    destination = retry_destination(record) or queue_url
+    user = db.fetch_user_by_queue_url(base_queue_url(destination))
+
+    if user:
+        ip_port = user["ip_port"]
+        token = user["token"]
+        logger.debug("Fetched user details: %s", user)
+        if node_saturated(ip_port, token):
+            defer_record(record)
+            return False
+
+        api_client = ApiClient()
+        headers = {USERNAME_HEADER: user['username'],
+                   **trace_headers(trace_id, add_hop(hops, "delivery_out")),
+                   **idempotency_headers(idempotency_key_from_record(record))}
+        response = api_client.post_request(ip_port, token, record.raw_body, headers)
+
+        if response:
+            metrics.incr("delivered")
+            logger.debug("POST Response: %s", response)
+            # delete record from queue
+            delete_record_from_queue(record, queue_url)
+        else:
+            metrics.incr("delivery_failures")
+            logger.warning("No response from user_service at %s", ip_port)
+            reason = f"POST to {ip_port} failed"
+            if not retry_destination(record) and record.body.get("event_type") not in UNORDERED_EVENT_TYPES:
+                return retry_in_place(record, queue_url, destination, reason)
+            # Handed off to the retry queue / DLQ: drop it here so the rest of the group moves on
+            if not handle_failure("delivery", destination, record.raw_body, forwarded_attributes(record),
+                                  retry_attempt(record), reason):
+                return back_off(record, reason)
+            delete_record_from_queue(record, queue_url)
+    else:
+        logger.warning("No user found with queue_url: %s", destination)
+        reason = "no user for queue_url"
+        if not handle_failure("delivery", destination, record.raw_body, forwarded_attributes(record),
+                              retry_attempt(record), reason, permanent=True):
+            return back_off(record, reason)
+        delete_record_from_queue(record, queue_url)
+    return True
+
+
+def retry_in_place(record, queue_url, destination, reason):
+    """
+    retries a failed delivery without reordering its message group: the record stays
+    in its FIFO queue, invisible for a full-jitter backoff on its receive count, and
+    the group's later events wait behind it. After MAX_RETRY_ATTEMPTS retries it is
+    dead-lettered (when there is a DLQ) and the group moves on.
+    Returns False while the record stays queued, like deliver_record.
+    """
+    attempt = receive_count(record)
+    if attempt > MAX_RETRY_ATTEMPTS and handle_failure(
+            "delivery", destination, record.raw_body, forwarded_attributes(record), attempt - 1, reason,
+            permanent=True):
+        delete_record_from_queue(record, queue_url)
+        return True
+    return back_off(record, reason)
+
+
+def back_off(record, reason):
+    """
+    leaves a failed record in its queue, invisible for a full-jitter backoff on its
+    receive count, for SQS to hand out again (or its redrive policy to dead-letter it).
+    Returns False: the record stays queued.
+    """
+    attempt = receive_count(record)
+    metrics.incr("delivery_retries")
+    delay = backoff_seconds(min(attempt, MAX_RETRY_ATTEMPTS))
+    logger.warning("%s; retry %d in %ds, in place", reason, attempt, delay)
+    defer_record(record, delay)
+    return False
+
+
+def defer_record(record, seconds=None):
+    """ leaves a record in its queue, invisible for seconds (default: a jittered backpressure delay) """
+    metrics.incr("deferred")
+    SQSService(queue_url=get_queue_url(record['eventSourceARN']), region_name="us-east-1") \
+        .change_visibility(record['receiptHandle'], defer_seconds() if seconds is None else seconds)
+
+
+def release_record(record):
+    """ makes a record left for a later invocation visible again now, rather than after its visibility timeout """
+    SQSService(queue_url=get_queue_url(record['eventSourceARN']), region_name="us-east-1") \
+        .change_visibility(record['receiptHandle'], 0)
+
+
+def receive_high_lane_records(queue_url, max_records):
+    """
+    Receives up to max_records waiting messages from the user's high-priority lane,
+    shaped like the Lambda SQS records of an event source mapping.
+    """
+    high_lane_url = lane_queue_url(queue_url, HIGH)
+    sqs_service = SQSService(queue_url=high_lane_url, region_name="us-east-1")
+    queue_arn = get_queue_arn(high_lane_url)
+    records = []
+    while len(records) < max_records:
+        messages = sqs_service.receive_messages(max_messages=min(10, max_records - len(records)), wait_time_seconds=0)
+        if not messages:
+            break
+        for message in messages:
+            records.append(SQSRecord({
+                "messageId": message["MessageId"],
+                "receiptHandle": message["ReceiptHandle"],
+                "body": message["Body"],
+                "attributes": message.get("Attributes", {}),
+                "messageAttributes": {
+                    name: {"stringValue": value.get("StringValue"), "dataType": value.get("DataType")}
+                    for name, value in message.get("MessageAttributes", {}).items()
+                },
+                "eventSource": "aws:sqs",
+                "eventSourceARN": queue_arn,
+            }))
+    return records
+
 
 def delete_record_from_queue(record, queue_url=None):
     """ deletes event from queue """
@@ -47,7 +208,7 @@ def delete_record_from_queue(record, queue_url=None):
     try:
         sqs_service.delete_message(receipt_handle)
     except Exception as e:
-        print(f"Error deleting message: {str(e)}")
+        logger.error("Error deleting message: %s", e, exc_info=True)
 
 
 def get_queue_url(queue_arn):
@@ -60,9 +221,16 @@ def get_queue_url(queue_arn):
     # Construct queue URL
     queue_url = f"https://sqs.{region}.amazonaws.com/{account_id}/{queue_name}"
 
-    print(f"Queue URL: {queue_url}")
+    logger.debug("Queue URL: %s", queue_url)
     return queue_url
 
+
+def get_queue_arn(queue_url):
+    """ returns queue arn """
+    _, _, host, account_id, queue_name = queue_url.split("/")
+    region = host.split(".")[1]
+    return f"arn:aws:sqs:{region}:{account_id}:{queue_name}"
+
 if __name__ == "__main__":
     main()
 
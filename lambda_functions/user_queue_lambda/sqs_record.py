@@ -0,0 +1,65 @@
+import json
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator
+
+from instrumentation import metrics
+
+_UNPARSED = object()
+
+
+class SQSRecord(Mapping):
+    """
+    A Lambda SQS record whose JSON body is parsed on first use, at most once.
+
+    Reads like the record dict (record["messageId"], record.get("messageAttributes")),
+    so the tracing, idempotency and failure helpers take it unchanged; record["body"]
+    is the body as delivered. The parsed event is .body, the text to forward
+    is .raw_body: a hop that does not change the event sends the text it received
+    instead of encoding it again. Records whose body is already decoded (e.g. built
+    by hand) are accepted too.
+    """
+
+    __slots__ = ("record", "_body")
+
+    def __init__(self, record: Dict[str, Any]):
+        self.record = record
+        self._body = _UNPARSED
+
+    def __getitem__(self, key: str) -> Any:
+        return self.record[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.record)
+
+    def __len__(self) -> int:
+        return len(self.record)
+
+    @property
+    def message_id(self) -> str:
+        return self.record["messageId"]
+
+    @property
+    def body(self) -> Any:
+        """The decoded event (raises ValueError if the body is not JSON)."""
+        if self._body is _UNPARSED:
+            raw = self.record["body"]
+            if isinstance(raw, (str, bytes)):
+                metrics.incr("body_parses")
+                raw = json.loads(raw)
+            self._body = raw
+        return self._body
+
+    @property
+    def raw_body(self) -> str:
+        """The body as JSON text: the delivered text itself unless it arrived decoded."""
+        raw = self.record["body"]
+        if isinstance(raw, bytes):
+            return raw.decode("utf-8")
+        if isinstance(raw, str):
+            return raw
+        return json.dumps(raw)
+
+
+def wrap(record) -> SQSRecord:
+    """record as an SQSRecord (unchanged if it already is one)."""
+    return record if isinstance(record, SQSRecord) else SQSRecord(record)
@@ -0,0 +1,50 @@
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+# SQS message attributes / HTTP headers carrying the trace context
+TRACE_ID_ATTRIBUTE = "trace_id"
+TRACE_HOPS_ATTRIBUTE = "trace_hops"
+TRACE_ID_HEADER = "X-Trace-Id"
+TRACE_HOPS_HEADER = "X-Trace-Hops"
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def add_hop(hops: str, name: str, timestamp_ms: Optional[int] = None) -> str:
+    """
+    Append a hop to the trace hop list.
+
+    Hops are serialized as "ingest=1700000000000;master_in=1700000000042", one
+    wall clock timestamp (epoch ms) per place the event passed through.
+    """
+    hop = f"{name}={timestamp_ms if timestamp_ms is not None else now_ms()}"
+    return f"{hops};{hop}" if hops else hop
+
+
+def trace_from_record(record: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Read (trace_id, hops) from a Lambda SQS record.
+
+    Events published without a trace context get a fresh trace ID here so the
+    rest of the pipeline can still be correlated.
+    """
+    attributes = record.get("messageAttributes") or {}
+    trace_id = (attributes.get(TRACE_ID_ATTRIBUTE) or {}).get("stringValue") or uuid.uuid4().hex
+    hops = (attributes.get(TRACE_HOPS_ATTRIBUTE) or {}).get("stringValue") or ""
+    return trace_id, hops
+
+
+def trace_attributes(trace_id: str, hops: str) -> Dict[str, Dict[str, str]]:
+    """SQS MessageAttributes (boto3 format) carrying the trace context."""
+    return {
+        TRACE_ID_ATTRIBUTE: {"DataType": "String", "StringValue": trace_id},
+        TRACE_HOPS_ATTRIBUTE: {"DataType": "String", "StringValue": hops},
+    }
+
+
+def trace_headers(trace_id: str, hops: str) -> Dict[str, str]:
+    """HTTP headers carrying the trace context."""
+    return {TRACE_ID_HEADER: trace_id, TRACE_HOPS_HEADER: hops}
@@ -1,5 +1,8 @@
-import json
+import db
+import startup
+from instrumentation import logger, metrics
 from main import main
+from sqs_service import get_sqs_client
 
 def lambda_handler(event, context):
     """
@@ -9,10 +12,7 @@ def lambda_handler(event, context):
         {
           "messageId": "19dd0b57-b21e-4ac1-bd88-01bbb068cb78",
           "receiptHandle": "MessageReceiptHandle",
-          "body": {
-            "event_type": "test2"
-            "strategy": "test_strat_ut"
-           },
+          "body": "{\\"event_type\\": \\"test2\\", \\"strategy\\": \\"test_strat_ut\\"}",
           "attributes": {
             "ApproximateReceiveCount": "1",
             "SentTimestamp": "1523232000000",
@@ -29,13 +29,25 @@ def lambda_handler(event, context):
     }
     """
 
-    print(event)
-    main(event)
-    
+    logger.debug("event: %s", event)
+    try:
+        with metrics.timer("invocation"):
+            held_back = main(event, context)
+    finally:
+        metrics.flush()
+
+    # Records held back by backpressure or the time budget stay in the queue (needs ReportBatchItemFailures on the mapping)
     return {
         'statusCode': 200,
-        'body': 'Messages processed successfully.'
+        'body': 'Messages processed successfully.',
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in held_back],
     }
 
 
+def prime():
+    """Cold-start work, done at init: the SQS client and the MySQL driver (connections open per container on first use)."""
+    get_sqs_client()
+    db._pymysql()
+
 
+startup.register(prime)
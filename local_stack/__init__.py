@@ -0,0 +1,3 @@
+from .mysql import SQLiteDatabase
+from .sqs import LocalSQS
+from .harness import LambdaContext, Package, Pipeline, QueuePoller, UserServiceServer, load_package
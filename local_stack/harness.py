@@ -0,0 +1,400 @@
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from .mysql import SQLiteDatabase
+from .sqs import LocalSQS
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+MASTER_DIR = ROOT_DIR / "lambda_functions" / "master"
+USER_QUEUE_DIR = ROOT_DIR / "lambda_functions" / "user_queue_lambda"
+USER_SERVICE_DIR = ROOT_DIR / "user_service"
+
+DEFAULT_INGEST_QUEUE_URL = os.environ.get(
+    "SQS_QUEUE_URL", "https://sqs.ap-south-1.amazonaws.com/428590250375/Testing.fifo"
+)
+
+
+class Package:
+    """A deployment directory (Lambda or user_service) imported in isolation."""
+
+    def __init__(self, directory: str, entry_module, modules: Dict[str, Any]):
+        self.directory = directory
+        self.entry_module = entry_module
+        self.modules = modules
+
+    @property
+    def handler(self) -> Callable:
+        return self.entry_module.lambda_handler
+
+    def module(self, name: str):
+        return self.modules[name]
+
+
+def load_package(directory, entry_module: str) -> Package:
+    """
+    Import a deployment directory without letting its flat module names leak.
+
+    The Lambda directories and user_service all ship top level modules with
+    shared names (`main`, `db`, `sqs_service`), so each package is imported with
+    its own directory first on sys.path and its modules are removed from
+    sys.modules afterwards. The entry module keeps references to its own modules,
+    so several packages can run side by side in one process.
+
+    Args:
+        directory: Deployment directory
+        entry_module (str): Module to import (e.g. "master_lambda", "app")
+
+    Returns:
+        Package: The entry module and every module imported from directory
+    """
+    directory = str(Path(directory).resolve())
+    local_names = {path.stem for path in Path(directory).glob("*.py")}
+    shadowed = {name: sys.modules.pop(name) for name in local_names if name in sys.modules}
+    modules = {}
+    sys.path.insert(0, directory)
+    try:
+        entry = importlib.import_module(entry_module)
+        modules = {
+            name: module for name, module in list(sys.modules.items())
+            if os.path.dirname(getattr(module, "__file__", None) or "") == directory
+        }
+    finally:
+        sys.path.remove(directory)
+        for name in set(modules) | local_names:
+            sys.modules.pop(name, None)
+        sys.modules.update(shadowed)
+
+    # Modules imported by name at runtime (ACL functions) still need to resolve
+    if directory not in sys.path:
+        sys.path.append(directory)
+    return Package(directory, entry, modules)
+
+
+class LambdaContext:
+    """Minimal stand-in for the Lambda context object."""
+
+    def __init__(self, function_name: str, timeout_seconds: float = 900):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+def to_lambda_record(message: Dict[str, Any], queue_arn: str, region: str, decode_body: bool = False) -> Dict[str, Any]:
+    """
+    Convert a ReceiveMessage entry into the record shape Lambda delivers for SQS.
+
+    The body stays the JSON text, as Lambda delivers it; decode_body hands the
+    handlers an already decoded body instead.
+    """
+    body = message["Body"]
+    if decode_body:
+        body = json.loads(body)
+    message_attributes = {
+        name: {
+            "stringValue": value.get("StringValue"),
+            "binaryValue": value.get("BinaryValue"),
+            "stringListValues": [],
+            "binaryListValues": [],
+            "dataType": value["DataType"],
+        }
+        for name, value in message.get("MessageAttributes", {}).items()
+    }
+    return {
+        "messageId": message["MessageId"],
+        "receiptHandle": message["ReceiptHandle"],
+        "body": body,
+        "attributes": message["Attributes"],
+        "messageAttributes": message_attributes,
+        "md5OfBody": message["MD5OfBody"],
+        "eventSource": "aws:sqs",
+        "eventSourceARN": queue_arn,
+        "awsRegion": region,
+    }
+
+
+class QueuePoller:
+    """
+    Plays the role of a Lambda SQS event source mapping for one queue.
+
+    Receives batches, invokes the handler and, like the real mapping, deletes the
+    whole batch when the handler returns. If the handler raises, the batch stays
+    in flight and is redelivered once its visibility timeout expires. With
+    report_batch_item_failures, records listed in the handler's batchItemFailures
+    are left in the queue and the rest are deleted.
+    """
+
+    def __init__(self, sqs: LocalSQS, queue_url: str, handler: Callable, function_name: str,
+                 batch_size: int = 10, wait_time_seconds: int = 1, timeout_seconds: float = 900,
+                 decode_body: bool = False, report_batch_item_failures: bool = False):
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.queue_arn = sqs.queue_arn(queue_url)
+        self.region = self.queue_arn.split(":")[3]
+        self.handler = handler
+        self.function_name = function_name
+        self.batch_size = batch_size
+        self.wait_time_seconds = wait_time_seconds
+        self.timeout_seconds = timeout_seconds
+        self.decode_body = decode_body
+        self.report_batch_item_failures = report_batch_item_failures
+        self.invocations = 0
+        self.errors: List[str] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def poll_once(self, wait_time_seconds: Optional[int] = None) -> int:
+        """Run one receive/invoke/delete cycle. Returns the number of records handled."""
+        wait = self.wait_time_seconds if wait_time_seconds is None else wait_time_seconds
+        response = self.sqs.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=self.batch_size,
+            WaitTimeSeconds=wait,
+            AttributeNames=["All"],
+            MessageAttributeNames=["All"],
+        )
+        messages = response.get("Messages", [])
+        if not messages:
+            return 0
+
+        records = [to_lambda_record(m, self.queue_arn, self.region, self.decode_body) for m in messages]
+        self.invocations += 1
+        try:
+            result = self.handler({"Records": records}, LambdaContext(self.function_name, self.timeout_seconds))
+        except Exception:
+            self.errors.append(traceback.format_exc())
+            return len(records)
+
+        failed = set()
+        if self.report_batch_item_failures and isinstance(result, dict):
+            failed = {item["itemIdentifier"] for item in result.get("batchItemFailures", [])}
+        done = [m for m in messages if m["MessageId"] not in failed]
+        for start in range(0, len(done), 10):
+            self.sqs.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{"Id": str(i), "ReceiptHandle": m["ReceiptHandle"]}
+                         for i, m in enumerate(done[start:start + 10])],
+            )
+        return len(records)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"poller-{self.function_name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll_once()
+
+
+class Pipeline:
+    """
+    The event pipeline wired to a LocalSQS instead of AWS.
+
+    EventService publishes to the ingest queue, a poller feeds the master Lambda
+    from it, and one poller per user queue feeds the user-queue Lambda, which then
+    delivers to the user's user_service over HTTP. The Lambdas use MySQL as
+    configured through MYSQL_* environment variables unless a SQLiteDatabase is
+    given, in which case every Lambda connection is opened against it.
+
+    Example:
+        pipeline = Pipeline()
+        pipeline.add_user_queue(queue_url_from_users_table)
+        pipeline.start()
+        pipeline.event_service().process_event(BaseEvent(event_type="test2", strategy="s1"))
+        pipeline.drain()
+        pipeline.stop()
+    """
+
+    def __init__(self, sqs: Optional[LocalSQS] = None, ingest_queue_url: str = DEFAULT_INGEST_QUEUE_URL,
+                 batch_size: int = 10, decode_body: bool = False, database: Optional[SQLiteDatabase] = None):
+        self.sqs = sqs or LocalSQS()
+        self.batch_size = batch_size
+        self.decode_body = decode_body
+        self.database = database
+        self.ingest_queue_url = self.sqs.ensure_queue(ingest_queue_url)
+
+        self.master = load_package(MASTER_DIR, "master_lambda")
+        self.user = load_package(USER_QUEUE_DIR, "user_lambda")
+        for package, label in ((self.master, "master"), (self.user, "user_queue")):
+            package.module("sqs_service").set_sqs_client(self.sqs)
+            if database is not None:
+                package.module("db").set_connection_factory(database.connector(label))
+
+        self.pollers = [self._poller(self.ingest_queue_url, self.master.handler, "master")]
+
+    def add_user_queue(self, queue_url: str, attributes: Optional[Dict[str, str]] = None,
+                       priority_lanes: bool = False) -> QueuePoller:
+        """
+        Create a user queue and attach a user-queue Lambda poller to it.
+
+        With priority_lanes, the user's "<name>-high.fifo" lane queue and its poller are created too.
+        """
+        self.sqs.ensure_queue(queue_url, attributes)
+        poller = self._poller(queue_url, self.user.handler, "user_queue")
+        self.pollers.append(poller)
+        if priority_lanes:
+            high_lane_url = self.user.module("lanes").lane_queue_url(queue_url, "high")
+            self.sqs.ensure_queue(high_lane_url, attributes)
+            self.pollers.append(self._poller(high_lane_url, self.user.handler, "user_queue"))
+        return poller
+
+    def enable_retries(self, max_attempts: Optional[int] = None,
+                       base_delay_seconds: Optional[int] = None) -> Dict[str, str]:
+        """
+        Create the standard retry queues of both Lambdas and a shared DLQ, and poll the retry queues.
+        Call before start().
+
+        Returns:
+            dict: fanout_retry, delivery_retry and dlq queue URLs
+        """
+        prefix = f"https://sqs.{self.sqs.region_name}.amazonaws.com/{self.sqs.account_id}"
+        urls = {name: self.sqs.ensure_queue(f"{prefix}/{name.replace('_', '-')}")
+                for name in ("fanout_retry", "delivery_retry", "dlq")}
+        for package, retry_url, function_name in ((self.master, urls["fanout_retry"], "master"),
+                                                  (self.user, urls["delivery_retry"], "user_queue")):
+            failures = package.module("failures")
+            failures.RETRY_QUEUE_URL = retry_url
+            failures.DLQ_URL = urls["dlq"]
+            if max_attempts is not None:
+                failures.MAX_RETRY_ATTEMPTS = max_attempts
+            if base_delay_seconds is not None:
+                failures.RETRY_BASE_DELAY_SECONDS = base_delay_seconds
+            self.pollers.append(self._poller(retry_url, package.handler, function_name))
+        return urls
+
+    def enable_routing_snapshot(self, path: str) -> str:
+        """
+        Build the routing snapshot from the database into path and route the master Lambda from it.
+
+        Returns:
+            str: The snapshot version
+        """
+        from tools.build_routing_snapshot import build, publish
+
+        snapshot = build(self.database.connector("routing_snapshot")())
+        publish(snapshot, path)
+        routing = self.master.module("routing")
+        routing.ROUTING_SNAPSHOT_PATH = path
+        routing.reset()
+        return snapshot["version"]
+
+    def event_service(self):
+        """An EventService whose SQS client is the local stand-in."""
+        from event_generator.services.event_service import EventService
+
+        service = EventService()
+        service.sqs_client = self.sqs
+        return service
+
+    def start(self):
+        for poller in self.pollers:
+            poller.start()
+
+    def stop(self):
+        for poller in self.pollers:
+            poller.stop()
+
+    def drain(self, timeout: float = 30.0) -> bool:
+        """Wait until every polled queue (not the DLQ) is empty. Returns False on timeout."""
+        queue_urls = [poller.queue_url for poller in self.pollers]
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.sqs.is_idle(queue_urls):
+                return True
+            time.sleep(0.01)
+        return self.sqs.is_idle(queue_urls)
+
+    def errors(self) -> List[str]:
+        return [error for poller in self.pollers for error in poller.errors]
+
+    def _poller(self, queue_url: str, handler: Callable, function_name: str) -> QueuePoller:
+        return QueuePoller(self.sqs, queue_url, handler, function_name,
+                           batch_size=self.batch_size, decode_body=self.decode_body,
+                           report_batch_item_failures=True)
+
+
+class UserServiceServer:
+    """
+    user_service running on a background IOLoop, backed by a SQLiteDatabase.
+
+    Listens on an ephemeral localhost port (see `ip_port`) and records every
+    request as (path, status, seconds) in `requests`. Subscriptions are
+    loaded at start(), so seed the database first. USER_SERVICE_TOKEN_PATH must
+    point at the token file before start() imports the service.
+    """
+
+    def __init__(self, database: SQLiteDatabase):
+        from tornado.netutil import bind_sockets
+
+        self.database = database
+        self.requests: List[tuple] = []
+        # Bound up front so the address can be seeded into the users table before start()
+        self._sockets = bind_sockets(0, "127.0.0.1")
+        self.port = self._sockets[0].getsockname()[1]
+        self.package: Optional[Package] = None
+        self._io_loop = None
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ip_port(self) -> str:
+        return f"127.0.0.1:{self.port}"
+
+    def start(self):
+        self._ready.clear()
+        self.package = load_package(USER_SERVICE_DIR, "app")
+        self.package.module("db").set_connection_factory(self.database.connector("user_service"))
+        self._thread = threading.Thread(target=self._run, name="user-service", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self):
+        if self._io_loop is not None:
+            self._io_loop.add_callback(self._io_loop.stop)
+            self._thread.join()
+            self._io_loop = None
+            for sock in self._sockets:
+                sock.close()
+
+    def _run(self):
+        import asyncio
+        from tornado.httpserver import HTTPServer
+        from tornado.ioloop import IOLoop, PeriodicCallback
+
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        app_module = self.package.entry_module
+        db = self.package.module("db").Database()
+        db.connect()
+        app = app_module.Application(db, db.load_subscription_index())
+        self._service_log_function = app.settings.get("log_function")
+        app.settings["log_function"] = self._log_request
+
+        HTTPServer(app).add_sockets(self._sockets)
+        # As app.main does: finished commands free their resources for queued ones
+        poll_interval = self.package.module("config").SCHEDULER_POLL_INTERVAL
+        PeriodicCallback(app.scheduler.poll, poll_interval * 1000).start()
+        self._io_loop = IOLoop.current()
+        self._ready.set()
+        self._io_loop.start()
+
+    def _log_request(self, handler):
+        self.requests.append((handler.request.path, handler.get_status(), handler.request.request_time()))
+        if self._service_log_function:
+            self._service_log_function(handler)
@@ -0,0 +1,203 @@
+import datetime
+import hashlib
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, Optional
+
+# SQLite dialect of the shared MySQL schema, at the latest migration of tools/migrate.py
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username VARCHAR(255) PRIMARY KEY,
+    role TEXT NOT NULL DEFAULT 'user',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    ip_port TEXT NOT NULL,
+    queue_url TEXT NOT NULL,
+    token TEXT NOT NULL,
+    queue_url_hash CHAR(64) AS (SHA2(queue_url, 256)) VIRTUAL
+);
+CREATE INDEX IF NOT EXISTS idx_users_queue_url_hash ON users (queue_url_hash);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    event_type VARCHAR(255) NOT NULL,
+    command TEXT NOT NULL,
+    username VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    filter_expression TEXT NULL,
+    resources TEXT NULL,
+    result_cache TEXT NULL,
+    PRIMARY KEY (event_type, username)
+);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_username ON subscriptions (username);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_updated_at ON subscriptions (updated_at);
+CREATE TABLE IF NOT EXISTS acl_function (
+    function_name VARCHAR(255) PRIMARY KEY,
+    function_path TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS event_acl_mapping (
+    event_type VARCHAR(255) NOT NULL,
+    function_name VARCHAR(255) NOT NULL,
+    PRIMARY KEY (event_type, function_name)
+);
+CREATE TABLE IF NOT EXISTS subscription_tombstones (
+    event_type VARCHAR(255) NOT NULL,
+    username VARCHAR(255) NOT NULL,
+    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (event_type, username)
+);
+CREATE INDEX IF NOT EXISTS idx_tombstones_deleted_at ON subscription_tombstones (deleted_at);
+"""
+
+# pymysql returns TIMESTAMP columns as datetimes and accepts them as parameters
+_TIMESTAMP = re.compile(r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(\.\d+)?$")
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(" "))
+
+_PLACEHOLDER = re.compile(r"%s")
+_ON_DUPLICATE = re.compile(r"ON\s+DUPLICATE\s+KEY\s+UPDATE", re.IGNORECASE)
+_VALUES_FN = re.compile(r"VALUES\((\w+)\)", re.IGNORECASE)
+_EXPLAIN = re.compile(r"^\s*EXPLAIN\s", re.IGNORECASE)
+
+
+def translate(query: str) -> str:
+    """Rewrite the MySQL-isms used by the services into SQLite syntax."""
+    query = _PLACEHOLDER.sub("?", query)
+    query = _EXPLAIN.sub("EXPLAIN QUERY PLAN ", query)
+    if _ON_DUPLICATE.search(query):
+        head, tail = _ON_DUPLICATE.split(query, 1)
+        query = head + "ON CONFLICT DO UPDATE SET" + _VALUES_FN.sub(r"excluded.\1", tail)
+    return query
+
+
+def _sha2(value, bits):
+    """MySQL SHA2() for the 256-bit case the schema uses."""
+    return None if value is None else hashlib.sha256(str(value).encode("utf-8")).hexdigest()
+
+
+def _connect(path: str, **kwargs) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, **kwargs)
+    conn.create_function("SHA2", 2, _sha2, deterministic=True)
+    return conn
+
+
+def _row(row: sqlite3.Row) -> Dict[str, Any]:
+    record = dict(row)
+    for key, value in record.items():
+        if isinstance(value, str) and _TIMESTAMP.match(value):
+            record[key] = datetime.datetime.fromisoformat(value)
+    return record
+
+
+class Cursor:
+    """pymysql DictCursor lookalike over a sqlite3 cursor."""
+
+    def __init__(self, connection: "Connection"):
+        self._connection = connection
+        self._cursor = connection._conn.cursor()
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def execute(self, query: str, args: Optional[Iterable[Any]] = None) -> int:
+        self._connection._count(query)
+        self._cursor.execute(translate(query), tuple(args or ()))
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+        return self.rowcount
+
+    def executemany(self, query: str, args: Iterable[Iterable[Any]]) -> int:
+        self._connection._count(query)
+        self._cursor.executemany(translate(query), [tuple(a) for a in args])
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def fetchone(self) -> Optional[Dict[str, Any]]:
+        row = self._cursor.fetchone()
+        return _row(row) if row is not None else None
+
+    def fetchall(self):
+        return [_row(row) for row in self._cursor.fetchall()]
+
+    def close(self):
+        self._cursor.close()
+
+
+class Connection:
+    """pymysql Connection lookalike; autocommit like the services' connections."""
+
+    def __init__(self, database: "SQLiteDatabase", label: str):
+        self._database = database
+        self._label = label
+        self._conn = _connect(database.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self.open = True
+
+    def cursor(self) -> Cursor:
+        return Cursor(self)
+
+    def commit(self):
+        if self._conn.in_transaction:
+            self._conn.execute("COMMIT")
+
+    def rollback(self):
+        if self._conn.in_transaction:
+            self._conn.execute("ROLLBACK")
+
+    def begin(self):
+        self._conn.execute("BEGIN")
+
+    def ping(self, reconnect: bool = True):
+        return True
+
+    def close(self):
+        if self.open:
+            self._conn.close()
+            self.open = False
+
+    def _count(self, query: str):
+        self._database.count(self._label, query)
+
+
+class SQLiteDatabase:
+    """
+    A SQLite file standing in for the shared MySQL database.
+
+    `connector(label)` returns a pymysql.connect-compatible factory for the
+    services' `set_connection_factory` hooks. Every statement is counted per
+    label, so callers can attribute DB round trips to a stage.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.queries = Counter()
+        self.connections = Counter()
+        self._lock = threading.Lock()
+        with _connect(path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def connector(self, label: str):
+        def connect(**kwargs) -> Connection:
+            with self._lock:
+                self.connections[label] += 1
+            return Connection(self, label)
+        return connect
+
+    def count(self, label: str, query: str):
+        with self._lock:
+            self.queries[label] += 1
+
+    def executemany(self, query: str, rows: Iterable[Iterable[Any]]):
+        """Seed helper that bypasses the query counters."""
+        with _connect(self.path) as conn:
+            conn.executemany(translate(query), [tuple(r) for r in rows])
+
+    def reset_stats(self):
+        with self._lock:
+            self.queries.clear()
+            self.connections.clear()
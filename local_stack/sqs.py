@@ -0,0 +1,384 @@
+import hashlib
+import itertools
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from botocore.exceptions import ClientError
+
+DEDUPLICATION_WINDOW_SECONDS = 300
+DEFAULT_VISIBILITY_TIMEOUT = 30
+MAX_BATCH_ENTRIES = 10
+
+
+def _error(operation: str, code: str, message: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+class _Message:
+    """A single message stored in a local queue."""
+
+    __slots__ = (
+        "message_id", "body", "md5", "group_id", "dedup_id", "attributes",
+        "sequence_number", "sent_at", "visible_at", "receive_count",
+        "first_receive_at", "receipt_handle",
+    )
+
+    def __init__(self, body, group_id, dedup_id, attributes, sequence_number, sent_at, visible_at):
+        self.message_id = str(uuid.uuid4())
+        self.body = body
+        self.md5 = hashlib.md5(body.encode("utf-8")).hexdigest()
+        self.group_id = group_id
+        self.dedup_id = dedup_id
+        self.attributes = attributes or {}
+        self.sequence_number = sequence_number
+        self.sent_at = sent_at
+        self.visible_at = visible_at
+        self.receive_count = 0
+        self.first_receive_at = None
+        self.receipt_handle = None
+
+
+class _Queue:
+    """State of one local queue: messages in send order plus the dedup window."""
+
+    def __init__(self, url: str, arn: str, attributes: Dict[str, str]):
+        self.url = url
+        self.arn = arn
+        self.fifo = url.endswith(".fifo")
+        self.visibility_timeout = int(attributes.get("VisibilityTimeout", DEFAULT_VISIBILITY_TIMEOUT))
+        self.delay_seconds = int(attributes.get("DelaySeconds", 0))
+        self.content_based_dedup = attributes.get("ContentBasedDeduplication", "false").lower() == "true"
+        self.attributes = dict(attributes)
+        self.messages: "OrderedDict[str, _Message]" = OrderedDict()
+        self.receipts: Dict[str, str] = {}
+        self.dedup: Dict[str, tuple] = {}
+
+
+class LocalSQS:
+    """
+    In-process, boto3-compatible stand-in for the SQS client.
+
+    Implements the subset of the SQS API used by the services: FIFO queues with
+    MessageGroupId ordering, the 5 minute deduplication window, visibility
+    timeouts, long polling and the batch send/delete/visibility calls. Queues are
+    keyed by URL, so the URLs derived from Lambda event source ARNs resolve to the
+    same queue as the URLs stored in the users table.
+
+    Every call is counted in `stats` so harnesses can report API calls per event,
+    and `listeners` are called as listener(action, queue_url, message) when a
+    message is "sent" or "deleted", for measuring time spent in each queue.
+    """
+
+    def __init__(self, region_name: str = "us-east-1", account_id: str = "000000000000",
+                 clock: Callable[[], float] = time.time):
+        self.region_name = region_name
+        self.account_id = account_id
+        self.clock = clock
+        self.stats = Counter()
+        self.listeners: List[Callable[[str, str, _Message], None]] = []
+        self._queues: Dict[str, _Queue] = {}
+        self._sequence = itertools.count(1)
+        self._cond = threading.Condition()
+
+    # Queue management
+
+    def create_queue(self, QueueName: str, Attributes: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        url = f"https://sqs.{self.region_name}.amazonaws.com/{self.account_id}/{QueueName}"
+        self.ensure_queue(url, Attributes)
+        return {"QueueUrl": url}
+
+    def ensure_queue(self, queue_url: str, attributes: Optional[Dict[str, str]] = None) -> str:
+        """
+        Register a queue by its full URL if it does not exist yet.
+
+        Args:
+            queue_url (str): https://sqs.<region>.amazonaws.com/<account>/<name>
+            attributes (dict, optional): SQS queue attributes (VisibilityTimeout, ...)
+
+        Returns:
+            str: The queue URL
+        """
+        with self._cond:
+            if queue_url not in self._queues:
+                region, account_id, name = self._parse_url(queue_url)
+                arn = f"arn:aws:sqs:{region}:{account_id}:{name}"
+                self._queues[queue_url] = _Queue(queue_url, arn, attributes or {})
+        return queue_url
+
+    def get_queue_url(self, QueueName: str, QueueOwnerAWSAccountId: Optional[str] = None) -> Dict[str, str]:
+        account_id = QueueOwnerAWSAccountId or self.account_id
+        for queue in self._queues.values():
+            if queue.url.endswith(f"/{account_id}/{QueueName}"):
+                return {"QueueUrl": queue.url}
+        raise _error("GetQueueUrl", "AWS.SimpleQueueService.NonExistentQueue", f"Queue {QueueName} does not exist")
+
+    def queue_arn(self, queue_url: str) -> str:
+        return self._queue("GetQueueAttributes", queue_url).arn
+
+    def get_queue_attributes(self, QueueUrl: str, AttributeNames: Optional[List[str]] = None) -> Dict[str, Any]:
+        queue = self._queue("GetQueueAttributes", QueueUrl)
+        with self._cond:
+            now = self.clock()
+            visible = sum(1 for m in queue.messages.values() if m.visible_at <= now)
+            in_flight = sum(1 for m in queue.messages.values() if m.receive_count > 0 and m.visible_at > now)
+            delayed = sum(1 for m in queue.messages.values() if m.receive_count == 0 and m.visible_at > now)
+        attributes = dict(queue.attributes)
+        attributes.update({
+            "QueueArn": queue.arn,
+            "FifoQueue": str(queue.fifo).lower(),
+            "VisibilityTimeout": str(queue.visibility_timeout),
+            "ApproximateNumberOfMessages": str(visible),
+            "ApproximateNumberOfMessagesNotVisible": str(in_flight),
+            "ApproximateNumberOfMessagesDelayed": str(delayed),
+        })
+        if AttributeNames and "All" not in AttributeNames:
+            attributes = {k: v for k, v in attributes.items() if k in AttributeNames}
+        return {"Attributes": attributes}
+
+    def purge_queue(self, QueueUrl: str) -> Dict[str, Any]:
+        queue = self._queue("PurgeQueue", QueueUrl)
+        with self._cond:
+            queue.messages.clear()
+            queue.receipts.clear()
+        return {}
+
+    def is_idle(self, queue_urls: Optional[Iterable[str]] = None) -> bool:
+        """True when no queue (of queue_urls, default all) holds a message, visible, delayed or in flight."""
+        with self._cond:
+            queues = self._queues.values() if queue_urls is None else [self._queues[url] for url in queue_urls]
+            return all(not queue.messages for queue in queues)
+
+    # Sending
+
+    def send_message(self, QueueUrl: str, MessageBody: str, MessageGroupId: Optional[str] = None,
+                     MessageDeduplicationId: Optional[str] = None, DelaySeconds: int = 0,
+                     MessageAttributes: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        self.stats["SendMessage"] += 1
+        queue = self._queue("SendMessage", QueueUrl)
+        with self._cond:
+            result = self._enqueue("SendMessage", queue, MessageBody, MessageGroupId,
+                                   MessageDeduplicationId, DelaySeconds, MessageAttributes)
+            self._cond.notify_all()
+        return result
+
+    def send_message_batch(self, QueueUrl: str, Entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        self.stats["SendMessageBatch"] += 1
+        queue = self._queue("SendMessageBatch", QueueUrl)
+        self._check_batch("SendMessageBatch", Entries)
+        successful, failed = [], []
+        with self._cond:
+            for entry in Entries:
+                try:
+                    result = self._enqueue(
+                        "SendMessageBatch", queue, entry["MessageBody"], entry.get("MessageGroupId"),
+                        entry.get("MessageDeduplicationId"), entry.get("DelaySeconds", 0),
+                        entry.get("MessageAttributes"),
+                    )
+                    successful.append({"Id": entry["Id"], **result})
+                except ClientError as e:
+                    failed.append({"Id": entry["Id"], "SenderFault": True,
+                                   "Code": e.response["Error"]["Code"], "Message": e.response["Error"]["Message"]})
+            self._cond.notify_all()
+        return {"Successful": successful, "Failed": failed}
+
+    def _enqueue(self, operation, queue, body, group_id, dedup_id, delay_seconds, attributes):
+        if queue.fifo:
+            if not group_id:
+                raise _error(operation, "MissingParameter", "MessageGroupId is required for FIFO queues")
+            if delay_seconds:
+                raise _error(operation, "InvalidParameterValue",
+                             "DelaySeconds is not supported per message on FIFO queues")
+            if not dedup_id:
+                if not queue.content_based_dedup:
+                    raise _error(operation, "InvalidParameterValue",
+                                 "The queue should either have ContentBasedDeduplication enabled "
+                                 "or MessageDeduplicationId provided explicitly")
+                dedup_id = hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+        now = self.clock()
+        if dedup_id:
+            previous = queue.dedup.get(dedup_id)
+            if previous and previous[0] > now:
+                self.stats["Deduplicated"] += 1
+                return {"MessageId": previous[1], "MD5OfMessageBody": previous[2]}
+
+        delay = delay_seconds or queue.delay_seconds
+        message = _Message(body, group_id, dedup_id, attributes, next(self._sequence), now, now + delay)
+        queue.messages[message.message_id] = message
+        self._notify("sent", queue, message)
+        if dedup_id:
+            queue.dedup[dedup_id] = (now + DEDUPLICATION_WINDOW_SECONDS, message.message_id, message.md5)
+        result = {"MessageId": message.message_id, "MD5OfMessageBody": message.md5}
+        if queue.fifo:
+            result["SequenceNumber"] = str(message.sequence_number)
+        return result
+
+    # Receiving
+
+    def receive_message(self, QueueUrl: str, MaxNumberOfMessages: int = 1, WaitTimeSeconds: int = 0,
+                        VisibilityTimeout: Optional[int] = None, AttributeNames: Optional[List[str]] = None,
+                        MessageAttributeNames: Optional[List[str]] = None, **kwargs) -> Dict[str, Any]:
+        self.stats["ReceiveMessage"] += 1
+        queue = self._queue("ReceiveMessage", QueueUrl)
+        if not 1 <= MaxNumberOfMessages <= MAX_BATCH_ENTRIES:
+            raise _error("ReceiveMessage", "InvalidParameterValue", "MaxNumberOfMessages must be between 1 and 10")
+        visibility = queue.visibility_timeout if VisibilityTimeout is None else VisibilityTimeout
+        deadline = time.monotonic() + WaitTimeSeconds
+
+        with self._cond:
+            while True:
+                now = self.clock()
+                taken = self._take_visible(queue, MaxNumberOfMessages, now)
+                remaining = deadline - time.monotonic()
+                if taken or remaining <= 0:
+                    break
+                self._cond.wait(min(remaining, 0.05))
+
+            messages = []
+            for message in taken:
+                message.receive_count += 1
+                if message.first_receive_at is None:
+                    message.first_receive_at = now
+                if message.receipt_handle:
+                    queue.receipts.pop(message.receipt_handle, None)
+                message.receipt_handle = f"{message.message_id}#{uuid.uuid4().hex}"
+                queue.receipts[message.receipt_handle] = message.message_id
+                message.visible_at = now + visibility
+                messages.append(self._render(message))
+        return {"Messages": messages} if messages else {}
+
+    def _take_visible(self, queue: _Queue, limit: int, now: float) -> List[_Message]:
+        taken, blocked = [], set()
+        for message in queue.messages.values():
+            if queue.fifo and message.group_id in blocked:
+                continue
+            if message.visible_at > now:
+                # An in-flight or delayed message holds back the rest of its group
+                if queue.fifo:
+                    blocked.add(message.group_id)
+                continue
+            taken.append(message)
+            if len(taken) == limit:
+                break
+        return taken
+
+    def _render(self, message: _Message) -> Dict[str, Any]:
+        attributes = {
+            "SenderId": self.account_id,
+            "SentTimestamp": str(int(message.sent_at * 1000)),
+            "ApproximateReceiveCount": str(message.receive_count),
+            "ApproximateFirstReceiveTimestamp": str(int(message.first_receive_at * 1000)),
+        }
+        if message.group_id:
+            attributes["MessageGroupId"] = message.group_id
+            attributes["SequenceNumber"] = str(message.sequence_number)
+        if message.dedup_id:
+            attributes["MessageDeduplicationId"] = message.dedup_id
+        rendered = {
+            "MessageId": message.message_id,
+            "ReceiptHandle": message.receipt_handle,
+            "MD5OfBody": message.md5,
+            "Body": message.body,
+            "Attributes": attributes,
+        }
+        if message.attributes:
+            rendered["MessageAttributes"] = message.attributes
+        return rendered
+
+    # Deleting and visibility
+
+    def delete_message(self, QueueUrl: str, ReceiptHandle: str) -> Dict[str, Any]:
+        self.stats["DeleteMessage"] += 1
+        queue = self._queue("DeleteMessage", QueueUrl)
+        with self._cond:
+            self._delete(queue, ReceiptHandle)
+            self._cond.notify_all()
+        return {}
+
+    def delete_message_batch(self, QueueUrl: str, Entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        self.stats["DeleteMessageBatch"] += 1
+        queue = self._queue("DeleteMessageBatch", QueueUrl)
+        self._check_batch("DeleteMessageBatch", Entries)
+        successful, failed = [], []
+        with self._cond:
+            for entry in Entries:
+                try:
+                    self._delete(queue, entry["ReceiptHandle"])
+                    successful.append({"Id": entry["Id"]})
+                except ClientError as e:
+                    failed.append({"Id": entry["Id"], "SenderFault": True,
+                                   "Code": e.response["Error"]["Code"], "Message": e.response["Error"]["Message"]})
+            self._cond.notify_all()
+        return {"Successful": successful, "Failed": failed}
+
+    def _delete(self, queue: _Queue, receipt_handle: str):
+        if "#" not in receipt_handle:
+            raise _error("DeleteMessage", "ReceiptHandleIsInvalid", f"The receipt handle {receipt_handle} is not valid")
+        # Deleting an already deleted message or using a stale handle succeeds, as in SQS
+        message_id = queue.receipts.pop(receipt_handle, None)
+        message = queue.messages.pop(message_id, None) if message_id else None
+        if message is not None:
+            self._notify("deleted", queue, message)
+
+    def change_message_visibility(self, QueueUrl: str, ReceiptHandle: str, VisibilityTimeout: int) -> Dict[str, Any]:
+        self.stats["ChangeMessageVisibility"] += 1
+        queue = self._queue("ChangeMessageVisibility", QueueUrl)
+        with self._cond:
+            self._change_visibility(queue, ReceiptHandle, VisibilityTimeout)
+            self._cond.notify_all()
+        return {}
+
+    def change_message_visibility_batch(self, QueueUrl: str, Entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        self.stats["ChangeMessageVisibilityBatch"] += 1
+        queue = self._queue("ChangeMessageVisibilityBatch", QueueUrl)
+        self._check_batch("ChangeMessageVisibilityBatch", Entries)
+        successful, failed = [], []
+        with self._cond:
+            for entry in Entries:
+                try:
+                    self._change_visibility(queue, entry["ReceiptHandle"], entry["VisibilityTimeout"])
+                    successful.append({"Id": entry["Id"]})
+                except ClientError as e:
+                    failed.append({"Id": entry["Id"], "SenderFault": True,
+                                   "Code": e.response["Error"]["Code"], "Message": e.response["Error"]["Message"]})
+            self._cond.notify_all()
+        return {"Successful": successful, "Failed": failed}
+
+    def _change_visibility(self, queue: _Queue, receipt_handle: str, timeout: int):
+        message_id = queue.receipts.get(receipt_handle)
+        message = queue.messages.get(message_id) if message_id else None
+        if message is None or message.visible_at <= self.clock():
+            raise _error("ChangeMessageVisibility", "MessageNotInflight", "Message is not in flight")
+        message.visible_at = self.clock() + timeout
+
+    # Helpers
+
+    def _notify(self, action: str, queue: _Queue, message: _Message):
+        for listener in self.listeners:
+            listener(action, queue.url, message)
+
+    def _queue(self, operation: str, queue_url: str) -> _Queue:
+        queue = self._queues.get(queue_url)
+        if queue is None:
+            raise _error(operation, "AWS.SimpleQueueService.NonExistentQueue", f"Queue {queue_url} does not exist")
+        return queue
+
+    @staticmethod
+    def _check_batch(operation: str, entries: List[Dict[str, Any]]):
+        if not entries:
+            raise _error(operation, "AWS.SimpleQueueService.EmptyBatchRequest", "No entries in batch")
+        if len(entries) > MAX_BATCH_ENTRIES:
+            raise _error(operation, "AWS.SimpleQueueService.TooManyEntriesInBatchRequest",
+                         "Maximum number of entries per request are 10")
+        ids = [entry["Id"] for entry in entries]
+        if len(set(ids)) != len(ids):
+            raise _error(operation, "AWS.SimpleQueueService.BatchEntryIdsNotDistinct", "Batch entry ids must be distinct")
+
+    @staticmethod
+    def _parse_url(queue_url: str):
+        # https://sqs.<region>.amazonaws.com/<account>/<name>
+        host, account_id, name = queue_url.split("://", 1)[-1].split("/")[:3]
+        return host.split(".")[1], account_id, name
@@ -0,0 +1,95 @@
+import itertools
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from local_stack.harness import USER_SERVICE_DIR, load_package
+
+_mtimes = itertools.count(1_700_000_000)
+
+
+@pytest.fixture(scope="module")
+def auth(tmp_path_factory):
+    # The module authenticates against USER_SERVICE_TOKEN_PATH as soon as it is imported
+    path = tmp_path_factory.mktemp("auth") / "token"
+    path.write_text("import-token\n")
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("USER_SERVICE_TOKEN_PATH", str(path))
+        return load_package(USER_SERVICE_DIR, "auth").module("auth")
+
+
+@pytest.fixture
+def clock(auth, monkeypatch):
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(auth, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def write(path, *lines):
+    """Rewrites the token file with a distinct modification time, as a later edit would have."""
+    path.write_text("".join(f"{line}\n" for line in lines))
+    mtime = next(_mtimes)
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def token_file(tmp_path):
+    path = tmp_path / "tokens"
+    write(path, "# rotated 2024-01", "old-token", "", "  new-token  ")
+    return path
+
+
+def test_accepts_every_listed_token(auth, token_file, clock):
+    authenticator = auth.TokenAuthenticator(str(token_file), reload_interval=10)
+    assert authenticator.check("Bearer old-token")
+    assert authenticator.check("Bearer new-token")
+    for header in ("Bearer # rotated 2024-01", "Bearer other", "Bearer ", "Basic old-token", "old-token", ""):
+        assert not authenticator.check(header)
+
+
+def test_changes_apply_after_the_reload_interval(auth, token_file, clock):
+    authenticator = auth.TokenAuthenticator(str(token_file), reload_interval=10)
+    assert authenticator.check("Bearer old-token")
+    write(token_file, "new-token")
+    clock.now = 9.9
+    # Still cached until the file is looked at again
+    assert authenticator.check("Bearer old-token")
+    clock.now = 10
+    assert not authenticator.check("Bearer old-token")
+    assert authenticator.check("Bearer new-token")
+
+
+def test_added_token_is_accepted_after_reload(auth, token_file, clock):
+    authenticator = auth.TokenAuthenticator(str(token_file), reload_interval=1)
+    assert not authenticator.check("Bearer added")
+    write(token_file, "old-token", "new-token", "added")
+    clock.now = 1
+    assert authenticator.check("Bearer added")
+
+
+def test_unchanged_file_is_not_reread(auth, token_file, clock, monkeypatch):
+    authenticator = auth.TokenAuthenticator(str(token_file), reload_interval=1)
+    monkeypatch.setattr(auth, "open", lambda *args, **kwargs: pytest.fail("re-read an unchanged file"),
+                        raising=False)
+    clock.now = 5
+    assert authenticator.check("Bearer old-token")
+
+
+@pytest.mark.parametrize("change", ["empty", "missing"])
+def test_unusable_file_keeps_the_current_tokens(auth, token_file, clock, change):
+    authenticator = auth.TokenAuthenticator(str(token_file), reload_interval=1)
+    if change == "empty":
+        write(token_file, "# nothing yet")
+    else:
+        token_file.unlink()
+    clock.now = 1
+    assert authenticator.check("Bearer old-token")
+
+
+def test_starting_without_tokens_fails(auth, tmp_path):
+    with pytest.raises(OSError):
+        auth.TokenAuthenticator(str(tmp_path / "missing"))
+    write(tmp_path / "empty", "# none")
+    with pytest.raises(ValueError):
+        auth.TokenAuthenticator(str(tmp_path / "empty"))
@@ -0,0 +1,75 @@
+import math
+
+import pytest
+
+from local_stack.harness import MASTER_DIR, load_package
+
+master = load_package(MASTER_DIR, "budget")
+budget = master.module("budget")
+metrics = master.module("instrumentation").metrics
+
+
+class Context:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    # The per-record average is kept for the container: start every test without one
+    monkeypatch.setattr(budget, "_record_ms", None)
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_unlimited_without_context():
+    unlimited = budget.Budget()
+    assert unlimited.remaining_ms() == math.inf
+    unlimited.record_done(10 ** 9)
+    assert unlimited.can_start()
+
+
+def test_first_record_only_needs_the_margin():
+    assert budget.Budget(Context(1000), margin_ms=1000).can_start()
+    assert not budget.Budget(Context(999), margin_ms=1000).can_start()
+
+
+def test_records_start_while_the_average_fits():
+    context = Context(1000)
+    limited = budget.Budget(context, margin_ms=100)
+    limited.record_done(400)
+    assert limited.can_start()
+    context.remaining_ms = 499
+    assert not limited.can_start()
+
+
+def test_average_is_smoothed_and_kept_for_the_container():
+    first = budget.Budget(Context(10_000), margin_ms=0)
+    first.record_done(100)
+    first.record_done(600)
+    expected = budget.RECORD_TIME_SMOOTHING * 600 + (1 - budget.RECORD_TIME_SMOOTHING) * 100
+    assert budget._record_ms == pytest.approx(expected)
+    # A later invocation of the same container budgets its first record with it
+    assert not budget.Budget(Context(expected - 1), margin_ms=0).can_start()
+
+
+def test_left_records_are_reported():
+    limited = budget.Budget(Context(10_000), margin_ms=0)
+    limited.leave(["r2", "r3"])
+    limited.report(batch_size=3)
+    assert limited.left == ["r2", "r3"]
+    assert metrics._counters["batch.stopped_early"] == 2
+    assert metrics._gauges["batch.size"] == (3, "Count")
+
+
+def test_recommended_size_is_capped():
+    limited = budget.Budget(Context(10_000), margin_ms=0)
+    limited.records = 1
+    limited.started -= 0.001  # one record in about a millisecond
+    limited.report(batch_size=1)
+    recommended, _ = metrics._gauges["batch.recommended_size"]
+    assert 1 <= recommended <= budget.MAX_RECOMMENDED_BATCH_SIZE
@@ -0,0 +1,61 @@
+import shlex
+import subprocess
+
+import pytest
+
+from local_stack.harness import USER_SERVICE_DIR, load_package
+
+command_template = load_package(USER_SERVICE_DIR, "command_template").module("command_template")
+CommandTemplate = command_template.CommandTemplate
+
+
+def test_renders_values_in_place():
+    template = CommandTemplate("python run.py <strategy> <date>")
+    assert template.placeholders == {"strategy", "date"}
+    assert template.render({"strategy": "s1", "date": "2024-01-02", "unused": "x"}) == "python run.py s1 2024-01-02"
+
+
+@pytest.mark.parametrize("value", [
+    "a b",
+    "it's",
+    "$(rm -rf /)",
+    "`id`",
+    "x; echo pwned",
+    "a && b | c > d",
+    "\"quoted\"",
+    "*",
+    "",
+    "line\nbreak",
+])
+def test_values_stay_one_shell_word(value):
+    rendered = CommandTemplate("run <arg> end").render({"arg": value})
+    assert shlex.split(rendered) == ["run", value, "end"]
+
+
+def test_the_shell_sees_the_value_unchanged():
+    value = "$HOME; echo `id` 'x'"
+    rendered = CommandTemplate("printf %s <arg>").render({"arg": value})
+    assert subprocess.run(rendered, shell=True, capture_output=True, text=True).stdout == value
+
+
+def test_non_string_values_are_rendered_as_text():
+    assert CommandTemplate("run <n> <flag>").render({"n": 3, "flag": True}) == "run 3 True"
+
+
+def test_unquoted_rendering_for_paths():
+    template = CommandTemplate("/data/<date>/prices csv")
+    assert template.render({"date": "a b"}, quote=False) == "/data/a b/prices csv"
+
+
+def test_repeated_placeholder_and_literal_angle_brackets():
+    template = CommandTemplate("cat < in.txt <name> <name> <not-a-placeholder>")
+    assert template.placeholders == {"name"}
+    assert template.render({"name": "x"}) == "cat < in.txt x x <not-a-placeholder>"
+
+
+def test_missing_values_are_reported():
+    template = CommandTemplate("run <b> <a> <c>")
+    with pytest.raises(command_template.MissingPlaceholderError) as error:
+        template.render({"c": 1})
+    assert error.value.missing == ["a", "b"]
+    assert isinstance(error.value, ValueError)
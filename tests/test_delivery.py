@@ -0,0 +1,135 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from local_stack import LocalSQS
+from local_stack.harness import USER_QUEUE_DIR, load_package, to_lambda_record
+
+user_queue = load_package(USER_QUEUE_DIR, "main")
+main = user_queue.module("main")
+failures = user_queue.module("failures")
+
+USER_QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/000000000000/alice.fifo"
+RETRY_QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/000000000000/delivery-retry"
+DLQ_URL = "https://sqs.us-east-1.amazonaws.com/000000000000/dlq"
+USER = {"username": "alice", "ip_port": "127.0.0.1:1", "token": "tok"}
+
+
+class Database:
+    def __init__(self, user=USER):
+        self.user = user
+
+    def init(self):
+        pass
+
+    def fetch_user_by_queue_url(self, queue_url):
+        return self.user if self.user and queue_url == USER_QUEUE_URL else None
+
+
+class ApiClient:
+    """user_service as seen by the Lambda: accepts every POST or none."""
+
+    accept = False
+
+    def post_request(self, ip_port, token, body, headers):
+        return {"status": "ok"} if self.accept else None
+
+
+@pytest.fixture
+def sqs(monkeypatch):
+    sqs = LocalSQS()
+    sqs.ensure_queue(USER_QUEUE_URL)
+    user_queue.module("sqs_service").set_sqs_client(sqs)
+    monkeypatch.setattr(main, "ApiClient", ApiClient)
+    monkeypatch.setattr(main, "node_saturated", lambda ip_port, token: False)
+    # No retry queue or DLQ, as when RETRY_QUEUE_URL and DLQ_URL are unset
+    monkeypatch.setattr(failures, "RETRY_QUEUE_URL", None)
+    monkeypatch.setattr(failures, "DLQ_URL", None)
+    yield sqs
+    user_queue.module("sqs_service").set_sqs_client(None)
+
+
+def queue(sqs, queue_url, event_type="trade"):
+    """Sends an event to queue_url and receives it as the Lambda record of an event source mapping."""
+    sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps({"event_type": event_type}),
+                     MessageGroupId="alice", MessageDeduplicationId=event_type)
+    return receive(sqs, queue_url)
+
+
+def receive(sqs, queue_url):
+    message, = sqs.receive_message(QueueUrl=queue_url, MessageAttributeNames=["All"])["Messages"]
+    return to_lambda_record(message, sqs.queue_arn(queue_url), "us-east-1")
+
+
+def counts(sqs, queue_url):
+    """(visible, in flight) messages of a queue."""
+    attributes = sqs.get_queue_attributes(QueueUrl=queue_url)["Attributes"]
+    return int(attributes["ApproximateNumberOfMessages"]), int(attributes["ApproximateNumberOfMessagesNotVisible"])
+
+
+def held_back(monkeypatch, records, db):
+    """The messageIds main() returns for batchItemFailures."""
+    monkeypatch.setattr(main, "database", SimpleNamespace(shared=lambda: db))
+    return main.main({"Records": records})
+
+
+def test_delivered_record_is_deleted(sqs, monkeypatch):
+    monkeypatch.setattr(ApiClient, "accept", True)
+    record = queue(sqs, USER_QUEUE_URL)
+    assert held_back(monkeypatch, [record], Database()) == []
+    assert counts(sqs, USER_QUEUE_URL) == (0, 0)
+
+
+def test_failed_delivery_is_retried_in_place(sqs, monkeypatch):
+    record = queue(sqs, USER_QUEUE_URL)
+    assert held_back(monkeypatch, [record], Database()) == [record["messageId"]]
+    # Still queued, hidden for the backoff, holding back the rest of its group
+    assert counts(sqs, USER_QUEUE_URL) == (0, 1)
+
+
+def test_in_place_retries_end_in_the_dlq(sqs, monkeypatch):
+    sqs.ensure_queue(DLQ_URL)
+    monkeypatch.setattr(failures, "DLQ_URL", DLQ_URL)
+    record = queue(sqs, USER_QUEUE_URL)
+    record["attributes"]["ApproximateReceiveCount"] = str(failures.MAX_RETRY_ATTEMPTS + 1)
+    assert held_back(monkeypatch, [record], Database()) == []
+    assert counts(sqs, USER_QUEUE_URL) == (0, 0)
+    dead_letter = receive(sqs, DLQ_URL)
+    assert dead_letter["messageAttributes"]["failure_stage"]["stringValue"] == "delivery"
+
+
+def test_unordered_failure_moves_to_the_retry_queue(sqs, monkeypatch):
+    sqs.ensure_queue(RETRY_QUEUE_URL)
+    monkeypatch.setattr(failures, "RETRY_QUEUE_URL", RETRY_QUEUE_URL)
+    monkeypatch.setattr(main, "UNORDERED_EVENT_TYPES", {"quote"})
+    record = queue(sqs, USER_QUEUE_URL, "quote")
+    assert held_back(monkeypatch, [record], Database()) == []
+    assert counts(sqs, USER_QUEUE_URL) == (0, 0)
+    retry = sqs.receive_message(QueueUrl=RETRY_QUEUE_URL, MessageAttributeNames=["All"])
+    # Delayed by the backoff
+    assert retry == {}
+    attributes = sqs.get_queue_attributes(QueueUrl=RETRY_QUEUE_URL)["Attributes"]
+    assert attributes["ApproximateNumberOfMessagesDelayed"] == "1"
+
+
+@pytest.mark.parametrize("db, event_type", [
+    (Database(user=None), "trade"),  # unknown user: permanent, dead-lettered right away
+    (Database(), "quote"),  # unordered: handed to the retry queue
+])
+def test_failure_without_retry_queue_or_dlq_stays_queued(sqs, monkeypatch, db, event_type):
+    monkeypatch.setattr(main, "UNORDERED_EVENT_TYPES", {"quote"})
+    record = queue(sqs, USER_QUEUE_URL, event_type)
+    assert held_back(monkeypatch, [record], db) == [record["messageId"]]
+    assert counts(sqs, USER_QUEUE_URL) == (0, 1)
+
+
+@pytest.mark.parametrize("db, event_type", [(Database(user=None), "trade"), (Database(), "quote")])
+def test_failure_whose_hand_off_fails_stays_queued(sqs, monkeypatch, db, event_type):
+    # Configured, but every send to them fails (they do not exist in this SQS)
+    monkeypatch.setattr(failures, "RETRY_QUEUE_URL", RETRY_QUEUE_URL)
+    monkeypatch.setattr(failures, "DLQ_URL", DLQ_URL)
+    monkeypatch.setattr(main, "UNORDERED_EVENT_TYPES", {"quote"})
+    record = queue(sqs, USER_QUEUE_URL, event_type)
+    assert held_back(monkeypatch, [record], db) == [record["messageId"]]
+    assert counts(sqs, USER_QUEUE_URL) == (0, 1)
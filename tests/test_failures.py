@@ -0,0 +1,140 @@
+import json
+
+import pytest
+
+from local_stack import LocalSQS
+from local_stack.harness import MASTER_DIR, load_package, to_lambda_record
+
+master = load_package(MASTER_DIR, "processor")
+failures = master.module("failures")
+processor = master.module("processor")
+SQSRecord = master.module("sqs_record").SQSRecord
+
+PREFIX = "https://sqs.us-east-1.amazonaws.com/000000000000"
+USER_QUEUE_URL = f"{PREFIX}/alice.fifo"
+RETRY_QUEUE_URL = f"{PREFIX}/fanout-retry"
+DLQ_URL = f"{PREFIX}/dlq"
+TRACE = {"trace_id": {"DataType": "String", "StringValue": "t-1"}}
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def sqs(monkeypatch):
+    sqs = LocalSQS(clock=Clock())
+    for url in (USER_QUEUE_URL, RETRY_QUEUE_URL, DLQ_URL):
+        sqs.ensure_queue(url)
+    master.module("sqs_service").set_sqs_client(sqs)
+    monkeypatch.setattr(failures, "RETRY_QUEUE_URL", RETRY_QUEUE_URL)
+    monkeypatch.setattr(failures, "DLQ_URL", DLQ_URL)
+    monkeypatch.setattr(failures, "MAX_RETRY_ATTEMPTS", 3)
+    yield sqs
+    master.module("sqs_service").set_sqs_client(None)
+
+
+def messages(sqs, queue_url):
+    """Everything in a queue as Lambda records, once the longest retry delay has passed."""
+    sqs.clock.now += failures.RETRY_MAX_DELAY_SECONDS
+    response = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10, MessageAttributeNames=["All"])
+    return [to_lambda_record(m, sqs.queue_arn(queue_url), "us-east-1") for m in response.get("Messages", [])]
+
+
+def attribute(record, name):
+    return record["messageAttributes"][name]["stringValue"]
+
+
+def test_failure_is_retried_with_its_context(sqs):
+    assert failures.handle_failure("fanout", "alice", '{"event_type": "t"}', TRACE, 0, "boom") == "retried"
+    retry, = messages(sqs, RETRY_QUEUE_URL)
+    assert retry["body"] == '{"event_type": "t"}'
+    assert failures.retry_attempt(retry) == 1
+    assert failures.retry_destination(retry) == "alice"
+    assert (attribute(retry, "failure_stage"), attribute(retry, "failure_reason")) == ("fanout", "boom")
+    assert attribute(retry, "trace_id") == "t-1"
+    assert messages(sqs, DLQ_URL) == []
+
+
+def test_retry_is_delayed_by_the_backoff(sqs):
+    failures.handle_failure("fanout", "alice", {"event_type": "t"}, {}, 0, "boom")
+    attributes = sqs.get_queue_attributes(QueueUrl=RETRY_QUEUE_URL)["Attributes"]
+    assert attributes["ApproximateNumberOfMessagesDelayed"] == "1"
+
+
+def test_failure_bookkeeping_is_not_forwarded():
+    record = {"messageAttributes": {
+        "trace_id": {"dataType": "String", "stringValue": "t-1"},
+        "retry_attempt": {"dataType": "String", "stringValue": "3"},
+        "failure_reason": {"dataType": "String", "stringValue": "down"},
+    }}
+    assert failures.forwarded_attributes(record) == TRACE
+
+
+def test_retries_run_out_into_the_dlq(sqs):
+    assert failures.handle_failure("delivery", USER_QUEUE_URL, "{}", TRACE, 3, "down") == "dead_lettered"
+    dead_letter, = messages(sqs, DLQ_URL)
+    assert failures.retry_attempt(dead_letter) == 3
+    assert attribute(dead_letter, "replay_queue_url") == RETRY_QUEUE_URL
+    assert int(attribute(dead_letter, "failed_at")) > 0
+    assert messages(sqs, RETRY_QUEUE_URL) == []
+
+
+def test_permanent_failure_skips_the_retries(sqs):
+    assert failures.handle_failure("fanout", "ghost", "{}", {}, 0, "no queue", permanent=True) == "dead_lettered"
+    assert len(messages(sqs, DLQ_URL)) == 1
+
+
+def test_without_queues_nothing_is_handed_off(sqs, monkeypatch):
+    monkeypatch.setattr(failures, "RETRY_QUEUE_URL", None)
+    monkeypatch.setattr(failures, "DLQ_URL", None)
+    assert failures.handle_failure("fanout", "alice", "{}", {}, 0, "boom") is None
+
+
+def test_failed_hand_off_is_reported(sqs, monkeypatch):
+    monkeypatch.setattr(failures, "RETRY_QUEUE_URL", f"{PREFIX}/missing")
+    assert failures.handle_failure("fanout", "alice", "{}", {}, 0, "boom") is None
+
+
+@pytest.mark.parametrize("attempt", range(1, 12))
+def test_backoff_stays_within_its_window(attempt):
+    ceiling = min(failures.RETRY_MAX_DELAY_SECONDS, failures.RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1))
+    for _ in range(50):
+        assert 1 <= failures.backoff_seconds(attempt) <= max(1, ceiling)
+
+
+def fanout_record(**attributes):
+    return SQSRecord({
+        "messageId": "m-1",
+        "body": json.dumps({"event_type": "t", "strategy": "s"}),
+        "attributes": {},
+        "messageAttributes": {name: {"dataType": "String", "stringValue": value} for name, value in attributes.items()},
+    })
+
+
+def test_fan_out_to_a_user_without_queue_is_dead_lettered(sqs):
+    assert not processor.send_event_to_user_queue("ghost", None, fanout_record(), "t-1", "")
+    dead_letter, = messages(sqs, DLQ_URL)
+    assert failures.retry_destination(dead_letter) == "ghost"
+
+
+def test_failed_fan_out_is_retried_for_that_user_alone(sqs):
+    assert processor.send_event_to_user_queue("alice", USER_QUEUE_URL, fanout_record(), "t-1", "")
+    assert not processor.send_event_to_user_queue("bob", f"{PREFIX}/missing.fifo", fanout_record(), "t-1", "")
+    retry, = messages(sqs, RETRY_QUEUE_URL)
+    assert failures.retry_destination(retry) == "bob"
+    assert len(messages(sqs, USER_QUEUE_URL)) == 1
+
+
+def test_retry_record_counts_its_attempts(sqs):
+    record = fanout_record(retry_attempt="2", retry_destination="bob")
+    assert not processor.send_event_to_user_queue("bob", f"{PREFIX}/missing.fifo", record, "t-1", "")
+    retry, = messages(sqs, RETRY_QUEUE_URL)
+    assert failures.retry_attempt(retry) == 3
+    # The last retry failed too
+    assert not processor.send_event_to_user_queue("bob", f"{PREFIX}/missing.fifo", SQSRecord(retry), "t-1", "")
+    assert failures.retry_attempt(messages(sqs, DLQ_URL)[0]) == 3
@@ -0,0 +1,64 @@
+import pytest
+
+from local_stack.harness import USER_SERVICE_DIR, load_package
+
+filters = load_package(USER_SERVICE_DIR, "filters").module("filters")
+FilterIndex = filters.FilterIndex
+
+SUBSCRIBERS = [
+    ("all", None),
+    ("nse", '{"exchange": "NSE"}'),
+    ("indian", '{"exchange": {"in": ["NSE", "BSE"]}}'),
+    ("nifty", '{"symbol": {"prefix": "NIFTY"}}'),
+    ("banknifty", '{"symbol": {"prefix": "BANKNIFTY"}}'),
+    ("nse_nifty", '{"exchange": "NSE", "symbol": {"prefix": "NIFTY"}}'),
+    ("broken", '{"exchange": {"like": "N%"}}'),
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return FilterIndex(SUBSCRIBERS)
+
+
+@pytest.mark.parametrize("event, expected", [
+    ({"exchange": "NSE", "symbol": "NIFTY50"}, ["all", "nse", "indian", "nifty", "nse_nifty", "broken"]),
+    ({"exchange": "BSE", "symbol": "NIFTY50"}, ["all", "indian", "nifty", "broken"]),
+    ({"exchange": "NSE", "symbol": "BANKNIFTY"}, ["all", "nse", "indian", "banknifty", "broken"]),
+    ({"exchange": "LSE", "symbol": "NIFTY"}, ["all", "nifty", "broken"]),
+    ({"symbol": "NIF"}, ["all", "broken"]),
+    ({}, ["all", "broken"]),
+])
+def test_match(index, event, expected):
+    assert index.match(event) == expected
+
+
+def test_match_agrees_with_matches(index):
+    events = [{"exchange": exchange, "symbol": symbol}
+              for exchange in ("NSE", "BSE", None, 1) for symbol in ("NIFTY", "NIFTY50", "BANKNIFTY", "N", None)]
+    for event in events:
+        expected = [username for username, expression in SUBSCRIBERS if username == "broken"
+                    or filters.matches(filters.parse_filter(expression), event)]
+        assert index.match(event) == expected
+
+
+def test_unhashable_values_do_not_match(index):
+    assert index.match({"exchange": ["NSE"], "symbol": {"prefix": "NIFTY"}}) == ["all", "broken"]
+
+
+def test_without_filters_everyone_matches():
+    index = FilterIndex([("a", None), ("b", ""), ("c", "{}")])
+    assert index.match({"anything": 1}) == ["a", "b", "c"]
+    assert len(index) == 3
+
+
+@pytest.mark.parametrize("expression", [
+    "[1]",
+    '{"a": {"eq": [1]}}',
+    '{"a": {"in": []}}',
+    '{"a": {"prefix": ""}}',
+    '{"a": {"eq": 1, "in": [1]}}',
+])
+def test_parse_filter_rejects_malformed(expression):
+    with pytest.raises(ValueError):
+        filters.parse_filter(expression)
@@ -0,0 +1,64 @@
+from event_generator.services.idempotency import idempotency_key
+from local_stack.harness import USER_SERVICE_DIR, load_package
+
+DedupCache = load_package(USER_SERVICE_DIR, "dedup").module("dedup").DedupCache
+
+EVENT = {"event_type": "eod", "strategy": "s1", "date": "2024-01-02", "timestamp": "2024-01-02T18:00:00"}
+
+
+def test_replay_at_another_time_has_the_same_key():
+    replay = {**EVENT, "timestamp": "2024-01-03T09:00:00"}
+    assert idempotency_key(EVENT, {}) == idempotency_key(replay, {})
+
+
+def test_key_does_not_depend_on_field_order():
+    assert idempotency_key(dict(reversed(list(EVENT.items()))), {}) == idempotency_key(EVENT, {})
+
+
+def test_other_payload_is_another_event():
+    assert idempotency_key({**EVENT, "date": "2024-01-03"}, {}) != idempotency_key(EVENT, {})
+
+
+def test_declared_fields_alone_identify_the_event():
+    key_fields = {"eod": ["strategy", "date"]}
+    retried = {**EVENT, "attempt": 2, "note": "resent by hand"}
+    assert idempotency_key(retried, key_fields) == idempotency_key(EVENT, key_fields)
+    assert idempotency_key({**EVENT, "date": "2024-01-03"}, key_fields) != idempotency_key(EVENT, key_fields)
+
+
+def test_event_type_is_part_of_the_key():
+    key_fields = {"eod": ["strategy"], "sod": ["strategy"]}
+    assert idempotency_key({**EVENT, "event_type": "sod"}, key_fields) != idempotency_key(EVENT, key_fields)
+
+
+def test_key_fits_a_deduplication_id():
+    key = idempotency_key({**EVENT, "blob": "x" * 10_000}, {})
+    assert len(key) <= 128 and key.isalnum()
+
+
+class Clock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_dedup_cache_remembers_keys_for_its_window():
+    clock = Clock()
+    cache = DedupCache(window_seconds=60, max_keys=10, clock=clock)
+    cache.add("key", "job-1")
+    clock.now = 59.9
+    assert cache.get("key") == "job-1"
+    clock.now = 60
+    assert cache.get("key") is None
+    assert len(cache) == 0
+
+
+def test_dedup_cache_evicts_the_least_recently_seen_key():
+    cache = DedupCache(window_seconds=60, max_keys=2, clock=Clock())
+    cache.add("a", "job-a")
+    cache.add("b", "job-b")
+    assert cache.get("a") == "job-a"
+    cache.add("c", "job-c")
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ("job-a", None, "job-c")
@@ -0,0 +1,133 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from local_stack import LocalSQS
+
+FIFO_URL = "https://sqs.us-east-1.amazonaws.com/000000000000/events.fifo"
+STANDARD_URL = "https://sqs.us-east-1.amazonaws.com/000000000000/retry"
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def sqs(clock):
+    sqs = LocalSQS(clock=clock)
+    sqs.ensure_queue(FIFO_URL, {"VisibilityTimeout": "30"})
+    sqs.ensure_queue(STANDARD_URL)
+    return sqs
+
+
+def send(sqs, body, group="g", dedup=None, queue_url=FIFO_URL):
+    return sqs.send_message(QueueUrl=queue_url, MessageBody=body, MessageGroupId=group,
+                            MessageDeduplicationId=dedup or body)
+
+
+def receive(sqs, queue_url=FIFO_URL, max_messages=10, **kwargs):
+    return sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=max_messages, **kwargs).get("Messages", [])
+
+
+def bodies(messages):
+    return [message["Body"] for message in messages]
+
+
+def test_duplicate_within_the_window_is_dropped(sqs, clock):
+    first = send(sqs, "a", dedup="key")
+    clock.now += 299
+    again = send(sqs, "b", dedup="key")
+    assert again["MessageId"] == first["MessageId"]
+    assert bodies(receive(sqs)) == ["a"]
+    assert sqs.stats["Deduplicated"] == 1
+
+
+def test_duplicate_after_the_window_is_a_new_message(sqs, clock):
+    send(sqs, "a", dedup="key")
+    clock.now += 300
+    send(sqs, "b", dedup="key")
+    assert bodies(receive(sqs)) == ["a", "b"]
+
+
+def test_deleted_message_still_deduplicates(sqs):
+    send(sqs, "a", dedup="key")
+    message, = receive(sqs)
+    sqs.delete_message(QueueUrl=FIFO_URL, ReceiptHandle=message["ReceiptHandle"])
+    send(sqs, "a", dedup="key")
+    assert receive(sqs) == []
+
+
+def test_fifo_requires_a_deduplication_id_or_content_based_dedup(sqs):
+    with pytest.raises(ClientError):
+        sqs.send_message(QueueUrl=FIFO_URL, MessageBody="a", MessageGroupId="g")
+    content_url = sqs.ensure_queue(FIFO_URL.replace("events", "content"), {"ContentBasedDeduplication": "true"})
+    sqs.send_message(QueueUrl=content_url, MessageBody="a", MessageGroupId="g")
+    sqs.send_message(QueueUrl=content_url, MessageBody="a", MessageGroupId="g")
+    assert bodies(receive(sqs, content_url)) == ["a"]
+
+
+def test_received_message_is_invisible_until_its_timeout(sqs, clock):
+    send(sqs, "a")
+    first, = receive(sqs)
+    assert receive(sqs) == []
+    clock.now += 29.9
+    assert receive(sqs) == []
+    clock.now += 0.1
+    again, = receive(sqs)
+    assert again["MessageId"] == first["MessageId"]
+    assert again["ReceiptHandle"] != first["ReceiptHandle"]
+    assert again["Attributes"]["ApproximateReceiveCount"] == "2"
+
+
+def test_change_visibility_hides_or_releases(sqs, clock):
+    send(sqs, "a")
+    message, = receive(sqs)
+    sqs.change_message_visibility(QueueUrl=FIFO_URL, ReceiptHandle=message["ReceiptHandle"], VisibilityTimeout=0)
+    message, = receive(sqs)
+    sqs.change_message_visibility(QueueUrl=FIFO_URL, ReceiptHandle=message["ReceiptHandle"], VisibilityTimeout=120)
+    clock.now += 119
+    assert receive(sqs) == []
+    clock.now += 1
+    assert bodies(receive(sqs)) == ["a"]
+
+
+def test_change_visibility_of_a_visible_message_fails(sqs, clock):
+    send(sqs, "a")
+    message, = receive(sqs)
+    clock.now += 30
+    with pytest.raises(ClientError):
+        sqs.change_message_visibility(QueueUrl=FIFO_URL, ReceiptHandle=message["ReceiptHandle"],
+                                      VisibilityTimeout=10)
+
+
+def test_in_flight_message_holds_back_its_group(sqs):
+    for body, group in (("a1", "a"), ("a2", "a"), ("b1", "b"), ("b2", "b")):
+        send(sqs, body, group)
+    a1, = receive(sqs, max_messages=1)
+    # a2 waits behind the in-flight a1; group b is not held back
+    assert bodies(receive(sqs)) == ["b1", "b2"]
+    assert receive(sqs) == []
+    sqs.delete_message(QueueUrl=FIFO_URL, ReceiptHandle=a1["ReceiptHandle"])
+    assert bodies(receive(sqs)) == ["a2"]
+
+
+def test_standard_queue_delays_single_messages(sqs, clock):
+    sqs.send_message(QueueUrl=STANDARD_URL, MessageBody="later", DelaySeconds=10)
+    sqs.send_message(QueueUrl=STANDARD_URL, MessageBody="now")
+    assert bodies(receive(sqs, STANDARD_URL)) == ["now"]
+    clock.now += 10
+    assert bodies(receive(sqs, STANDARD_URL)) == ["later"]
+
+
+def test_fifo_rejects_per_message_delay(sqs):
+    with pytest.raises(ClientError):
+        sqs.send_message(QueueUrl=FIFO_URL, MessageBody="a", MessageGroupId="g", MessageDeduplicationId="a",
+                         DelaySeconds=5)
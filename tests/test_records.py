@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from local_stack.harness import MASTER_DIR, load_package
+
+master = load_package(MASTER_DIR, "records")
+records = master.module("records")
+budget = master.module("budget")
+metrics = master.module("instrumentation").metrics
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def record(message_id, group_id=None):
+    attributes = {"MessageGroupId": group_id} if group_id else {}
+    return {"messageId": message_id, "attributes": attributes}
+
+
+def run(batch, fail=(), **kwargs):
+    """Processes batch, raising for the messageIds in fail. Returns (handled, failed) messageIds."""
+    handled = []
+
+    async def handle(r):
+        handled.append(r["messageId"])
+        if r["messageId"] in fail:
+            raise RuntimeError("boom")
+
+    failed = asyncio.run(records.process_records(batch, handle, **kwargs))
+    return handled, failed
+
+
+def test_groups_keep_their_order():
+    batch = [record("a1", "a"), record("b1", "b"), record("x"), record("a2", "a"), record("y")]
+    groups = records.message_groups(batch)
+    assert [[r["messageId"] for r in group] for group in groups.values()] == [["a1", "a2"], ["b1"], ["x"], ["y"]]
+
+
+def test_failure_holds_back_the_rest_of_its_group():
+    batch = [record("a1", "a"), record("a2", "a"), record("a3", "a"), record("b1", "b"), record("b2", "b")]
+    handled, failed = run(batch, fail={"a2"})
+    assert failed == ["a2", "a3"]
+    assert "a3" not in handled
+    assert {"b1", "b2"} <= set(handled)
+    assert metrics._counters == {"record_failures": 1, "records_held_back": 1}
+
+
+def test_records_without_group_fail_alone():
+    handled, failed = run([record("x"), record("y"), record("z")], fail={"x"})
+    assert failed == ["x"]
+    assert sorted(handled) == ["x", "y", "z"]
+
+
+def test_groups_run_concurrently_up_to_the_limit():
+    running, peak = set(), []
+
+    async def handle(r):
+        running.add(r["messageId"])
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.discard(r["messageId"])
+
+    batch = [record(f"m{i}", f"g{i}") for i in range(6)]
+    assert asyncio.run(records.process_records(batch, handle, concurrency=2)) == []
+    assert max(peak) == 2
+
+
+class OutOfTime(budget.Budget):
+    """A budget that has time for `starts` more records."""
+
+    def __init__(self, starts):
+        super().__init__()
+        self.starts = starts
+
+    def can_start(self):
+        self.starts -= 1
+        return self.starts >= 0
+
+
+def test_records_without_time_are_left_with_their_group():
+    batch = [record("a1", "a"), record("a2", "a"), record("a3", "a")]
+    out_of_time = OutOfTime(starts=1)
+    handled, failed = run(batch, budget=out_of_time)
+    assert handled == ["a1"]
+    assert failed == ["a2", "a3"]
+    assert [r["messageId"] for r in out_of_time.left] == ["a2", "a3"]
+    assert out_of_time.records == 1
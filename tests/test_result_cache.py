@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import pytest
+
+from local_stack.harness import USER_SERVICE_DIR, load_package
+
+result_cache = load_package(USER_SERVICE_DIR, "result_cache").module("result_cache")
+ResultCache = result_cache.ResultCache
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def job(finished_at=None, exit_code=None):
+    """What the cache reads of a Job; finished_at in seconds on the test clock."""
+    return SimpleNamespace(finished_at=None if finished_at is None else int(finished_at * 1000),
+                           exit_code=exit_code)
+
+
+def test_running_job_is_a_hit_whatever_its_age():
+    clock = Clock()
+    cache = ResultCache(10, clock=clock)
+    running = job()
+    cache.add("k", running, ttl_seconds=1)
+    clock.now += 3600
+    assert cache.get("k") is running
+
+
+def test_finished_job_expires_after_ttl():
+    clock = Clock()
+    cache = ResultCache(10, clock=clock)
+    done = job(finished_at=clock.now, exit_code=0)
+    cache.add("k", done, ttl_seconds=60)
+    clock.now += 59.9
+    assert cache.get("k") is done
+    clock.now += 0.1
+    assert cache.get("k") is None
+    assert len(cache) == 0
+
+
+def test_failed_job_is_dropped():
+    clock = Clock()
+    cache = ResultCache(10, clock=clock)
+    cache.add("k", job(finished_at=clock.now, exit_code=1), ttl_seconds=60)
+    assert cache.get("k") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = ResultCache(2, clock=Clock())
+    first, second, third = job(), job(), job()
+    cache.add("first", first, 60)
+    cache.add("second", second, 60)
+    assert cache.get("first") is first
+    cache.add("third", third, 60)
+    assert cache.get("second") is None
+    assert (cache.get("first"), cache.get("third")) == (first, third)
+
+
+def test_key_depends_on_every_part():
+    keys = {ResultCache.key("alice", "cmd"), ResultCache.key("bob", "cmd"),
+            ResultCache.key("alice", "cmd2"), ResultCache.key("alice", "cmd", "fp")}
+    assert len(keys) == 4
+
+
+def test_fingerprint_follows_inputs(tmp_path):
+    path = tmp_path / "prices-2024.csv"
+    policy = result_cache.parse_cache_policy({"ttl_seconds": 5, "inputs": [str(tmp_path / "prices-<year>.csv")]})
+    missing = policy.fingerprint({"year": "2024"})
+    path.write_text("1")
+    written = policy.fingerprint({"year": "2024"})
+    path.write_text("12")
+    assert len({missing, written, policy.fingerprint({"year": "2024"})}) == 3
+    assert policy.fingerprint({}) is None
+
+
+@pytest.mark.parametrize("expression", ['{"ttl_seconds": 0}', '{"ttl_seconds": true}', '{"inputs": ["a"]}',
+                                        '{"ttl_seconds": 1, "inputs": "a"}', '{"ttl_seconds": 1, "max": 2}'])
+def test_parse_cache_policy_rejects_malformed(expression):
+    with pytest.raises(ValueError):
+        result_cache.parse_cache_policy(expression)
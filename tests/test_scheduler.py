@@ -0,0 +1,145 @@
+import pytest
+
+from local_stack.harness import USER_SERVICE_DIR, load_package
+
+user_service = load_package(USER_SERVICE_DIR, "scheduler")
+scheduler = user_service.module("scheduler")
+jobs = user_service.module("jobs")
+Resources = scheduler.Resources
+
+
+class FakeProcess:
+    """Stands in for the Popen of a command; finish() makes it exit."""
+
+    pids = iter(range(1000, 10 ** 6))
+
+    def __init__(self, command):
+        self.command = command
+        self.pid = next(self.pids)
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def finish(self, code=0):
+        self.returncode = code
+
+
+@pytest.fixture
+def started(monkeypatch):
+    """The commands the scheduler started, in order, instead of running them."""
+    processes = []
+
+    def execute_cmd(cmd, **kwargs):
+        processes.append(FakeProcess(cmd))
+        return processes[-1]
+
+    monkeypatch.setattr(scheduler, "execute_cmd", execute_cmd)
+    return processes
+
+
+def make_scheduler(**kwargs):
+    kwargs.setdefault("enforcement", "none")
+    kwargs.setdefault("max_queued", 0)
+    return scheduler.Scheduler(jobs.JobRegistry(100), **kwargs)
+
+
+def submit(node, event_type, command, **resources):
+    job = jobs.Job("alice", event_type, command)
+    assert node.submit(job, command, {}, Resources(**resources))
+    return job
+
+
+def finish_first(node, started):
+    """Lets the oldest running command exit and collects it."""
+    next(p for p in started if p.returncode is None).finish()
+    node.poll()
+
+
+def test_starts_what_fits_and_queues_the_rest(started):
+    node = make_scheduler(cpu_slots=2)
+    first, second, third = (submit(node, "t", f"cmd {i}") for i in range(3))
+    assert [p.command for p in started] == ["cmd 0", "cmd 1"]
+    assert (first.state, second.state, third.state) == ("running", "running", "queued")
+    assert node.queued == 1
+
+    finish_first(node, started)
+    assert [p.command for p in started] == ["cmd 0", "cmd 1", "cmd 2"]
+    assert (first.state, third.state) == ("finished", "running")
+    assert node.queued == 0
+
+
+def test_higher_priority_runs_first(started):
+    node = make_scheduler(cpu_slots=1)
+    submit(node, "t", "running")
+    submit(node, "t", "low", priority=0)
+    submit(node, "t", "high", priority=5)
+    finish_first(node, started)
+    finish_first(node, started)
+    assert [p.command for p in started] == ["running", "high", "low"]
+
+
+def test_event_types_share_the_node(started):
+    node = make_scheduler(cpu_slots=2)
+    for i in range(4):
+        submit(node, "burst", f"burst {i}")
+    submit(node, "other", "other 0")
+    # The burst holds both slots; the next free slot goes to the type holding none
+    finish_first(node, started)
+    assert started[-1].command == "other 0"
+
+
+def test_round_robin_between_event_types(started):
+    node = make_scheduler(cpu_slots=1)
+    submit(node, "a", "a 0")
+    for i in range(1, 3):
+        submit(node, "a", f"a {i}")
+        submit(node, "b", f"b {i}")
+    while node.poll() or node.queued:
+        finish_first(node, started)
+    assert [p.command for p in started] == ["a 0", "b 1", "a 1", "b 2", "a 2"]
+
+
+def test_large_command_is_not_overtaken(started):
+    node = make_scheduler(cpu_slots=2)
+    submit(node, "t", "small 0")
+    large = submit(node, "t", "large", cpu_slots=2)
+    late = submit(node, "t", "small 1")
+    # A slot is free, but the large command at the head needs both
+    assert (large.state, late.state) == ("queued", "queued")
+    finish_first(node, started)
+    assert (large.state, late.state) == ("running", "queued")
+
+
+def test_command_larger_than_the_node_runs_alone(started):
+    node = make_scheduler(cpu_slots=2, memory_mb=100)
+    job = submit(node, "t", "huge", cpu_slots=8, memory_mb=4096)
+    assert job.state == "running"
+    assert node.to_dict()["cpu_slots"]["used"] == 2
+    assert node.to_dict()["memory_mb"]["used"] == 100
+
+
+def test_full_run_queue_refuses_jobs(started):
+    node = make_scheduler(cpu_slots=1, max_queued=1)
+    submit(node, "t", "running")
+    submit(node, "t", "queued")
+    assert not node.submit(jobs.Job("alice", "t", "refused"), "refused")
+
+
+def test_command_that_cannot_start_fails_and_frees_its_slot(monkeypatch):
+    def execute_cmd(cmd, **kwargs):
+        raise OSError("no such shell")
+
+    monkeypatch.setattr(scheduler, "execute_cmd", execute_cmd)
+    node = make_scheduler(cpu_slots=1)
+    job = submit(node, "t", "broken")
+    assert job.state == "failed"
+    assert node.to_dict()["cpu_slots"]["used"] == 0
+
+
+def test_parse_resources():
+    assert scheduler.parse_resources(None) is None
+    assert scheduler.parse_resources('{"cpu_slots": 2, "priority": -1}') == Resources(cpu_slots=2, priority=-1)
+    for invalid in ('{"cpu_slots": 0}', '{"memory_mb": -1}', '{"cpu_slots": true}', '{"gpus": 1}', "[1]"):
+        with pytest.raises(ValueError):
+            scheduler.parse_resources(invalid)
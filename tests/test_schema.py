@@ -0,0 +1,63 @@
+import pymysql
+import pytest
+
+from local_stack.harness import USER_SERVICE_DIR, load_package
+from tools import migrate
+
+db = load_package(USER_SERVICE_DIR, "db").module("db")
+
+
+class Connection:
+    """A pymysql connection whose schema_migrations holds `versions` (None: no such table)."""
+
+    open = True
+
+    def __init__(self, versions):
+        self.versions = versions
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, args=None):
+        assert query == "SELECT version FROM schema_migrations"
+        if self.versions is None:
+            raise pymysql.err.ProgrammingError(1146, "Table 'schema_migrations' doesn't exist")
+
+    def fetchall(self):
+        return [{"version": version} for version in self.versions]
+
+    def close(self):
+        pass
+
+
+def database(versions):
+    db.set_connection_factory(lambda **kwargs: Connection(versions))
+    database = db.Database()
+    database.connect()
+    return database
+
+
+@pytest.fixture(autouse=True)
+def restore_factory():
+    yield
+    db.set_connection_factory(None)
+
+
+def test_required_version_exists():
+    assert db.SCHEMA_VERSION <= max(version for version, _, _ in migrate.MIGRATIONS)
+
+
+def test_migrated_schema_is_accepted():
+    database(range(1, db.SCHEMA_VERSION + 2)).init_db()
+
+
+@pytest.mark.parametrize("versions", [None, [], [1, 2, 3], [v for v in range(1, 7) if v != 4]])
+def test_unmigrated_schema_is_refused(versions):
+    with pytest.raises(RuntimeError, match="tools.migrate up"):
+        database(versions).init_db()
@@ -0,0 +1,52 @@
+from local_stack.harness import MASTER_DIR, USER_SERVICE_DIR, load_package
+
+tracing = load_package(MASTER_DIR, "tracing").module("tracing")
+jobs = load_package(USER_SERVICE_DIR, "jobs").module("jobs")
+
+
+def test_hops_are_appended_in_order():
+    hops = tracing.add_hop("", "ingest", 1000)
+    hops = tracing.add_hop(hops, "master_in", 1042)
+    assert hops == "ingest=1000;master_in=1042"
+    assert jobs.parse_hops(hops) == [("ingest", 1000), ("master_in", 1042)]
+
+
+def test_hop_defaults_to_now():
+    name, timestamp = jobs.parse_hops(tracing.add_hop("", "ingest"))[0]
+    assert name == "ingest" and abs(timestamp - tracing.now_ms()) < 1000
+
+
+def test_malformed_hops_are_skipped():
+    assert jobs.parse_hops("ingest=1000;;broken;master_in=x;=5;user_in=1100") == [("ingest", 1000), ("user_in", 1100)]
+    assert jobs.parse_hops(None) == []
+
+
+def test_trace_context_survives_a_record():
+    attributes = tracing.trace_attributes("t-1", "ingest=1000")
+    record = {"messageAttributes": {name: {"dataType": a["DataType"], "stringValue": a["StringValue"]}
+                                    for name, a in attributes.items()}}
+    assert tracing.trace_from_record(record) == ("t-1", "ingest=1000")
+
+
+def test_untraced_record_gets_a_fresh_trace_id():
+    first, hops = tracing.trace_from_record({"messageAttributes": {}})
+    second, _ = tracing.trace_from_record({})
+    assert hops == "" and first and first != second
+
+
+def test_trace_headers():
+    assert tracing.trace_headers("t-1", "ingest=1000") == {"X-Trace-Id": "t-1", "X-Trace-Hops": "ingest=1000"}
+
+
+def test_job_reports_end_to_end_latency_and_the_slowest_hop():
+    job = jobs.Job("alice", "eod", "run", "t-1", jobs.parse_hops("ingest=1000;master_in=1040;user_in=1300"))
+    job.add_hop("started", 1310)
+    view = job.to_dict()
+    assert view["end_to_end_ms"] == 310
+    assert view["slowest_hop"] == {"hop": "master_in->user_in", "ms": 260}
+    assert [hop["hop"] for hop in view["hops"]] == ["ingest", "master_in", "user_in", "started"]
+
+
+def test_job_with_a_single_hop_has_no_latency():
+    view = jobs.Job("alice", "eod", "run", hops=[("user_in", 1000)]).to_dict()
+    assert view["end_to_end_ms"] is None and view["slowest_hop"] is None
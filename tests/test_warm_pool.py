@@ -0,0 +1,55 @@
+import shlex
+import sys
+
+import pytest
+
+from local_stack.harness import USER_SERVICE_DIR, load_package
+
+warm_pool = load_package(USER_SERVICE_DIR, "warm_pool").module("warm_pool")
+PYTHON = sys.executable
+
+
+def parse(command):
+    return warm_pool.parse_invocation(command.format(python=shlex.quote(PYTHON)), python=PYTHON)
+
+
+@pytest.mark.parametrize("command, expected", [
+    ("{python} job.py a 1", ("script", "job.py", ["a", "1"])),
+    ("{python} job.py 'x y' \"it's\"", ("script", "job.py", ["x y", "it's"])),
+    ("{python} -u job.py", ("script", "job.py", [])),
+    ("{python} -m entry b", ("module", "entry", ["b"])),
+    ("{python} -u -m pkg.entry", ("module", "pkg.entry", [])),
+    ("pkg.entry:main c d", ("entry", "pkg.entry:main", ["c", "d"])),
+])
+def test_runnable_in_the_pool(command, expected):
+    assert parse(command) == expected
+
+
+@pytest.mark.parametrize("command", [
+    "",
+    "{python}",
+    "{python} -m",
+    "{python} -c 'print(1)'",
+    "{python} -O job.py",
+    "{python} job.py | cat",
+    "{python} job.py > out.txt",
+    "{python} job.py $HOME",
+    "{python} job.py *.csv",
+    "{python} job.py; rm x",
+    "{python} job.py && true",
+    "FOO=1 {python} job.py",
+    "{python} job.py 'unterminated",
+    "bash run.sh",
+    "no-such-interpreter-here job.py",
+])
+def test_left_to_the_shell(command):
+    assert parse(command) is None
+
+
+def test_shell_command_runs_entry_points_without_the_pool():
+    command = warm_pool.shell_command("pkg.entry:main 'a b' c", python="python3")
+    words = shlex.split(command)
+    assert words[:2] == ["python3", "-c"]
+    assert "from pkg.entry import main" in words[2]
+    assert words[3:] == ["a b", "c"]
+    assert warm_pool.shell_command("python3 job.py | cat") == "python3 job.py | cat"
@@ -0,0 +1,150 @@
+"""
+Compile the master Lambda's routing data into a versioned snapshot.
+
+The snapshot holds event_type -> subscribers (with their filters), username ->
+queue_url and event_type -> ACL functions, read from MySQL in three queries, as
+gzipped JSON. It is written first and the version marker ("<output>.version")
+last, so a Lambda that sees a new marker always finds the matching snapshot.
+The version is a hash of the contents, so rebuilding unchanged data writes
+nothing and no container reloads. Run from the repository root, with the MYSQL_* variables:
+
+    python -m tools.build_routing_snapshot --output s3://routing-bucket/routing.json.gz
+    python -m tools.build_routing_snapshot --output /mnt/efs/routing.json.gz --interval 10
+"""
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+# Must match lambda_functions/master/routing.py
+SNAPSHOT_FORMAT = 1
+VERSION_SUFFIX = ".version"
+
+
+def build(connection) -> Dict[str, Any]:
+    """
+    Reads the routing data.
+
+    Args:
+        connection: A pymysql connection with a DictCursor
+
+    Returns:
+        dict: The snapshot, with its content version
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT username, queue_url FROM users")
+        users = {row["username"]: row["queue_url"] for row in cursor.fetchall()}
+        cursor.execute("""
+            SELECT event_type, username, filter_expression
+            FROM subscriptions
+            ORDER BY event_type, username
+        """)
+        subscriptions: Dict[str, list] = {}
+        filters: Dict[str, Dict[str, str]] = {}
+        for row in cursor.fetchall():
+            subscriptions.setdefault(row["event_type"], []).append(row["username"])
+            if row["filter_expression"]:
+                filters.setdefault(row["event_type"], {})[row["username"]] = row["filter_expression"]
+        cursor.execute("""
+            SELECT e.event_type, f.function_name, f.function_path
+            FROM event_acl_mapping e
+            JOIN acl_function f ON f.function_name = e.function_name
+            ORDER BY e.event_type, f.function_name
+        """)
+        acl: Dict[str, list] = {}
+        for row in cursor.fetchall():
+            acl.setdefault(row["event_type"], []).append([row["function_name"], row["function_path"]])
+
+    content = {"users": users, "subscriptions": subscriptions, "filters": filters, "acl": acl}
+    version = hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "version": version,
+        "built_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        **content,
+    }
+
+
+def _s3(path: str):
+    import boto3
+    bucket, _, key = path[len("s3://"):].partition("/")
+    return boto3.client("s3"), bucket, key
+
+
+def read_version(output: str) -> Optional[str]:
+    """The version the marker currently points at, or None."""
+    try:
+        if output.startswith("s3://"):
+            client, bucket, key = _s3(output + VERSION_SUFFIX)
+            return client.get_object(Bucket=bucket, Key=key)["Body"].read().decode("utf-8").strip()
+        with open(output + VERSION_SUFFIX) as f:
+            return f.read().strip()
+    except Exception:
+        return None
+
+
+def _write(path: str, data: bytes):
+    if path.startswith("s3://"):
+        client, bucket, key = _s3(path)
+        client.put_object(Bucket=bucket, Key=key, Body=data)
+        return
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def publish(snapshot: Dict[str, Any], output: str) -> bool:
+    """
+    Writes the snapshot, then its version marker, unless the marker already has this version.
+
+    Returns:
+        bool: True if a new version was published
+    """
+    if read_version(output) == snapshot["version"]:
+        return False
+    _write(output, gzip.compress(json.dumps(snapshot, separators=(",", ":")).encode("utf-8")))
+    _write(output + VERSION_SUFFIX, snapshot["version"].encode("utf-8"))
+    return True
+
+
+def _connect():
+    import pymysql
+    return pymysql.connect(
+        host=os.getenv("MYSQL_HOST"),
+        user=os.getenv("MYSQL_USER"),
+        password=os.getenv("MYSQL_PASSWORD"),
+        database=os.getenv("MYSQL_DATABASE"),
+        port=int(os.getenv("MYSQL_PORT", 3306)),
+        charset="utf8mb4",
+        cursorclass=pymysql.cursors.DictCursor,
+        autocommit=True,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the master Lambda's routing snapshot.")
+    parser.add_argument("--output", required=True, help="Local path or s3://bucket/key")
+    parser.add_argument("--interval", type=float, default=0, help="Rebuild every N seconds (0: once)")
+    args = parser.parse_args(argv)
+
+    connection = _connect()
+    try:
+        while True:
+            snapshot = build(connection)
+            published = publish(snapshot, args.output)
+            print(f"{'Published' if published else 'Unchanged'} routing snapshot {snapshot['version']}: "
+                  f"{len(snapshot['subscriptions'])} event types, {len(snapshot['users'])} users")
+            if args.interval <= 0:
+                break
+            time.sleep(args.interval)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+Versioned schema migrations for the shared MySQL database, and a check that the
+hot queries of both Lambdas and user_service are served by indexes.
+
+Migrations run in version order and are recorded in `schema_migrations`. DDL
+commits implicitly in MySQL, so every step checks information_schema first and
+a migration that stopped halfway can simply be run again. Run from the
+repository root, with the MYSQL_* variables the services use:
+
+    python -m tools.migrate status
+    python -m tools.migrate up
+    python -m tools.migrate check    # EXPLAIN the hot queries; exits 1 on a full scan
+"""
+import argparse
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+MIGRATIONS_TABLE = "schema_migrations"
+# Serializes concurrent `up` runs (MySQL named lock)
+LOCK_NAME = "event_handling_schema_migrations"
+LOCK_TIMEOUT_SECONDS = 60
+
+
+# Helpers used by the migrations below
+
+def _scalar(cursor, query: str, args: Sequence[Any] = ()) -> Any:
+    cursor.execute(query, args)
+    row = cursor.fetchone()
+    return next(iter(row.values())) if row else None
+
+
+def column_exists(cursor, table: str, column: str) -> bool:
+    return bool(_scalar(cursor, """
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column)))
+
+
+def index_exists(cursor, table: str, index: str) -> bool:
+    return bool(_scalar(cursor, """
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index)))
+
+
+def index_columns(cursor, table: str, index: str) -> List[str]:
+    cursor.execute("""
+        SELECT COLUMN_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        ORDER BY SEQ_IN_INDEX
+    """, (table, index))
+    return [row["COLUMN_NAME"] for row in cursor.fetchall()]
+
+
+def add_index(cursor, table: str, index: str, columns: str):
+    if not index_exists(cursor, table, index):
+        cursor.execute(f"CREATE INDEX {index} ON {table} ({columns})")
+
+
+def set_primary_key(cursor, table: str, columns: List[str]):
+    if index_columns(cursor, table, "PRIMARY") != columns:
+        cursor.execute(f"ALTER TABLE {table} DROP PRIMARY KEY, ADD PRIMARY KEY ({', '.join(columns)})")
+
+
+# The migrations
+
+def create_tables(cursor):
+    """The tables of aiven_db.py and user_service, with one definition each."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            username VARCHAR(255) PRIMARY KEY,
+            role ENUM('admin', 'user') NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            ip_port TEXT NOT NULL,
+            queue_url TEXT NOT NULL,
+            token TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            event_type VARCHAR(255) NOT NULL,
+            command TEXT NOT NULL,
+            username VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (event_type, username),
+            FOREIGN KEY (username) REFERENCES users(username) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS acl_function (
+            function_name VARCHAR(255) PRIMARY KEY,
+            function_path TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS event_acl_mapping (
+            event_type VARCHAR(255) NOT NULL,
+            function_name VARCHAR(255) NOT NULL,
+            PRIMARY KEY (event_type, function_name),
+            FOREIGN KEY (function_name) REFERENCES acl_function(function_name) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS subscription_tombstones (
+            event_type VARCHAR(255) NOT NULL,
+            username VARCHAR(255) NOT NULL,
+            deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (event_type, username),
+            KEY idx_tombstones_deleted_at (deleted_at)
+        )
+    """)
+
+
+def key_subscriptions_by_event_type(cursor):
+    """Tables first created by user_service were keyed (username, event_type)."""
+    set_primary_key(cursor, "subscriptions", ["event_type", "username"])
+    set_primary_key(cursor, "subscription_tombstones", ["event_type", "username"])
+    add_index(cursor, "subscription_tombstones", "idx_tombstones_deleted_at", "deleted_at")
+
+
+def add_hot_query_indexes(cursor):
+    """
+    users.queue_url is TEXT, which cannot be indexed whole: index a stored
+    SHA-256 of it instead. subscriptions gains indexes for per-user listings and
+    for the user_service sync poll. Fan-out (event_type = ?) and the ACL lookup
+    are served by the primary keys, which lead with event_type.
+    """
+    if not column_exists(cursor, "users", "queue_url_hash"):
+        cursor.execute("""
+            ALTER TABLE users
+            ADD COLUMN queue_url_hash CHAR(64) AS (SHA2(queue_url, 256)) STORED
+        """)
+    add_index(cursor, "users", "idx_users_queue_url_hash", "queue_url_hash")
+    add_index(cursor, "subscriptions", "idx_subscriptions_username", "username")
+    add_index(cursor, "subscriptions", "idx_subscriptions_updated_at", "updated_at")
+
+
+def add_subscription_filters(cursor):
+    """Filter expressions (JSON, see lambda_functions/master/filters.py); NULL matches every event."""
+    if not column_exists(cursor, "subscriptions", "filter_expression"):
+        cursor.execute("ALTER TABLE subscriptions ADD COLUMN filter_expression TEXT NULL")
+
+
+def add_subscription_resources(cursor):
+    """Declared command resources (JSON, see user_service/scheduler.py); NULL uses the defaults."""
+    if not column_exists(cursor, "subscriptions", "resources"):
+        cursor.execute("ALTER TABLE subscriptions ADD COLUMN resources TEXT NULL")
+
+
+def add_subscription_result_cache(cursor):
+    """Result cache policies (JSON, see user_service/result_cache.py); NULL never caches."""
+    if not column_exists(cursor, "subscriptions", "result_cache"):
+        cursor.execute("ALTER TABLE subscriptions ADD COLUMN result_cache TEXT NULL")
+
+
+# (version, description, step); never renumber or edit a released migration, add a new one
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "create tables", create_tables),
+    (2, "key subscriptions and tombstones by (event_type, username)", key_subscriptions_by_event_type),
+    (3, "indexes for the hot queries", add_hot_query_indexes),
+    (4, "subscription filter expressions", add_subscription_filters),
+    (5, "subscription resources", add_subscription_resources),
+    (6, "subscription result cache policies", add_subscription_result_cache),
+]
+
+
+def applied_versions(connection) -> Dict[int, Any]:
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+                version INT PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute(f"SELECT version, applied_at FROM {MIGRATIONS_TABLE}")
+        return {row["version"]: row["applied_at"] for row in cursor.fetchall()}
+
+
+def migrate(connection, target: Optional[int] = None) -> List[int]:
+    """
+    Applies the pending migrations up to target (default: all).
+
+    Args:
+        connection: An autocommit pymysql connection with a DictCursor
+
+    Returns:
+        list: The versions applied by this call
+    """
+    applied = []
+    with connection.cursor() as cursor:
+        if not _scalar(cursor, "SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT_SECONDS)):
+            raise RuntimeError(f"Another migration holds the {LOCK_NAME} lock")
+        try:
+            done = applied_versions(connection)
+            for version, description, step in MIGRATIONS:
+                if version in done or (target is not None and version > target):
+                    continue
+                print(f"Applying migration {version}: {description}")
+                step(cursor)
+                cursor.execute(f"INSERT INTO {MIGRATIONS_TABLE} (version, description) VALUES (%s, %s)",
+                               (version, description))
+                applied.append(version)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+    return applied
+
+
+# Hot queries, as issued by the services: (name, query, sample arguments)
+HOT_QUERIES: List[Tuple[str, str, Tuple]] = [
+    # lambda_functions/master/db.py
+    ("master.get_subscriber_index", """
+        SELECT username, filter_expression
+        FROM subscriptions
+        WHERE event_type = %s
+    """, ("event_type",)),
+    ("master.get_event_acl_functions", """
+        SELECT f.function_name, f.function_path
+        FROM acl_function f
+        JOIN event_acl_mapping e ON f.function_name = e.function_name
+        WHERE event_type = %s
+    """, ("event_type",)),
+    ("master.get_user_queue_urls", """
+        SELECT username, queue_url
+        FROM users
+        WHERE username IN (%s, %s)
+    """, ("username1", "username2")),
+    # lambda_functions/user_queue_lambda/db.py
+    ("user_queue.fetch_user_by_queue_url", """
+        SELECT username, ip_port, token
+        FROM users
+        WHERE queue_url_hash = SHA2(%s, 256) AND queue_url = %s
+    """, ("queue_url", "queue_url")),
+    # user_service/db.py (SubscriptionSync polls)
+    ("user_service.fetch_subscription_changes", """
+        SELECT username, event_type, command, created_at, updated_at, filter_expression, resources, result_cache
+        FROM subscriptions
+        WHERE updated_at >= %s
+    """, ("2100-01-01 00:00:00",)),
+    ("user_service.fetch_subscription_tombstones", """
+        SELECT username, event_type, deleted_at
+        FROM subscription_tombstones
+        WHERE deleted_at >= %s
+    """, ("2100-01-01 00:00:00",)),
+]
+
+# MySQL answers these from the index alone when no row matches the constant
+_NO_ROWS_EXTRA = ("no matching row in const table", "Impossible WHERE")
+
+
+def _full_scans(plan: List[Dict[str, Any]]) -> List[str]:
+    """The tables a query plan reads in full (MySQL EXPLAIN or SQLite EXPLAIN QUERY PLAN rows)."""
+    scans = []
+    for row in plan:
+        if "detail" in row:
+            if row["detail"].startswith("SCAN"):
+                scans.append(row["detail"])
+        elif row.get("type") in ("ALL", "index") and not any(e in (row.get("Extra") or "") for e in _NO_ROWS_EXTRA):
+            scans.append(f"{row.get('table')} ({row.get('type')}, key={row.get('key')})")
+    return scans
+
+
+def check_hot_queries(connection) -> Dict[str, List[str]]:
+    """
+    EXPLAINs every hot query.
+
+    The MySQL optimizer may prefer a scan on tables with a handful of rows, so
+    run this against a database of realistic size.
+
+    Returns:
+        dict: query name -> the full scans in its plan (empty if it only uses indexes)
+    """
+    results = {}
+    with connection.cursor() as cursor:
+        for name, query, args in HOT_QUERIES:
+            cursor.execute("EXPLAIN " + query, args)
+            results[name] = _full_scans(cursor.fetchall())
+    return results
+
+
+def _connect():
+    import pymysql
+    return pymysql.connect(
+        host=os.getenv("MYSQL_HOST"),
+        user=os.getenv("MYSQL_USER"),
+        password=os.getenv("MYSQL_PASSWORD"),
+        database=os.getenv("MYSQL_DATABASE"),
+        port=int(os.getenv("MYSQL_PORT", 3306)),
+        charset="utf8mb4",
+        cursorclass=pymysql.cursors.DictCursor,
+        autocommit=True,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=["status", "up", "check"])
+    parser.add_argument("--target", type=int, help="up: stop after this version")
+    args = parser.parse_args(argv)
+
+    connection = _connect()
+    try:
+        if args.command == "status":
+            done = applied_versions(connection)
+            for version, description, _ in MIGRATIONS:
+                state = f"applied {done[version]}" if version in done else "pending"
+                print(f"{version:>4}  {state:<30} {description}")
+        elif args.command == "up":
+            applied = migrate(connection, args.target)
+            print(f"Applied {len(applied)} migration(s)" + (f": {applied}" if applied else ""))
+        else:
+            results = check_hot_queries(connection)
+            for name, scans in results.items():
+                print(f"{'FULL SCAN' if scans else 'ok':<10} {name}" + (f": {'; '.join(scans)}" if scans else ""))
+            if any(results.values()):
+                raise SystemExit(1)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Re-inject dead-lettered events in batches.
+
+Dead-lettered events carry the failure attributes written by the Lambdas'
+failures module (failure_stage, failure_reason, retry_destination, ...). Each
+event is sent back to the retry queue it came through (its replay_queue_url
+attribute, or --target-queue-url) with a fresh retry budget, so the consuming
+Lambda delivers it to the same destination again. An event is deleted from the
+DLQ only once it has been re-sent. Run from the repository root:
+
+    python -m tools.replay_dlq --dlq-url https://sqs.us-east-1.amazonaws.com/123456789012/events-dlq \\
+        --stage delivery --rate 2 --max-messages 500
+"""
+import argparse
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+# Attribute names written by lambda_functions/*/failures.py
+ATTEMPT_ATTRIBUTE = "retry_attempt"
+DESTINATION_ATTRIBUTE = "retry_destination"
+STAGE_ATTRIBUTE = "failure_stage"
+REASON_ATTRIBUTE = "failure_reason"
+FAILED_AT_ATTRIBUTE = "failed_at"
+REPLAY_QUEUE_ATTRIBUTE = "replay_queue_url"
+# Dropped on replay, which resets the retry budget
+RESET_ATTRIBUTES = (ATTEMPT_ATTRIBUTE, REASON_ATTRIBUTE, FAILED_AT_ATTRIBUTE, REPLAY_QUEUE_ATTRIBUTE)
+
+
+def _value(message: Dict[str, Any], name: str) -> Optional[str]:
+    return (message.get("MessageAttributes", {}).get(name) or {}).get("StringValue")
+
+
+def _entry(message: Dict[str, Any], target_queue_url: str) -> Dict[str, Any]:
+    entry = {
+        "Id": message["MessageId"],
+        "MessageBody": message["Body"],
+        "MessageAttributes": {
+            name: value for name, value in message.get("MessageAttributes", {}).items()
+            if name not in RESET_ATTRIBUTES
+        },
+    }
+    if target_queue_url.endswith(".fifo"):
+        entry["MessageGroupId"] = _value(message, DESTINATION_ATTRIBUTE) or "replay"
+        entry["MessageDeduplicationId"] = message["MessageId"]
+    return entry
+
+
+def replay(sqs, dlq_url: str, batch_size: int = 10, max_messages: Optional[int] = None,
+           stage: Optional[str] = None, target_queue_url: Optional[str] = None,
+           rate: float = 0.0, dry_run: bool = False, wait_time_seconds: int = 1) -> Counter:
+    """
+    Move dead-lettered events back to their retry queue.
+
+    Args:
+        sqs: boto3 SQS client (or local_stack.LocalSQS)
+        dlq_url (str): The dead-letter queue
+        batch_size (int): Messages received / re-sent per call (1-10)
+        max_messages (int, optional): Stop after replaying this many
+        stage (str, optional): Only replay "fanout" or "delivery" failures
+        target_queue_url (str, optional): Send here instead of each event's replay_queue_url
+        rate (float): Maximum batches per second (0 = unlimited)
+        dry_run (bool): Count what would be replayed without sending or deleting
+
+    Returns:
+        Counter: replayed / skipped / failed counts
+    """
+    stats = Counter()
+    seen = set()
+    # Skipped / unsent messages stay invisible until the end, so later batches reach new ones
+    release: List[Dict[str, Any]] = []
+    interval = 1.0 / rate if rate else 0.0
+    while max_messages is None or stats["replayed"] < max_messages:
+        started = time.monotonic()
+        limit = batch_size if max_messages is None else min(batch_size, max_messages - stats["replayed"])
+        messages = sqs.receive_message(
+            QueueUrl=dlq_url, MaxNumberOfMessages=limit, WaitTimeSeconds=wait_time_seconds,
+            MessageAttributeNames=["All"],
+        ).get("Messages", [])
+        fresh = [m for m in messages if m["MessageId"] not in seen]
+        if not fresh:
+            break
+        seen.update(m["MessageId"] for m in fresh)
+
+        by_target: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for message in fresh:
+            target = target_queue_url or _value(message, REPLAY_QUEUE_ATTRIBUTE)
+            if stage and _value(message, STAGE_ATTRIBUTE) != stage:
+                stats["skipped"] += 1
+            elif not target:
+                print(f"No {REPLAY_QUEUE_ATTRIBUTE} on {message['MessageId']}; pass --target-queue-url")
+                stats["skipped"] += 1
+            elif dry_run:
+                stats["replayed"] += 1
+            else:
+                by_target[target].append(message)
+                continue
+            release.append(message)
+
+        for target, batch in by_target.items():
+            response = sqs.send_message_batch(QueueUrl=target, Entries=[_entry(m, target) for m in batch])
+            sent = {entry["Id"] for entry in response.get("Successful", [])}
+            for failure in response.get("Failed", []):
+                print(f"Could not replay {failure['Id']} to {target}: {failure.get('Message')}")
+            stats["replayed"] += len(sent)
+            stats["failed"] += len(batch) - len(sent)
+            done = [m for m in batch if m["MessageId"] in sent]
+            if done:
+                sqs.delete_message_batch(QueueUrl=dlq_url, Entries=[
+                    {"Id": m["MessageId"], "ReceiptHandle": m["ReceiptHandle"]} for m in done
+                ])
+            release.extend(m for m in batch if m["MessageId"] not in sent)
+
+        if interval:
+            delay = started + interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    for i in range(0, len(release), 10):
+        sqs.change_message_visibility_batch(QueueUrl=dlq_url, Entries=[
+            {"Id": m["MessageId"], "ReceiptHandle": m["ReceiptHandle"], "VisibilityTimeout": 0}
+            for m in release[i:i + 10]
+        ])
+    return stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Re-inject dead-lettered events in batches.")
+    parser.add_argument("--dlq-url", required=True, help="Dead-letter queue URL")
+    parser.add_argument("--region", default="us-east-1", help="AWS region")
+    parser.add_argument("--batch-size", type=int, default=10, help="Messages per batch (1-10)")
+    parser.add_argument("--max-messages", type=int, help="Stop after replaying this many messages")
+    parser.add_argument("--stage", choices=("fanout", "delivery"), help="Only replay failures of this stage")
+    parser.add_argument("--target-queue-url", help="Send to this queue instead of each message's replay_queue_url")
+    parser.add_argument("--rate", type=float, default=0.0, help="Maximum batches per second (0 = unlimited)")
+    parser.add_argument("--dry-run", action="store_true", help="Count only; send and delete nothing")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    import boto3
+
+    args = parse_args()
+    stats = replay(
+        boto3.client("sqs", region_name=args.region), args.dlq_url, batch_size=args.batch_size,
+        max_messages=args.max_messages, stage=args.stage, target_queue_url=args.target_queue_url,
+        rate=args.rate, dry_run=args.dry_run,
+    )
+    print(", ".join(f"{name}={count}" for name, count in sorted(stats.items())) or "DLQ is empty")
@@ -1,40 +1,88 @@
+import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
 import tornado.web
+import os
 import socket
 import sys
 from db import Database
-from handlers import MainHandler, SubscribeHandler, UnsubscribeHandler, HealthHandler, ListSubscriptionsHandler
+from instrumentation import log_request
+from jobs import JobRegistry
+from dedup import DedupCache
+from result_cache import ResultCache
+from scheduler import Scheduler
+from warm_pool import WarmPool
+from sync import SubscriptionSync
+from config import (COMMAND_OUTPUT_DIR, DEDUP_MAX_KEYS, DEDUP_WINDOW_SECONDS, MAX_JOB_RECORDS,
+                    RESULT_CACHE_MAX_ENTRIES, SCHEDULER_POLL_INTERVAL, USER_SERVICE_DEBUG, USER_SERVICE_WORKERS,
+                    WARM_POOL_SIZE)
+from handlers import (MainHandler, SubscribeHandler, UnsubscribeHandler, BulkSubscriptionsHandler, HealthHandler,
+                      ListSubscriptionsHandler, MetricsHandler, JobsHandler)
 
 
 class Application(tornado.web.Application):
-    def __init__(self, db, event_type_cmd_map):
+    def __init__(self, db, subscriptions, debug=USER_SERVICE_DEBUG, worker=0, workers=1):
         handlers = [
             (r"/", MainHandler),
             (r"/subscribe", SubscribeHandler),
             (r"/unsubscribe", UnsubscribeHandler),
+            (r"/subscriptions/bulk", BulkSubscriptionsHandler),
             (r"/health", HealthHandler),
-            (r"/list-subscriptions", ListSubscriptionsHandler)
+            (r"/list-subscriptions", ListSubscriptionsHandler),
+            (r"/metrics", MetricsHandler),
+            (r"/jobs", JobsHandler)
         ]
-        settings = dict(debug=True)
+        settings = dict(debug=debug, log_function=log_request)
         super().__init__(handlers, **settings)
         self.db = db
-        self.event_type_cmd_map = event_type_cmd_map
+        self.subscriptions = subscriptions
+        self.jobs = JobRegistry(MAX_JOB_RECORDS)
+        # Every worker process runs its own pool
+        self.warm_pool = WarmPool() if WARM_POOL_SIZE > 0 else None
+        if self.warm_pool is not None:
+            self.warm_pool.start()
+        self.scheduler = Scheduler.share(self.jobs, worker, workers, self.warm_pool)
+        self.dedup = DedupCache(DEDUP_WINDOW_SECONDS, DEDUP_MAX_KEYS) if DEDUP_WINDOW_SECONDS > 0 else None
+        self.result_cache = ResultCache(RESULT_CACHE_MAX_ENTRIES) if RESULT_CACHE_MAX_ENTRIES > 0 else None
 
 
-def main(port):
+def main(port, workers=USER_SERVICE_WORKERS):
     # Initialize MySQL connection
     db = Database()
     db.connect()
     db.init_db()
     print("✅ Database connected and initialized")
 
-    # Load event_type -> command map
-    event_type_cmd_map = db.load_event_type_cmd_map()
-    print(f"✅ Loaded command map: {event_type_cmd_map}")
+    # Load the subscription index, then keep it in sync with changes made through other replicas
+    sync = SubscriptionSync(db)
+    subscriptions = sync.load()
+    print(f"✅ Loaded {subscriptions!r}")
+
+    if COMMAND_OUTPUT_DIR:
+        os.makedirs(COMMAND_OUTPUT_DIR, exist_ok=True)
+
+    if workers == 1:
+        sockets = tornado.netutil.bind_sockets(port)
+        app = Application(db, subscriptions)
+    else:
+        # The index is loaded once and shared copy-on-write; connections must not
+        # cross the fork, so every worker opens its own pool and syncs on its own.
+        # Each worker binds its own SO_REUSEPORT socket, so the kernel spreads
+        # connections evenly instead of waking every worker on each accept.
+        db.close()
+        tornado.process.fork_processes(workers)
+        db.connect()
+        sockets = tornado.netutil.bind_sockets(port, reuse_port=True)
+        app = Application(db, subscriptions, debug=False, worker=tornado.process.task_id(),
+                          workers=workers or tornado.process.cpu_count())
+        print(f"👷 Worker {tornado.process.task_id()} started")
 
     # Start the Tornado app
-    app = Application(db, event_type_cmd_map)
-    app.listen(port)
+    tornado.httpserver.HTTPServer(app).add_sockets(sockets)
+    sync.start()
+    # Finished commands free their resources for queued ones
+    tornado.ioloop.PeriodicCallback(app.scheduler.poll, SCHEDULER_POLL_INTERVAL * 1000).start()
 
     # Print the server info
     hostname = socket.gethostname()
@@ -49,5 +97,8 @@ if __name__ == "__main__":
     port = 8021
     if len(sys.argv) > 1:
         port = int(sys.argv[1])
+    workers = USER_SERVICE_WORKERS
+    if len(sys.argv) > 2:
+        workers = int(sys.argv[2])
 
-    main(port)
+    main(port, workers)
@@ -1,12 +1,90 @@
+import hmac
+import os
+import time
 from tornado.web import HTTPError
-from config import API_TOKEN
+from config import TOKEN_PATH, TOKEN_RELOAD_INTERVAL
+from instrumentation import logger
+
+# Validated Authorization headers remembered between token reloads
+MAX_CACHED_HEADERS = 1024
+
+
+class TokenAuthenticator:
+    """
+    Bearer token check against the tokens in a file.
+
+    The file holds one token per line (blank lines and "#" comments are
+    ignored), so a new token can be added next to the old one and the old one
+    removed once every client has switched. The file is stat()ed at most every
+    `reload_interval` seconds and re-read when it changes; a missing or empty
+    file keeps the tokens that were loaded last. Tokens are compared with
+    hmac.compare_digest against every accepted token, and headers that passed
+    are cached until the next reload, so the common case is a dict lookup.
+    """
+
+    def __init__(self, path, reload_interval=TOKEN_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._tokens = ()
+        self._signature = None
+        self._checked_at = 0.0
+        self._valid_headers = set()
+        self.reload()
+
+    def reload(self):
+        """Re-reads the token file if it changed since the last load."""
+        self._checked_at = time.monotonic()
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if signature == self._signature:
+                return
+            with open(self.path, "r") as f:
+                tokens = tuple(
+                    line.strip().encode("utf-8") for line in f
+                    if line.strip() and not line.lstrip().startswith("#")
+                )
+        except OSError:
+            if not self._tokens:
+                raise
+            logger.warning("Cannot read token file %s; keeping the current tokens", self.path)
+            return
+        if not tokens:
+            if not self._tokens:
+                raise ValueError(f"No tokens in {self.path}")
+            logger.warning("Token file %s is empty; keeping the current tokens", self.path)
+            return
+        self._tokens = tokens
+        self._signature = signature
+        # Revoked tokens must stop working immediately
+        self._valid_headers = set()
+        print(f"🔑 Loaded {len(tokens)} API token(s) from {self.path}")
+
+    def check(self, auth_header):
+        """True if auth_header is "Bearer <token>" for an accepted token."""
+        if time.monotonic() - self._checked_at >= self.reload_interval:
+            self.reload()
+        if auth_header in self._valid_headers:
+            return True
+        scheme, _, token = auth_header.partition(" ")
+        if scheme != "Bearer" or not token:
+            return False
+        token = token.encode("utf-8")
+        valid = False
+        # Compare against every token so the timing does not reveal which one matched
+        for accepted in self._tokens:
+            valid |= hmac.compare_digest(token, accepted)
+        if valid and len(self._valid_headers) < MAX_CACHED_HEADERS:
+            self._valid_headers.add(auth_header)
+        return valid
+
+
+authenticator = TokenAuthenticator(TOKEN_PATH)
+
 
 def authenticate(handler):
     def wrapper(self, *args, **kwargs):
-        auth_header = self.request.headers.get("Authorization", "")
-        #print(API_TOKEN)
-        if not auth_header.startswith("Bearer ") or auth_header.split(" ")[1] != API_TOKEN:
+        if not authenticator.check(self.request.headers.get("Authorization", "")):
             raise HTTPError(401, "Unauthorized")
         return handler(self, *args, **kwargs)
     return wrapper
-
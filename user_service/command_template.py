@@ -0,0 +1,69 @@
+import re
+import shlex
+
+# <name> placeholders; anything else in angle brackets (e.g. "< input.txt") is literal
+PLACEHOLDER = re.compile(r"<([A-Za-z_][A-Za-z0-9_]*)>")
+
+
+class MissingPlaceholderError(ValueError):
+    """Raised when an event does not provide a value for every placeholder."""
+
+    def __init__(self, missing):
+        self.missing = sorted(missing)
+        super().__init__(f"Missing values for placeholders: {', '.join(self.missing)}")
+
+
+class CommandTemplate:
+    """
+    A subscription command parsed once into literal and placeholder segments.
+
+    "python run.py <strategy> <date>" becomes literals ["python run.py ", " ", ""]
+    and placeholders ["strategy", "date"]; rendering interleaves them with the
+    shell-quoted event values in a single join, so the cost is proportional to
+    the output instead of (event keys x template length).
+
+    Values are quoted with shlex.quote, so templates should not wrap placeholders
+    in their own quotes.
+    """
+
+    __slots__ = ("source", "placeholders", "_literals", "_names")
+
+    def __init__(self, source):
+        parts = PLACEHOLDER.split(source)
+        self.source = source
+        self._literals = parts[0::2]
+        self._names = parts[1::2]
+        self.placeholders = frozenset(self._names)
+
+    def missing(self, values):
+        """Placeholders that values does not provide."""
+        return [name for name in self.placeholders if name not in values]
+
+    def render(self, values, quote=True):
+        """
+        Render the command for an event.
+
+        Args:
+            values (dict): Event fields, keyed by placeholder name
+            quote (bool): Shell-quote the values (False renders plain text, e.g. a path)
+
+        Returns:
+            str: The shell command
+
+        Raises:
+            MissingPlaceholderError: If a placeholder has no value
+        """
+        missing = self.missing(values)
+        if missing:
+            raise MissingPlaceholderError(missing)
+        out = [self._literals[0]]
+        for name, literal in zip(self._names, self._literals[1:]):
+            out.append(shlex.quote(str(values[name])) if quote else str(values[name]))
+            out.append(literal)
+        return "".join(out)
+
+    def __str__(self):
+        return self.source
+
+    def __repr__(self):
+        return f"CommandTemplate({self.source!r})"
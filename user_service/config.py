@@ -1,8 +1,65 @@
 import os
 
-# Read token from ~/.token file
-TOKEN_PATH = os.path.expanduser("~/.user_service.token")
-with open(TOKEN_PATH, "r") as f:
-    API_TOKEN = f.read().strip()
+# Accepted API tokens, one per line (several during a rotation); see auth.TokenAuthenticator
+TOKEN_PATH = os.path.expanduser(os.getenv("USER_SERVICE_TOKEN_PATH", "~/.user_service.token"))
+# Seconds between checks of the token file for changes
+TOKEN_RELOAD_INTERVAL = float(os.getenv("USER_SERVICE_TOKEN_RELOAD_INTERVAL", 1))
 
+# Number of recent jobs kept in memory for /jobs
+MAX_JOB_RECORDS = int(os.getenv("MAX_JOB_RECORDS", 1000))
+# Directory for each command's stdout and stderr, as <job_id>.log (empty discards the output)
+COMMAND_OUTPUT_DIR = os.getenv("COMMAND_OUTPUT_DIR", "")
 
+# Seconds between incremental subscription syncs from the database (0 disables)
+SUBSCRIPTION_SYNC_INTERVAL = float(os.getenv("SUBSCRIPTION_SYNC_INTERVAL", 5))
+# Each sync re-reads this many seconds before the watermark, covering in-flight transactions
+SUBSCRIPTION_SYNC_OVERLAP_SECONDS = int(os.getenv("SUBSCRIPTION_SYNC_OVERLAP_SECONDS", 5))
+# Tombstones older than this are purged; a replica that has been down longer reloads in full
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("TOMBSTONE_RETENTION_DAYS", 7))
+
+# Worker processes; each binds the port with SO_REUSEPORT (0 = one per CPU, 1 = single process)
+USER_SERVICE_WORKERS = int(os.getenv("USER_SERVICE_WORKERS", 1))
+# Tornado debug mode (autoreload); always off with more than one worker
+USER_SERVICE_DEBUG = os.getenv("USER_SERVICE_DEBUG", "true").lower() == "true"
+
+# Seconds an event's idempotency key is remembered, so re-deliveries do not re-run
+# its command (0 disables the cache); at most DEDUP_MAX_KEYS keys are kept
+DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", 0))
+DEDUP_MAX_KEYS = int(os.getenv("DEDUP_MAX_KEYS", 100000))
+
+# /health reports the node as saturated past any of these (0 disables a check);
+# the delivery Lambda then defers events instead of posting them
+MAX_RUNNING_JOBS = int(os.getenv("MAX_RUNNING_JOBS", 0))
+MAX_LOAD_PER_CPU = float(os.getenv("MAX_LOAD_PER_CPU", 2.0))
+MIN_AVAILABLE_MEMORY_RATIO = float(os.getenv("MIN_AVAILABLE_MEMORY_RATIO", 0.05))
+
+# Resource-aware command scheduling (see scheduler.py). Subscriptions declare what their
+# command uses; at most SCHEDULER_CPU_SLOTS slots and SCHEDULER_MEMORY_MB MB are handed out
+# at once and later commands wait in the run queue (0 disables a limit; with both 0 every
+# command starts at once). With several workers each one schedules an equal share.
+SCHEDULER_CPU_SLOTS = int(os.getenv("SCHEDULER_CPU_SLOTS", 0))
+SCHEDULER_MEMORY_MB = int(os.getenv("SCHEDULER_MEMORY_MB", 0))
+# How declared resources are enforced: "none" (accounting only), "cgroup" (cgroup v2
+# memory.max / cpu.max below SCHEDULER_CGROUP_ROOT, which must be delegated to the
+# service) or "rlimit" (CPU affinity, and memory_mb as a limit on virtual address space,
+# which threaded and numpy/BLAS programs reserve far beyond what they use)
+SCHEDULER_ENFORCEMENT = os.getenv("SCHEDULER_ENFORCEMENT", "none").lower()
+SCHEDULER_CGROUP_ROOT = os.getenv("SCHEDULER_CGROUP_ROOT", "/sys/fs/cgroup/user_service")
+# Seconds between checks for finished commands, whose resources go to queued ones
+SCHEDULER_POLL_INTERVAL = float(os.getenv("SCHEDULER_POLL_INTERVAL", 0.5))
+# Commands the run queue holds before events are refused with 503 (0 = unbounded);
+# /health reports the node as saturated once it is full
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", 0))
+
+# Warm Python worker pool (see warm_pool.py; 0 disables): Python commands and entry points
+# run in workers forked ahead of time from a process that has WARM_POOL_MODULES imported
+WARM_POOL_SIZE = int(os.getenv("WARM_POOL_SIZE", 0))
+WARM_POOL_MODULES = [module.strip() for module in os.getenv("WARM_POOL_MODULES", "").split(",") if module.strip()]
+# Interpreter of the pool: only commands whose `python` resolves to it run in the pool
+WARM_POOL_PYTHON = os.getenv("WARM_POOL_PYTHON", "python3")
+# Seconds the pool may take to start a command before the job fails
+WARM_POOL_START_TIMEOUT = float(os.getenv("WARM_POOL_START_TIMEOUT", 5))
+
+# Results of subscriptions that opt in to the result cache (see result_cache.py) kept
+# at most; least recently used first out (0 disables the cache)
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 10000))
@@ -1,29 +1,89 @@
 import pymysql
 import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from tornado.ioloop import IOLoop
+from instrumentation import DB_QUERY_SECONDS
+from options import KEEP
+from subscriptions import SubscriptionIndex
 
 # Load environment variables from .env file
 load_dotenv()
 
+_connection_factory = pymysql.connect
+
+# The newest tools/migrate.py migration whose tables and columns the queries here use
+SCHEMA_VERSION = 6
+
+# Subscription columns an upsert may leave as stored: pass KEEP for them (None clears them)
+OPTIONAL_COLUMNS = ("filter_expression", "resources", "result_cache")
+
+
+def _upsert_query(kept):
+    """The subscription upsert; an existing row keeps the optional columns in kept."""
+    updates = ", ".join(f"{column} = VALUES({column})" for column in OPTIONAL_COLUMNS if column not in kept)
+    return f'''
+        INSERT INTO subscriptions (username, event_type, command, filter_expression, resources, result_cache)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+        command = VALUES(command), {updates + ", " if updates else ""}updated_at = CURRENT_TIMESTAMP
+    '''
+
+
+def _kept(options):
+    return frozenset(column for column, value in zip(OPTIONAL_COLUMNS, options) if value is KEEP)
+
+
+def _stored(options):
+    return tuple(None if value is KEEP else value for value in options)
+
+
+def set_connection_factory(factory):
+    """
+    Open connections through factory instead of pymysql.connect.
+
+    Used by local_stack to back the service with SQLite. Pass None to restore pymysql.
+    """
+    global _connection_factory
+    _connection_factory = factory or pymysql.connect
+
 
 class Database:
     """
     A class to manage MySQL database operations for subscriptions using pymysql.
+
+    Queries run on a small pool of connections. Handlers call them through `run()`,
+    which executes them on a thread pool sized to the connection pool, so a slow
+    query never blocks the IOLoop (and the event triggers it serves).
     """
 
-    def __init__(self):
+    def __init__(self, pool_size=None):
         # Read MySQL credentials from environment variables
         self.host = os.getenv("MYSQL_HOST")
         self.database = os.getenv("MYSQL_DATABASE")
         self.user = os.getenv("MYSQL_USER")
         self.password = os.getenv("MYSQL_PASSWORD")
         self.port = int(os.getenv("MYSQL_PORT", 3306))
-        self.connection = None
+        self.pool_size = pool_size or int(os.getenv("MYSQL_POOL_SIZE", 4))
+        # A connection idle for longer is pinged (and reopened if the server dropped it) before use
+        self.ping_after = float(os.getenv("MYSQL_POOL_PING_SECONDS", 30))
+        # (connection, last used) per slot; the connection is None while the slot waits to be reopened
+        self._pool = queue.Queue()
+        self._executor = None
 
     def connect(self):
-        """Establishes a connection to the MySQL database."""
-        print("🔌 Connecting to the MySQL database...")
-        self.connection = pymysql.connect(
+        """Opens the connection pool and the executor that runs queries off the IOLoop."""
+        print(f"🔌 Connecting to the MySQL database (pool of {self.pool_size})...")
+        for _ in range(self.pool_size):
+            self._pool.put((self._open_connection(), time.monotonic()))
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="mysql")
+        print("✅ Connected to MySQL successfully.")
+
+    def _open_connection(self):
+        return _connection_factory(
             host=self.host,
             user=self.user,
             password=self.password,
@@ -32,115 +92,243 @@ class Database:
             cursorclass=pymysql.cursors.DictCursor,
             autocommit=True
         )
-        print("✅ Connected to MySQL successfully.")
+
+    @contextmanager
+    def _connection(self):
+        """
+        Borrows a pooled connection. A connection that failed is dropped and its slot
+        reopened on the next borrow, so while MySQL is down each borrow fails on its
+        own and the pool recovers once it is back.
+        """
+        connection, last_used = self._pool.get()
+        try:
+            if connection is None or not connection.open:
+                connection = self._open_connection()
+            elif time.monotonic() - last_used > self.ping_after:
+                connection.ping(reconnect=True)
+            yield connection
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            self._discard(connection)
+            connection = None
+            raise
+        finally:
+            self._pool.put((connection, time.monotonic()))
+
+    @staticmethod
+    def _discard(connection):
+        if connection is None:
+            return
+        try:
+            connection.close()
+        except pymysql.err.Error:
+            pass  # Already closed
+
+    @contextmanager
+    def _transaction(self):
+        """Borrows a pooled connection and yields a cursor inside one transaction."""
+        with self._connection() as connection:
+            connection.begin()
+            try:
+                with connection.cursor() as cursor:
+                    yield cursor
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+
+    async def run(self, method, *args):
+        """
+        Runs a blocking Database method on the query executor.
+
+        Example:
+            await db.run(db.upsert_subscription, username, event_type, command)
+        """
+        return await IOLoop.current().run_in_executor(self._executor, method, *args)
 
     def init_db(self):
-        """Initializes the `subscriptions` table if it does not exist."""
-        print("🛠️  Initializing the database and creating subscriptions table if not exists...")
-        with self.connection.cursor() as cursor:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS subscriptions (
-                    username VARCHAR(255) NOT NULL,
-                    event_type VARCHAR(255) NOT NULL,
-                    command TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    PRIMARY KEY (username, event_type)
-                )
-            ''')
-        print("✅ Table 'subscriptions' is ready.")
+        """
+        Checks that the shared schema is migrated up to SCHEMA_VERSION.
+
+        The tables are owned by tools/migrate.py: user_service creates none of its
+        own, so the schema is the same whichever process reaches a database first.
+
+        Raises:
+            RuntimeError: If a migration up to SCHEMA_VERSION has not been applied;
+                run `python -m tools.migrate up` first.
+        """
+        print("🛠️  Checking the database schema...")
+        with self._connection() as connection, connection.cursor() as cursor:
+            try:
+                cursor.execute("SELECT version FROM schema_migrations")
+                applied = {row["version"] for row in cursor.fetchall()}
+            except pymysql.err.ProgrammingError:
+                applied = set()  # No migration has run yet
+        missing = [version for version in range(1, SCHEMA_VERSION + 1) if version not in applied]
+        if missing:
+            raise RuntimeError(f"Schema migrations {missing} are not applied; run `python -m tools.migrate up`")
+        print(f"✅ Schema is at migration {SCHEMA_VERSION} or later.")
 
-    def upsert_subscription(self, username, event_type, command):
+    @DB_QUERY_SECONDS.timed(op="upsert_subscription")
+    def upsert_subscription(self, username, event_type, command, filter_expression=KEEP, resources=KEEP,
+                            result_cache=KEEP):
         """
-        Inserts or updates a subscription for a (username, event_type) pair.
+        Inserts or updates a subscription for a (username, event_type) pair,
+        clearing any tombstone left by an earlier delete. The filter, the
+        declared resources and the result cache policy are replaced when given
+        (None removes them) and kept as stored when KEEP.
+
+        Returns:
+            dict: The stored subscription, including created_at / updated_at.
         """
         print(f"📥 Upserting subscription: username={username}, event_type={event_type}, command={command}")
-        with self.connection.cursor() as cursor:
+        options = (filter_expression, resources, result_cache)
+        with self._transaction() as cursor:
+            cursor.execute(_upsert_query(_kept(options)), (username, event_type, command, *_stored(options)))
             cursor.execute('''
-                INSERT INTO subscriptions (username, event_type, command)
-                VALUES (%s, %s, %s)
-                ON DUPLICATE KEY UPDATE
-                command = VALUES(command), updated_at = CURRENT_TIMESTAMP
-            ''', (username, event_type, command))
+                DELETE FROM subscription_tombstones
+                WHERE username = %s AND event_type = %s
+            ''', (username, event_type))
+            cursor.execute('''
+                SELECT username, event_type, command, created_at, updated_at, filter_expression, resources, result_cache
+                FROM subscriptions
+                WHERE username = %s AND event_type = %s
+            ''', (username, event_type))
+            record = cursor.fetchone()
         print("✅ Subscription added/updated successfully.")
+        return record
 
+    @DB_QUERY_SECONDS.timed(op="delete_subscription")
     def delete_subscription(self, username, event_type):
         """
-        Deletes a subscription for a given username and event_type.
+        Deletes a subscription for a given username and event_type and records a tombstone.
         """
         print(f"❌ Deleting subscription for username={username}, event_type={event_type}")
-        with self.connection.cursor() as cursor:
+        with self._transaction() as cursor:
             cursor.execute('''
                 DELETE FROM subscriptions
                 WHERE username = %s AND event_type = %s
             ''', (username, event_type))
+            cursor.execute('''
+                INSERT INTO subscription_tombstones (username, event_type)
+                VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE deleted_at = CURRENT_TIMESTAMP
+            ''', (username, event_type))
         print("✅ Subscription deleted successfully.")
 
-    def load_event_type_cmd_map(self):
+    @DB_QUERY_SECONDS.timed(op="apply_subscription_changes")
+    def apply_subscription_changes(self, username, upserts, deletes):
         """
-        Loads all subscriptions into an in-memory dictionary.
+        Upserts and deletes several subscriptions of one user in a single transaction.
+
+        Args:
+            username (str): The subscriber
+            upserts (list): (event_type, command, filter_expression, resources, result_cache) to insert or
+                update; KEEP leaves that column as stored
+            deletes (list): Event types to unsubscribe from (tombstones are recorded)
 
         Returns:
-            dict: Mapping of (username, event_type) to command.
+            list: The stored upserted subscriptions, including created_at / updated_at.
         """
-        print("🔄 Loading event_type-command map from database...")
-        event_type_cmd_map = {}
-        with self.connection.cursor() as cursor:
-            cursor.execute("SELECT username, event_type, command FROM subscriptions")
-            records = cursor.fetchall()
-            for record in records:
-                event_type_cmd_map[(record['username'], record['event_type'])] = record['command']
-        print(f"✅ Loaded {len(event_type_cmd_map)} subscriptions into in-memory map.")
-        return event_type_cmd_map
+        print(f"📥 Applying {len(upserts)} upsert(s) and {len(deletes)} delete(s) for username={username}")
+        records = []
+        with self._transaction() as cursor:
+            if upserts:
+                # One statement per set of kept columns; usually all upserts share one
+                by_kept = {}
+                for event_type, command, *options in upserts:
+                    by_kept.setdefault(_kept(options), []).append((username, event_type, command, *_stored(options)))
+                for kept, rows in by_kept.items():
+                    cursor.executemany(_upsert_query(kept), rows)
+                cursor.executemany('''
+                    DELETE FROM subscription_tombstones
+                    WHERE username = %s AND event_type = %s
+                ''', [(username, upsert[0]) for upsert in upserts])
+            if deletes:
+                cursor.executemany('''
+                    DELETE FROM subscriptions
+                    WHERE username = %s AND event_type = %s
+                ''', [(username, event_type) for event_type in deletes])
+                cursor.executemany('''
+                    INSERT INTO subscription_tombstones (username, event_type)
+                    VALUES (%s, %s)
+                    ON DUPLICATE KEY UPDATE deleted_at = CURRENT_TIMESTAMP
+                ''', [(username, event_type) for event_type in deletes])
+            if upserts:
+                placeholders = ", ".join(["%s"] * len(upserts))
+                cursor.execute(f'''
+                    SELECT username, event_type, command, created_at, updated_at, filter_expression, resources, result_cache
+                    FROM subscriptions
+                    WHERE username = %s AND event_type IN ({placeholders})
+                ''', (username, *(upsert[0] for upsert in upserts)))
+                records = cursor.fetchall()
+        print("✅ Subscription changes applied successfully.")
+        return records
 
-    def list_subscriptions(self, username, event_type=None):
+    @DB_QUERY_SECONDS.timed(op="load_subscription_index")
+    def load_subscription_index(self):
         """
-        Lists all subscriptions for a username, optionally filtered by event_type.
+        Loads all subscriptions into an in-memory index, compiling each command once.
+
+        Returns:
+            SubscriptionIndex: Subscriptions indexed by event_type and by username.
+        """
+        print("🔄 Loading subscriptions from database...")
+        with self._connection() as connection, connection.cursor() as cursor:
+            cursor.execute('''
+                SELECT username, event_type, command, created_at, updated_at, filter_expression, resources, result_cache
+                FROM subscriptions
+            ''')
+            subscriptions = SubscriptionIndex(cursor.fetchall())
+        print(f"✅ Loaded {len(subscriptions)} subscriptions into the in-memory index.")
+        return subscriptions
+
+    def current_timestamp(self):
+        """The database clock, used as the sync watermark (TIMESTAMP columns use it too)."""
+        with self._connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT CURRENT_TIMESTAMP AS now")
+            return cursor.fetchone()["now"]
+
+    @DB_QUERY_SECONDS.timed(op="fetch_subscription_changes")
+    def fetch_subscription_changes(self, since):
+        """
+        Fetches subscriptions changed and deleted at or after `since`.
 
         Args:
-            username (str): The username whose subscriptions are listed.
-            event_type (str, optional): Filters by event_type if provided.
+            since (datetime): Watermark in database time.
 
         Returns:
-            list: List of dictionaries containing subscription details.
-        """
-        print(f"📋 Listing subscriptions for username={username}" + (f", event_type={event_type}" if event_type else ""))
-        
-        query = '''
-            SELECT username, event_type, command, created_at, updated_at
-            FROM subscriptions
-            WHERE username = %s
-        '''
-        params = [username]
-
-        if event_type:
-            query += " AND event_type = %s"
-            params.append(event_type)
-
-        with self.connection.cursor() as cursor:
-            cursor.execute(query, params)
-            records = cursor.fetchall()
-
-        subscriptions = [
-            {
-                "username": record["username"],
-                "event_type": record["event_type"],
-                "command": record["command"],
-                "created_at": str(record["created_at"]),
-                "updated_at": str(record["updated_at"]),
-            }
-            for record in records
-        ]
-
-        print(f"✅ Found {len(subscriptions)} subscription(s) for username='{username}'" +
-              (f", event_type='{event_type}'" if event_type else ""))
-        return subscriptions
+            tuple: (upserts, tombstones) - lists of records with `updated_at` / `deleted_at`.
+        """
+        with self._connection() as connection, connection.cursor() as cursor:
+            cursor.execute('''
+                SELECT username, event_type, command, created_at, updated_at, filter_expression, resources, result_cache
+                FROM subscriptions
+                WHERE updated_at >= %s
+            ''', (since,))
+            upserts = cursor.fetchall()
+            cursor.execute('''
+                SELECT username, event_type, deleted_at
+                FROM subscription_tombstones
+                WHERE deleted_at >= %s
+            ''', (since,))
+            tombstones = cursor.fetchall()
+        return upserts, tombstones
+
+    @DB_QUERY_SECONDS.timed(op="purge_tombstones")
+    def purge_tombstones(self, before):
+        """Deletes tombstones older than `before`; replicas further behind reload in full."""
+        with self._connection() as connection, connection.cursor() as cursor:
+            cursor.execute("DELETE FROM subscription_tombstones WHERE deleted_at < %s", (before,))
+            return cursor.rowcount
 
     def close(self):
-        """Closes the MySQL connection."""
-        if self.connection:
-            self.connection.close()
-            print("🔌 MySQL connection closed.")
+        """Closes the pooled MySQL connections."""
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        while not self._pool.empty():
+            self._discard(self._pool.get_nowait()[0])
+        print("🔌 MySQL connections closed.")
 
 
 
@@ -0,0 +1,39 @@
+import time
+from collections import OrderedDict
+
+
+class DedupCache:
+    """
+    Idempotency keys of recently executed events, each with the job it started.
+
+    Keys expire `window_seconds` after they were added; beyond `max_keys` the
+    least recently seen key is evicted first. SQS FIFO only deduplicates for
+    five minutes, so this covers re-deliveries and replays over longer windows.
+    """
+
+    def __init__(self, window_seconds, max_keys, clock=time.monotonic):
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._clock = clock
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """The job_id recorded for key, or None if it is unknown or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, job_id = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return job_id
+
+    def add(self, key, job_id):
+        self._entries[key] = (self._clock() + self.window_seconds, job_id)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,7 +1,21 @@
 import tornado.web
 import tornado.escape
-from utils import execute_cmd
 from auth import authenticate
+from instrumentation import COMMANDS_CACHED, COMMANDS_DEDUPLICATED, REGISTRY, logger
+from jobs import Job, now_ms, parse_hops
+from load import node_load
+from filters import parse_filter
+from options import canonical_options
+from scheduler import parse_resources, stored_resources
+from result_cache import ResultCache, parse_cache_policy, stored_cache_policy
+
+TRACE_ID_HEADER = "X-Trace-Id"
+TRACE_HOPS_HEADER = "X-Trace-Hops"
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+# Set by the user-queue Lambda, which posts the queued event unchanged
+USERNAME_HEADER = "X-Event-Username"
+# Options of /subscribe and bulk upserts, in the order of db.OPTIONAL_COLUMNS
+SUBSCRIPTION_OPTIONS = (("filter", parse_filter), ("resources", parse_resources), ("result_cache", parse_cache_policy))
 
 
 class MainHandler(tornado.web.RequestHandler):
@@ -13,6 +27,15 @@ class MainHandler(tornado.web.RequestHandler):
     def post(self):
         """
         Trigger command for a given username and event_type by replacing placeholders with data from request.
+        The trace context (X-Trace-Id / X-Trace-Hops headers) is recorded in the job and passed to the
+        command as EVENT_TRACE_ID / EVENT_JOB_ID environment variables, the Idempotency-Key header
+        as EVENT_IDEMPOTENCY_KEY. The X-Event-Username header, when present, is the username
+        (it takes precedence over the payload's). With the dedup cache enabled, an event whose key already ran a
+        command within DEDUP_WINDOW_SECONDS is not executed again. The command is handed to the scheduler,
+        which starts it once the node has the subscription's declared resources free (see scheduler.py).
+        For a subscription with a result cache policy, an event that renders the same command (with
+        unchanged input files) as an earlier one that is still running or succeeded is answered with
+        that job instead (see result_cache.py).
         Request JSON:
             {
                 "username": "user1",
@@ -21,12 +44,29 @@ class MainHandler(tornado.web.RequestHandler):
             }
 
         Response:
-            200 OK: {"status": "Command executed"}
+            200 OK: {"status": "Command executed", "job_id": "...", "trace_id": "..."}
+            200 OK: {"status": "Command queued", "job_id": "...", "trace_id": "..."}
+            200 OK: {"status": "Duplicate ignored", "job_id": "<job of the first delivery>", "trace_id": "..."}
+            200 OK: {"status": "Cached result", "job_id": "<job that has the result>", "state": "running" | "finished",
+                     "exit_code": 0 | null, "trace_id": "..."}
             400 Bad Request: {"error": "event_type and username are required"}
+            400 Bad Request: {"error": "Missing values for placeholders: ...", "missing": [...]}
             404 Not Found: {"error": "No command found for this event_type and username"}
+            500 Internal Server Error: {"error": "Command could not be started", "job_id": "..."}
+            503 Service Unavailable: {"error": "Run queue is full"}
         """
+        received_ms = now_ms()
+        hops = parse_hops(self.request.headers.get(TRACE_HOPS_HEADER))
+        trace_id = self.request.headers.get(TRACE_ID_HEADER)
         body = tornado.escape.json_decode(self.request.body)
-        print(f"payload: {body}")
+        logger.debug("payload: %s", body)
+        if not isinstance(body, dict):
+            self.set_status(400)
+            self.write({"error": "payload must be a JSON object"})
+            return
+        header_username = self.request.headers.get(USERNAME_HEADER)
+        if header_username:
+            body["username"] = header_username
         event_type = body.get("event_type")
         username = body.get("username")
         
@@ -35,42 +75,98 @@ class MainHandler(tornado.web.RequestHandler):
             self.write({"error": "event_type and username are required"})
             return
 
-        key = (username, event_type)
-        command_template = self.application.event_type_cmd_map.get(key)    
-        if not command_template:
+        subscription = self.application.subscriptions.get(username, event_type)
+        if not subscription:
             self.set_status(404)
             self.write({"error": "No command found for this event_type and username"})
             return
-
-        # Replace placeholders in command
-        command = command_template
-        for k, v in body.items():
-            command = command.replace(f"<{k}>", str(v))
-
-        print(f"⚙️ Executing command: {command}")
-
-        # Execute command synchronously
-        execute_cmd(command)
-        self.write({"status": "Command executed"})
+        command_template = subscription.command
+
+        idempotency_key = self.request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        dedup = self.application.dedup
+        dedup_key = (username, event_type, idempotency_key)
+        if idempotency_key and dedup is not None:
+            job_id = dedup.get(dedup_key)
+            if job_id:
+                COMMANDS_DEDUPLICATED.inc(event_type=event_type)
+                logger.debug("Duplicate event ignored (idempotency_key=%s, job_id=%s)", idempotency_key, job_id)
+                self.write({"status": "Duplicate ignored", "job_id": job_id, "trace_id": trace_id})
+                return
+
+        # Fill placeholders from the precompiled template; refuse to spawn a command with holes
+        missing = command_template.missing(body)
+        if missing:
+            self.set_status(400)
+            self.write({"error": f"Missing values for placeholders: {', '.join(sorted(missing))}",
+                        "missing": sorted(missing)})
+            return
+        command = command_template.render(body)
+
+        policy = stored_cache_policy(subscription.result_cache)
+        result_cache = self.application.result_cache
+        cache_key = None
+        if policy is not None and result_cache is not None:
+            fingerprint = policy.fingerprint(body)
+            if fingerprint is not None:
+                cache_key = ResultCache.key(username, command, fingerprint)
+                cached = result_cache.get(cache_key)
+                if cached is not None:
+                    COMMANDS_CACHED.inc(event_type=event_type)
+                    logger.debug("Cached result of job %s (%s) for: %s", cached.job_id, cached.state, command)
+                    self.write({"status": "Cached result", "job_id": cached.job_id, "state": cached.state,
+                                "exit_code": cached.exit_code, "trace_id": trace_id})
+                    return
+
+        job = Job(username, event_type, command, trace_id, hops)
+        job.add_hop("service_in", received_ms)
+
+        # Start the command now if its resources are free, else queue it
+        env = {"EVENT_TRACE_ID": trace_id or "", "EVENT_JOB_ID": job.job_id,
+               "EVENT_IDEMPOTENCY_KEY": idempotency_key or ""}
+        if not self.application.scheduler.submit(job, command, env, stored_resources(subscription.resources)):
+            self.set_status(503)
+            self.write({"error": "Run queue is full"})
+            return
+        self.application.jobs.add(job)
+        if job.state == "failed":
+            self.set_status(500)
+            self.write({"error": "Command could not be started", "job_id": job.job_id})
+            return
+        if idempotency_key and dedup is not None:
+            dedup.add(dedup_key, job.job_id)
+        if cache_key is not None:
+            result_cache.add(cache_key, job, policy.ttl_seconds)
+        if job.state == "queued":
+            logger.debug("Command queued (job_id=%s, %d waiting)", job.job_id, self.application.scheduler.queued)
+        status = "Command queued" if job.state == "queued" else "Command executed"
+        self.write({"status": status, "job_id": job.job_id, "trace_id": trace_id})
 
 
 class SubscribeHandler(tornado.web.RequestHandler):
     """
-    Handler to subscribe a user to an event with a command.
+    Handler to subscribe a user to an event with a command, optionally only for
+    events matching a filter (see filters.py), with the resources the command uses
+    (see scheduler.py) and a result cache policy for a deterministic command (see
+    result_cache.py). Omitting filter, resources or result_cache keeps what the
+    subscription has (nothing for a new one); null removes it.
     Request JSON:
             {
                 "username": "user1",
                 "event_type": "deploy",
-                "command": "bash deploy.sh <branch>"
+                "command": "bash deploy.sh <branch>",
+                "filter": {"branch": {"prefix": "release/"}},
+                "resources": {"cpu_slots": 4, "memory_mb": 8192, "priority": 1},
+                "result_cache": {"ttl_seconds": 86400, "inputs": ["/data/<branch>/config.yaml"]}
             }
 
         Response:
             200 OK: {"status": "Subscription added/updated"}
             400 Bad Request: {"error": "event_type, command, and username are required"}
+            400 Bad Request: {"error": "Invalid filter: ..."}, likewise for resources and result_cache
     """
 
     @authenticate
-    def post(self):
+    async def post(self):
         """
         Add or update a subscription for a username and event_type.
         """
@@ -83,12 +179,21 @@ class SubscribeHandler(tornado.web.RequestHandler):
             self.set_status(400)
             self.write({"error": "event_type, command, and username are required"})
             return
+        try:
+            options = canonical_options(body, SUBSCRIPTION_OPTIONS)
+        except ValueError as e:
+            self.set_status(400)
+            self.write({"error": f"Invalid {e}"})
+            return
 
-        # Insert or update in DB (synchronously)
-        self.application.db.upsert_subscription(username, event_type, command)
+        # Insert or update in DB (on the query executor, off the IOLoop)
+        db = self.application.db
+        record = await db.run(db.upsert_subscription, username, event_type, command, *options)
 
-        # Update in-memory map
-        self.application.event_type_cmd_map[(username, event_type)] = command
+        # Update the in-memory index with the compiled command and the options as stored
+        self.application.subscriptions.put(username, event_type, command, record["created_at"],
+                                           record["updated_at"], record["filter_expression"], record["resources"],
+                                           record["result_cache"])
 
         print(f"✅ Subscription added/updated for ({username}, {event_type}) -> {command}")
 
@@ -101,7 +206,7 @@ class UnsubscribeHandler(tornado.web.RequestHandler):
     """
 
     @authenticate
-    def post(self):
+    async def post(self):
         """
         Delete a subscription for a username and event_type.
         """
@@ -114,48 +219,115 @@ class UnsubscribeHandler(tornado.web.RequestHandler):
             self.write({"error": "event_type and username are required"})
             return
 
-        # Remove from DB (synchronously)
-        self.application.db.delete_subscription(username, event_type)
+        # Remove from DB (on the query executor, off the IOLoop)
+        db = self.application.db
+        await db.run(db.delete_subscription, username, event_type)
 
-        # Remove from in-memory map
-        self.application.event_type_cmd_map.pop((username, event_type), None)
+        # Remove from the in-memory index
+        self.application.subscriptions.remove(username, event_type)
 
         print(f"🗑️ Subscription removed for ({username}, {event_type})")
 
         self.write({"status": "Subscription removed"})
 
 
+class BulkSubscriptionsHandler(tornado.web.RequestHandler):
+    """
+    Handler to apply several subscription changes of one user at once, in one DB transaction.
+    As for /subscribe, an upsert without filter, resources or result_cache keeps the stored one.
+    Request JSON:
+            {
+                "username": "user1",
+                "upserts": [{"event_type": "deploy", "command": "bash deploy.sh <branch>",
+                             "filter": {"branch": "main"}, "resources": {"cpu_slots": 2}}],
+                "deletes": ["build"]
+            }
+
+        Response:
+            200 OK: {"status": "Subscriptions updated", "upserted": 1, "deleted": 1}
+            400 Bad Request: {"error": "username and at least one upsert or delete are required"}
+            400 Bad Request: {"error": "every upsert needs an event_type and a command"}
+            400 Bad Request: {"error": "Invalid filter: ... (event_type deploy)"}, likewise for resources
+                             and result_cache
+    """
+
+    @authenticate
+    async def post(self):
+        """
+        Add, update and remove subscriptions of a username.
+        """
+        body = tornado.escape.json_decode(self.request.body)
+        username = body.get("username")
+        upserts = body.get("upserts") or []
+        deletes = body.get("deletes") or []
+
+        if not username or not (upserts or deletes):
+            self.set_status(400)
+            self.write({"error": "username and at least one upsert or delete are required"})
+            return
+        if any(not u.get("event_type") or not u.get("command") for u in upserts):
+            self.set_status(400)
+            self.write({"error": "every upsert needs an event_type and a command"})
+            return
+
+        changes = []
+        for upsert in upserts:
+            try:
+                options = canonical_options(upsert, SUBSCRIPTION_OPTIONS)
+            except ValueError as e:
+                self.set_status(400)
+                self.write({"error": f"Invalid {e} (event_type {upsert['event_type']})"})
+                return
+            changes.append((upsert["event_type"], upsert["command"], *options))
+
+        db = self.application.db
+        records = await db.run(db.apply_subscription_changes, username, changes, deletes)
+
+        subscriptions = self.application.subscriptions
+        for event_type in deletes:
+            subscriptions.remove(username, event_type)
+        for record in records:
+            subscriptions.put(username, record["event_type"], record["command"],
+                              record["created_at"], record["updated_at"], record["filter_expression"],
+                              record["resources"], record["result_cache"])
+
+        print(f"✅ Subscriptions updated for {username}: {len(records)} upserted, {len(deletes)} removed")
+
+        self.write({"status": "Subscriptions updated", "upserted": len(records), "deleted": len(deletes)})
+
+
 class ListSubscriptionsHandler(tornado.web.RequestHandler):
     """
-    Handler to list all subscriptions for a username, optionally filtered by event_type.
+    Handler to list all subscriptions for a username, optionally filtered by event_type,
+    or all subscribers of an event_type. Served from the in-memory subscription index.
     Query parameters:
-            - username (required)
+            - username (required unless event_type is given)
             - event_type (optional)
 
         Example:
             GET /list_subscriptions?username=user1
             GET /list_subscriptions?username=user1&event_type=deploy
+            GET /list_subscriptions?event_type=deploy
 
         Response:
             200 OK: List of subscriptions
-            400 Bad Request: {"error": "username is required"}
+            400 Bad Request: {"error": "username or event_type is required"}
     """
 
     @authenticate
     def get(self):
         """
-        List subscriptions for a username (optionally filtered by event_type).
+        List subscriptions for a username and/or event_type.
         """
         username = self.get_argument("username", None)
         event_type = self.get_argument("event_type", None)
 
-        if not username:
+        if not username and not event_type:
             self.set_status(400)
-            self.write({"error": "username is required"})
+            self.write({"error": "username or event_type is required"})
             return
 
-        # Fetch subscriptions from DB (synchronously)
-        subscriptions = self.application.db.list_subscriptions(username, event_type)
+        subscriptions = [s.to_dict() for s in self.application.subscriptions.list(username, event_type)]
 
         print(f"📋 Listed {len(subscriptions)} subscription(s) for username='{username}'" + (f", event_type='{event_type}'" if event_type else ""))
 
@@ -164,13 +336,81 @@ class ListSubscriptionsHandler(tornado.web.RequestHandler):
 
 class HealthHandler(tornado.web.RequestHandler):
     """
-    Health check endpoint to ensure the server is running.
+    Health check endpoint to ensure the server is running, with the node's load.
+
+        Response:
+            200 OK: {"status": "ok" | "saturated", "running_jobs": 3, "queued_jobs": 0,
+                     "cpu": {...}, "memory": {...}, "scheduler": {...}, "reasons": [...]}
+    """
+
+    @authenticate
+    def get(self):
+        """
+        Health check endpoint; "saturated" tells the delivery Lambda to hold back events.
+        """
+        scheduler = self.application.scheduler
+        load = node_load(scheduler.poll(), scheduler.queued)
+        self.write({"status": "saturated" if load.pop("saturated") else "ok", **load,
+                    "scheduler": scheduler.to_dict()})
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """
+    Prometheus scrape endpoint: request, DB and command spawn timings.
     """
 
     @authenticate
     def get(self):
         """
-        Health check endpoint.
+        Metrics in the Prometheus text exposition format.
         """
-        self.write({"status": "ok"})
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(REGISTRY.render())
+
+
+class JobsHandler(tornado.web.RequestHandler):
+    """
+    Handler to inspect recent jobs and their trace hops.
+    Query parameters:
+            - job_id (optional): return a single job
+            - username, event_type, trace_id (optional): filters
+            - limit (optional, default 100): a positive integer
+
+        Response:
+            200 OK: {"jobs": [...]}
+            400 Bad Request: {"error": "limit must be a positive integer"}
+            404 Not Found: {"error": "Job not found"}
+    """
+
+    @authenticate
+    def get(self):
+        """
+        List recent jobs, most recent first, with end-to-end latency and slowest hop.
+        """
+        self.application.scheduler.poll()
+        job_id = self.get_argument("job_id", None)
+        if job_id:
+            job = self.application.jobs.get(job_id)
+            if job is None:
+                self.set_status(404)
+                self.write({"error": "Job not found"})
+                return
+            self.write({"jobs": [job.to_dict()]})
+            return
+
+        try:
+            limit = int(self.get_argument("limit", 100))
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            self.set_status(400)
+            self.write({"error": "limit must be a positive integer"})
+            return
 
+        jobs = self.application.jobs.find(
+            username=self.get_argument("username", None),
+            event_type=self.get_argument("event_type", None),
+            trace_id=self.get_argument("trace_id", None),
+            limit=limit,
+        )
+        self.write({"jobs": [job.to_dict() for job in jobs]})
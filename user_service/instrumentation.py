@@ -0,0 +1,189 @@
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Payload dumps are logged at DEBUG, so the default level keeps them out of the logs
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger("user_service")
+logger.setLevel(LOG_LEVEL)
+if not logging.getLogger().handlers:
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    """A Prometheus counter with optional labels."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """A Prometheus gauge (a value that goes up and down) with optional labels."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """A Prometheus histogram (seconds) with optional labels."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the enclosed block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def timed(self, **labels):
+        """Decorator form of time()."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for key, (buckets, count, total) in self._series.items():
+                for bound, n in zip(self.buckets, buckets):
+                    lines.append(f"{self.name}_bucket{_labels(names, key + (bound,))} {n}")
+                lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+        return lines
+
+
+class Registry:
+    """Holds the service's metrics and renders the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, documentation, labelnames=()):
+        metric = Gauge(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "user_service_http_request_seconds", "Time spent handling HTTP requests", ("handler", "method", "status"))
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "user_service_db_query_seconds", "Time spent in database calls", ("op",))
+COMMAND_SPAWN_SECONDS = REGISTRY.histogram(
+    "user_service_command_spawn_seconds", "Time spent spawning subscription commands", ("mode",))
+COMMANDS_TOTAL = REGISTRY.counter(
+    "user_service_commands_total", "Subscription commands started", ("event_type",))
+COMMANDS_DEDUPLICATED = REGISTRY.counter(
+    "user_service_commands_deduplicated_total", "Events skipped as duplicates of an executed event", ("event_type",))
+COMMANDS_CACHED = REGISTRY.counter(
+    "user_service_commands_cached_total", "Events answered with the result of an earlier run", ("event_type",))
+SUBSCRIPTION_SYNC_CHANGES = REGISTRY.counter(
+    "user_service_subscription_sync_changes_total", "Subscription changes applied by the sync", ("kind",))
+SCHEDULER_QUEUED_JOBS = REGISTRY.gauge(
+    "user_service_scheduler_queued_jobs", "Commands waiting in the run queue", ("event_type",))
+SCHEDULER_CPU_SLOTS_USED = REGISTRY.gauge(
+    "user_service_scheduler_cpu_slots_used", "CPU slots held by running commands", ("event_type",))
+SCHEDULER_WAIT_SECONDS = REGISTRY.histogram(
+    "user_service_scheduler_wait_seconds", "Time commands waited in the run queue", ("event_type",),
+    buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0))
+
+
+def log_request(handler):
+    """Tornado log_function: records request timing and keeps the access log."""
+    request_time = handler.request.request_time()
+    status = handler.get_status()
+    HTTP_REQUEST_SECONDS.observe(request_time, handler=type(handler).__name__,
+                                 method=handler.request.method, status=status)
+    logger.debug("%d %s %.2fms", status, handler._request_summary(), request_time * 1000.0)
@@ -0,0 +1,125 @@
+import itertools
+import time
+import uuid
+from collections import OrderedDict
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def parse_hops(hops):
+    """Parse "ingest=1700000000000;master_in=..." into [(name, epoch_ms), ...]."""
+    parsed = []
+    for hop in (hops or "").split(";"):
+        name, _, timestamp = hop.partition("=")
+        if name and timestamp.isdigit():
+            parsed.append((name, int(timestamp)))
+    return parsed
+
+
+class Job:
+    """
+    One command started for an event, with the trace context that led to it.
+    """
+
+    __slots__ = ("job_id", "username", "event_type", "command", "trace_id", "hops", "pid", "created_at",
+                 "started_at", "exit_code", "finished_at")
+
+    def __init__(self, username, event_type, command, trace_id=None, hops=None):
+        self.job_id = uuid.uuid4().hex
+        self.username = username
+        self.event_type = event_type
+        self.command = command
+        self.trace_id = trace_id
+        self.hops = list(hops or [])
+        self.pid = None
+        self.created_at = now_ms()
+        # When the scheduler handed the command to the shell or the warm pool; its pid may follow
+        self.started_at = None
+        self.exit_code = None
+        self.finished_at = None
+
+    @property
+    def state(self):
+        """queued (in the scheduler's run queue), running, finished, or failed (could not be started)."""
+        if self.finished_at is None:
+            return "queued" if self.started_at is None else "running"
+        return "finished" if self.pid is not None else "failed"
+
+    def add_hop(self, name, timestamp_ms=None):
+        self.hops.append((name, timestamp_ms if timestamp_ms is not None else now_ms()))
+
+    def to_dict(self):
+        """
+        JSON view of the job, including end-to-end latency and the slowest hop.
+
+        Hop timestamps come from different hosts' wall clocks, so hop durations
+        are only as accurate as their clock sync.
+        """
+        hops = [{"hop": name, "timestamp_ms": ts} for name, ts in self.hops]
+        segments = [
+            (f"{a[0]}->{b[0]}", b[1] - a[1]) for a, b in zip(self.hops, self.hops[1:])
+        ]
+        slowest = max(segments, key=lambda s: s[1]) if segments else None
+        return {
+            "job_id": self.job_id,
+            "username": self.username,
+            "event_type": self.event_type,
+            "command": self.command,
+            "trace_id": self.trace_id,
+            "state": self.state,
+            "pid": self.pid,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "exit_code": self.exit_code,
+            "finished_at": self.finished_at,
+            "hops": hops,
+            "end_to_end_ms": self.hops[-1][1] - self.hops[0][1] if len(self.hops) > 1 else None,
+            "slowest_hop": {"hop": slowest[0], "ms": slowest[1]} if slowest else None,
+        }
+
+
+class JobRegistry:
+    """
+    Bounded, in-memory record of recent jobs (oldest evicted first), and of the
+    commands still running.
+    """
+
+    def __init__(self, max_jobs):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._running = {}
+
+    def track(self, job, proc):
+        """Remember proc as the running command of job until reap() sees it exit."""
+        self._running[job.job_id] = (job, proc)
+
+    def reap(self):
+        """Collects finished commands, recording their exit codes. Returns the number still running."""
+        for job_id, (job, proc) in list(self._running.items()):
+            exit_code = proc.poll()
+            if exit_code is not None:
+                job.exit_code = exit_code
+                job.finished_at = now_ms()
+                del self._running[job_id]
+        return len(self._running)
+
+    def add(self, job):
+        self._jobs[job.job_id] = job
+        while len(self._jobs) > self.max_jobs:
+            self._jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def find(self, username=None, event_type=None, trace_id=None, limit=100):
+        """Most recent jobs first, optionally filtered."""
+        matches = (
+            job for job in reversed(self._jobs.values())
+            if (username is None or job.username == username)
+            and (event_type is None or job.event_type == event_type)
+            and (trace_id is None or job.trace_id == trace_id)
+        )
+        return list(itertools.islice(matches, limit))
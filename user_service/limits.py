@@ -0,0 +1,98 @@
+import os
+import resource
+from instrumentation import logger
+
+# cgroup v2 CPU bandwidth period; a slot is one CPU's worth of quota per period
+CPU_PERIOD_US = 100000
+
+
+def available_cpus():
+    """CPUs this process may run on, in order."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _write(path, value):
+    with open(path, "w") as f:
+        f.write(value)
+
+
+def cgroup_ready(root):
+    """
+    Prepares root for per-command cgroups: creates it and enables the cpu and memory
+    controllers for its children. Returns False where that is not allowed (no cgroup
+    v2, or root not delegated to the service).
+    """
+    try:
+        os.makedirs(root, exist_ok=True)
+        _write(os.path.join(root, "cgroup.subtree_control"), "+cpu +memory")
+    except OSError as e:
+        logger.warning("cgroup root %s is not usable: %s", root, e)
+        return False
+    return True
+
+
+def cgroup_create(root, name, cpu_slots, memory_mb):
+    """
+    Creates the cgroup of one command with its limits.
+
+    Returns:
+        str: The cgroup's directory, or None if it could not be created
+    """
+    path = os.path.join(root, name)
+    try:
+        os.mkdir(path)
+        if cpu_slots:
+            _write(os.path.join(path, "cpu.max"), f"{cpu_slots * CPU_PERIOD_US} {CPU_PERIOD_US}")
+        if memory_mb:
+            _write(os.path.join(path, "memory.max"), str(memory_mb * 1024 * 1024))
+    except OSError as e:
+        logger.warning("Could not create cgroup %s: %s", path, e)
+        cgroup_remove(path)
+        return None
+    return path
+
+
+def cgroup_remove(path):
+    """Removes a command's cgroup (it stays behind while a process of the command lives on)."""
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
+
+
+def preexec(memory_mb=0, cpus=None, cgroup=None):
+    """
+    The preexec_fn that applies a command's limits in the child, before the shell
+    starts, so everything the command spawns inherits them. None if there is nothing
+    to apply.
+
+    It runs between fork and exec: it must not import, log or take locks.
+
+    Args:
+        memory_mb (int): Address space limit (RLIMIT_AS), 0 for none
+        cpus (list): CPUs to pin the command to, None for any
+        cgroup (str): cgroup directory to move the command into
+    """
+    if not (memory_mb or cpus or cgroup):
+        return None
+    limit = memory_mb * 1024 * 1024
+    procs = os.path.join(cgroup, "cgroup.procs") if cgroup else None
+    cpus = set(cpus or ())
+
+    def apply():
+        if procs:
+            fd = os.open(procs, os.O_WRONLY)
+            try:
+                os.write(fd, str(os.getpid()).encode())
+            finally:
+                os.close(fd)
+        if limit:
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        if cpus:
+            try:
+                os.sched_setaffinity(0, cpus)
+            except OSError:
+                pass  # CPUs taken away since (hotplug, cpuset): run unpinned rather than not at all
+    return apply
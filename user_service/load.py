@@ -0,0 +1,50 @@
+import os
+from config import MAX_LOAD_PER_CPU, MAX_QUEUED_JOBS, MAX_RUNNING_JOBS, MIN_AVAILABLE_MEMORY_RATIO
+
+
+def memory_info():
+    """Total and available memory in MB from /proc/meminfo, or None where it does not exist."""
+    try:
+        with open("/proc/meminfo") as f:
+            fields = dict(line.split(":", 1) for line in f)
+        total_kb = int(fields["MemTotal"].split()[0])
+        available_kb = int(fields["MemAvailable"].split()[0])
+    except (OSError, KeyError, ValueError):
+        return None
+    return {"total_mb": total_kb // 1024, "available_mb": available_kb // 1024,
+            "available_ratio": round(available_kb / total_kb, 4) if total_kb else None}
+
+
+def node_load(running_jobs, queued_jobs=0):
+    """
+    Load signals of this node and whether it is saturated.
+
+    Args:
+        running_jobs (int): Commands started by this service that are still running
+        queued_jobs (int): Commands waiting in the scheduler's run queue
+
+    Returns:
+        dict: running_jobs, queued_jobs, cpu, memory, and saturated with the reasons
+    """
+    cpus = os.cpu_count() or 1
+    load_1m, load_5m, _ = os.getloadavg()
+    memory = memory_info()
+
+    reasons = []
+    if MAX_RUNNING_JOBS and running_jobs >= MAX_RUNNING_JOBS:
+        reasons.append(f"running_jobs {running_jobs} >= {MAX_RUNNING_JOBS}")
+    if MAX_QUEUED_JOBS and queued_jobs >= MAX_QUEUED_JOBS:
+        reasons.append(f"queued_jobs {queued_jobs} >= {MAX_QUEUED_JOBS}")
+    if MAX_LOAD_PER_CPU and load_1m / cpus >= MAX_LOAD_PER_CPU:
+        reasons.append(f"load per cpu {load_1m / cpus:.2f} >= {MAX_LOAD_PER_CPU}")
+    if memory and memory["available_ratio"] is not None and memory["available_ratio"] < MIN_AVAILABLE_MEMORY_RATIO:
+        reasons.append(f"available memory {memory['available_ratio']:.1%} < {MIN_AVAILABLE_MEMORY_RATIO:.1%}")
+
+    return {
+        "running_jobs": running_jobs,
+        "queued_jobs": queued_jobs,
+        "cpu": {"count": cpus, "load_1m": load_1m, "load_5m": load_5m, "load_per_cpu": round(load_1m / cpus, 3)},
+        "memory": memory,
+        "saturated": bool(reasons),
+        "reasons": reasons,
+    }
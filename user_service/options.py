@@ -0,0 +1,69 @@
+import functools
+import json
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+# Subscription options besides the command (a filter, declared resources, a result cache
+# policy) are JSON objects, each validated by its parser: JSON text or a decoded object
+# in, the parsed option (None for none) out, ValueError if it is malformed.
+Parser = Callable[[Any], Any]
+
+# An option a request leaves out: the subscription keeps the stored one (None removes it)
+KEEP = object()
+
+
+def json_object(expression, fields: Sequence[str]) -> Optional[Dict[str, Any]]:
+    """
+    Decodes an option declared as a JSON object (or its text) with some of `fields`;
+    None (or empty text) for none.
+
+    Raises:
+        ValueError: If it is not valid JSON, not an object, or has other fields
+    """
+    if isinstance(expression, str):
+        try:
+            expression = json.loads(expression) if expression.strip() else None
+        except json.JSONDecodeError as e:
+            raise ValueError(f"not valid JSON: {e}")
+    if expression is None:
+        return None
+    if not isinstance(expression, dict):
+        raise ValueError("must be a JSON object")
+    unknown = set(expression) - set(fields)
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+    return expression
+
+
+def canonical(parse: Parser, expression) -> Optional[str]:
+    """The stored form of an option: validated, compact JSON with sorted keys (None for none)."""
+    if parse(expression) is None:
+        return None
+    if isinstance(expression, str):
+        expression = json.loads(expression)
+    return json.dumps(expression, sort_keys=True, separators=(",", ":"))
+
+
+@functools.lru_cache(maxsize=4096)
+def stored(parse: Parser, text: Optional[str]) -> Any:
+    """An option as stored on a subscription, parsed once per distinct text."""
+    return parse(text)
+
+
+def canonical_options(request: Dict[str, Any], options: Sequence[Tuple[str, Parser]]) -> Tuple:
+    """
+    The stored forms of a request's options, in the order of `options` ((key, parser)
+    pairs); KEEP for each key the request does not have.
+
+    Raises:
+        ValueError: "<key>: <why>" for the first malformed option
+    """
+    values = []
+    for key, parse in options:
+        if key not in request:
+            values.append(KEEP)
+            continue
+        try:
+            values.append(canonical(parse, request[key]))
+        except ValueError as e:
+            raise ValueError(f"{key}: {e}")
+    return tuple(values)
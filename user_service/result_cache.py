@@ -0,0 +1,104 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
+from command_template import CommandTemplate
+from options import json_object, stored
+
+
+class CachePolicy(NamedTuple):
+    """A subscription's opt-in to the result cache, as declared on the subscription."""
+    ttl_seconds: float
+    # Files the command reads, as templates ("/data/<date>/prices.csv"); a change to one is a new result
+    inputs: Tuple[CommandTemplate, ...] = ()
+
+    def fingerprint(self, values):
+        """
+        Size and modification time of every input, rendered with the event's values;
+        a missing file is part of the fingerprint too.
+
+        Returns:
+            str: The fingerprint, or None if an input has a placeholder the event does not provide
+        """
+        parts = []
+        for template in self.inputs:
+            if template.missing(values):
+                return None
+            path = template.render(values, quote=False)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                parts.append(f"{path}\0missing")
+                continue
+            parts.append(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}")
+        return "\0".join(parts)
+
+
+def parse_cache_policy(expression) -> Optional[CachePolicy]:
+    """
+    Validates a result cache declaration: a JSON object (or its text) with
+    ttl_seconds (> 0) and optionally inputs (a list of paths, with placeholders).
+    None for no caching.
+
+    Raises:
+        ValueError: If the declaration is malformed.
+    """
+    expression = json_object(expression, CachePolicy._fields)
+    if expression is None:
+        return None
+    ttl_seconds = expression.get("ttl_seconds")
+    if not isinstance(ttl_seconds, (int, float)) or isinstance(ttl_seconds, bool) or ttl_seconds <= 0:
+        raise ValueError("ttl_seconds must be a positive number")
+    inputs = expression.get("inputs", [])
+    if not isinstance(inputs, list) or not all(isinstance(path, str) and path for path in inputs):
+        raise ValueError("inputs must be a list of paths")
+    return CachePolicy(ttl_seconds, tuple(CommandTemplate(path) for path in inputs))
+
+
+def stored_cache_policy(text) -> Optional[CachePolicy]:
+    """The policy of a stored declaration (subscriptions.result_cache)."""
+    return stored(parse_cache_policy, text)
+
+
+class ResultCache:
+    """
+    Jobs of deterministic commands, keyed by what determines their result: the
+    username, the rendered command and the fingerprint of its input files.
+
+    A job is a hit while it is queued or running, and for its subscription's
+    ttl_seconds after it finished with exit code 0. A job that failed is dropped,
+    so the next event runs the command again. Beyond `max_entries` the least
+    recently used entry is evicted first.
+    """
+
+    def __init__(self, max_entries, clock=time.time):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(username, command, fingerprint=""):
+        return hashlib.sha256("\0".join((username, command, fingerprint)).encode()).hexdigest()
+
+    def get(self, key):
+        """The job with the result for key, or None if there is none (or it failed or expired)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        ttl_seconds, job = entry
+        if job.finished_at is not None and (
+                job.exit_code != 0 or job.finished_at / 1000 + ttl_seconds <= self._clock()):
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return job
+
+    def add(self, key, job, ttl_seconds):
+        self._entries[key] = (ttl_seconds, job)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
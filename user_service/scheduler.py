@@ -0,0 +1,293 @@
+import functools
+import heapq
+import itertools
+import time
+from typing import NamedTuple, Optional
+import limits
+from config import (MAX_QUEUED_JOBS, SCHEDULER_CGROUP_ROOT, SCHEDULER_CPU_SLOTS, SCHEDULER_ENFORCEMENT,
+                    SCHEDULER_MEMORY_MB)
+from instrumentation import (COMMANDS_TOTAL, SCHEDULER_CPU_SLOTS_USED, SCHEDULER_QUEUED_JOBS,
+                             SCHEDULER_WAIT_SECONDS, logger)
+from jobs import now_ms
+from options import json_object, stored
+from utils import execute_cmd, output_path
+from warm_pool import shell_command
+
+ENFORCEMENTS = ("rlimit", "cgroup", "none")
+
+
+class Resources(NamedTuple):
+    """What a subscription's command uses, as declared on the subscription."""
+    cpu_slots: int = 1
+    memory_mb: int = 0
+    # Higher runs first; equal priorities share the node fairly between event types
+    priority: int = 0
+
+
+DEFAULT_RESOURCES = Resources()
+
+
+def parse_resources(expression) -> Optional[Resources]:
+    """
+    Validates declared resources: a JSON object (or its text) with any of
+    cpu_slots (>= 1), memory_mb (>= 0) and priority (any integer). None for none.
+
+    Raises:
+        ValueError: If the declaration is malformed.
+    """
+    expression = json_object(expression, Resources._fields)
+    if expression is None:
+        return None
+    for field, value in expression.items():
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError(f"{field} must be an integer")
+    resources = Resources(**expression)
+    if resources.cpu_slots < 1 or resources.memory_mb < 0:
+        raise ValueError("cpu_slots must be at least 1 and memory_mb not negative")
+    return resources
+
+
+def stored_resources(text) -> Resources:
+    """Resources of a stored declaration (subscriptions.resources)."""
+    return stored(parse_resources, text) or DEFAULT_RESOURCES
+
+
+class _Entry:
+    """A job in the run queue, and once started, what it holds."""
+
+    __slots__ = ("job", "command", "env", "cpu_slots", "memory_mb", "priority", "queued_at", "cpus", "cgroup")
+
+    def __init__(self, job, command, env, cpu_slots, memory_mb, priority):
+        self.job = job
+        self.command = command
+        self.env = env
+        self.cpu_slots = cpu_slots
+        self.memory_mb = memory_mb
+        self.priority = priority
+        self.queued_at = time.monotonic()
+        self.cpus = None
+        self.cgroup = None
+
+
+class Scheduler:
+    """
+    Starts subscription commands within the node's capacity.
+
+    Capacity is cpu_slots CPU slots and memory_mb MB (0: not limited). Each command
+    holds its subscription's declared Resources while it runs; commands that do not
+    fit wait in the run queue. The queue is kept per event type. The next command
+    is the highest priority one; between event types of equal priority it comes from
+    the type holding the fewest slots, then the one served least recently (round
+    robin), so a burst of one event type cannot take the node from the others. Dispatch is strictly in that
+    order: a large command at the head is not overtaken by smaller ones, so it
+    cannot starve.
+
+    Declared resources are enforced on the command per `enforcement` (see limits.py):
+        none:   accounting only
+        cgroup: its own cgroup v2 group with memory.max and cpu.max
+        rlimit: pinned to cpu_slots CPUs of `cpus`, and RLIMIT_AS of memory_mb; that
+                caps virtual address space, not memory in use, so programs that
+                reserve much more than they touch (threads, BLAS) fail well below it
+
+    With a warm_pool, Python commands it can run start in one of its workers
+    (see warm_pool.py) and everything else through the shell.
+    """
+
+    def __init__(self, jobs, cpu_slots=SCHEDULER_CPU_SLOTS, memory_mb=SCHEDULER_MEMORY_MB,
+                 enforcement=SCHEDULER_ENFORCEMENT, cgroup_root=SCHEDULER_CGROUP_ROOT,
+                 max_queued=MAX_QUEUED_JOBS, cpus=None, warm_pool=None):
+        if enforcement not in ENFORCEMENTS:
+            raise ValueError(f"SCHEDULER_ENFORCEMENT must be one of {', '.join(ENFORCEMENTS)}, got {enforcement!r}")
+        if enforcement == "cgroup" and not limits.cgroup_ready(cgroup_root):
+            logger.warning("Falling back to rlimit enforcement")
+            enforcement = "rlimit"
+        self.jobs = jobs
+        self.cpu_slots = cpu_slots
+        self.memory_mb = memory_mb
+        self.enforcement = enforcement
+        self.cgroup_root = cgroup_root
+        self.max_queued = max_queued
+        self.warm_pool = warm_pool
+        # Pinning needs a CPU per slot; otherwise commands may run on any CPU
+        cpus = limits.available_cpus() if cpus is None else list(cpus)
+        self._free_cpus = cpus if enforcement == "rlimit" and 0 < cpu_slots <= len(cpus) else None
+        self._queues = {}  # event_type -> heap of (-priority, seq, _Entry)
+        self._seq = itertools.count()
+        self._queued = 0
+        self._running = {}  # job_id -> _Entry
+        self._used_slots = 0
+        self._used_memory = 0
+        self._slots_by_type = {}
+        self._starts = itertools.count()
+        self._last_start = {}  # event_type -> value of _starts when it last started a command
+
+    @classmethod
+    def share(cls, jobs, worker=0, workers=1, warm_pool=None):
+        """The scheduler of one of `workers` worker processes: an equal share of the capacity and of the CPUs."""
+        def part(total):
+            return max(1, total // workers) if total else 0
+        return cls(jobs, cpu_slots=part(SCHEDULER_CPU_SLOTS), memory_mb=part(SCHEDULER_MEMORY_MB),
+                   max_queued=part(MAX_QUEUED_JOBS), cpus=limits.available_cpus()[worker::workers],
+                   warm_pool=warm_pool)
+
+    @property
+    def queued(self):
+        return self._queued
+
+    def submit(self, job, command, env=None, resources=DEFAULT_RESOURCES):
+        """
+        Queues job's command and starts whatever fits. The job has a pid once started.
+
+        Returns:
+            bool: False if the run queue is full (the job was not accepted)
+        """
+        if self.max_queued and self._queued >= self.max_queued:
+            return False
+        # A command larger than the node runs alone instead of waiting forever
+        cpu_slots = min(resources.cpu_slots, self.cpu_slots) if self.cpu_slots else resources.cpu_slots
+        memory_mb = min(resources.memory_mb, self.memory_mb) if self.memory_mb else resources.memory_mb
+        entry = _Entry(job, command, env, cpu_slots, memory_mb, resources.priority)
+        heapq.heappush(self._queues.setdefault(job.event_type, []), (-entry.priority, next(self._seq), entry))
+        self._queued += 1
+        self.dispatch()
+        if job.started_at is None:
+            job.add_hop("queued")
+        self._update_gauges(job.event_type)
+        return True
+
+    def poll(self):
+        """
+        Collects finished commands, frees their resources and starts queued ones.
+
+        Returns:
+            int: Commands still running
+        """
+        if self.warm_pool is not None:
+            self.warm_pool.check()
+        self.jobs.reap()
+        finished = [entry for entry in self._running.values() if entry.job.finished_at is not None]
+        for entry in finished:
+            self._release(entry)
+        # Also after commands the warm pool failed, released as that happened
+        self.dispatch()
+        for event_type in {entry.job.event_type for entry in finished}:
+            self._update_gauges(event_type)
+        return len(self._running)
+
+    def dispatch(self):
+        """Starts queued commands, in scheduling order, while the next one fits."""
+        while self._queues:
+            event_type = min(self._queues, key=self._order)
+            queue = self._queues[event_type]
+            entry = queue[0][2]
+            if not self._fits(entry):
+                return
+            heapq.heappop(queue)
+            if not queue:
+                del self._queues[event_type]
+            self._queued -= 1
+            self._last_start[event_type] = next(self._starts)
+            self._start(entry)
+            self._update_gauges(event_type)
+
+    def _order(self, event_type):
+        neg_priority, seq, _ = self._queues[event_type][0]
+        return neg_priority, self._slots_by_type.get(event_type, 0), self._last_start.get(event_type, -1), seq
+
+    def _fits(self, entry):
+        if self.cpu_slots and self._used_slots + entry.cpu_slots > self.cpu_slots:
+            return False
+        return not self.memory_mb or self._used_memory + entry.memory_mb <= self.memory_mb
+
+    def _start(self, entry):
+        job = entry.job
+        cpus = None
+        if self._free_cpus is not None:
+            cpus, self._free_cpus = self._free_cpus[:entry.cpu_slots], self._free_cpus[entry.cpu_slots:]
+        entry.cpus = cpus
+        if self.enforcement == "cgroup":
+            entry.cgroup = limits.cgroup_create(self.cgroup_root, f"job-{job.job_id}", entry.cpu_slots,
+                                                entry.memory_mb)
+        self._hold(entry)
+        job.started_at = now_ms()
+        logger.debug("Executing command: %s (job_id=%s, trace_id=%s)", entry.command, job.job_id, job.trace_id)
+        if self.warm_pool is not None:
+            try:
+                # The pool reports back through the callbacks, never blocking here
+                process = self.warm_pool.run(job.job_id, entry.command, entry.env, self._memory_limit(entry),
+                                             entry.cpus, entry.cgroup, output_path(job.job_id),
+                                             on_start=functools.partial(self._spawned, entry),
+                                             on_fail=functools.partial(self._warm_failed, entry))
+            except Exception:
+                logger.exception("Could not start command of job %s", job.job_id)
+                self._fail(entry)
+                return
+            if process is not None:
+                return
+        self._start_shell(entry)
+
+    def _memory_limit(self, entry):
+        return entry.memory_mb if self.enforcement == "rlimit" else 0
+
+    def _start_shell(self, entry):
+        try:
+            proc = execute_cmd(shell_command(entry.command), env=entry.env,
+                               preexec_fn=limits.preexec(self._memory_limit(entry), entry.cpus, entry.cgroup),
+                               output=output_path(entry.job.job_id))
+        except Exception:
+            logger.exception("Could not start command of job %s", entry.job.job_id)
+            self._fail(entry)
+            return
+        self._spawned(entry, proc)
+
+    def _spawned(self, entry, proc):
+        job = entry.job
+        job.pid = proc.pid
+        job.add_hop("spawned")
+        self.jobs.track(job, proc)
+        SCHEDULER_WAIT_SECONDS.observe(time.monotonic() - entry.queued_at, event_type=job.event_type)
+        COMMANDS_TOTAL.inc(event_type=job.event_type)
+
+    def _warm_failed(self, entry, process, not_started):
+        if not_started:
+            self._start_shell(entry)
+        else:
+            self._fail(entry)
+
+    def _fail(self, entry):
+        entry.job.finished_at = now_ms()
+        self._release(entry)
+        self._update_gauges(entry.job.event_type)
+
+    def _hold(self, entry):
+        event_type = entry.job.event_type
+        self._running[entry.job.job_id] = entry
+        self._used_slots += entry.cpu_slots
+        self._used_memory += entry.memory_mb
+        self._slots_by_type[event_type] = self._slots_by_type.get(event_type, 0) + entry.cpu_slots
+
+    def _release(self, entry):
+        event_type = entry.job.event_type
+        del self._running[entry.job.job_id]
+        self._used_slots -= entry.cpu_slots
+        self._used_memory -= entry.memory_mb
+        self._slots_by_type[event_type] -= entry.cpu_slots
+        if not self._slots_by_type[event_type]:
+            del self._slots_by_type[event_type]
+        if entry.cpus:
+            self._free_cpus.extend(entry.cpus)
+        if entry.cgroup:
+            limits.cgroup_remove(entry.cgroup)
+
+    def _update_gauges(self, event_type):
+        SCHEDULER_QUEUED_JOBS.set(len(self._queues.get(event_type, ())), event_type=event_type)
+        SCHEDULER_CPU_SLOTS_USED.set(self._slots_by_type.get(event_type, 0), event_type=event_type)
+
+    def to_dict(self):
+        """Capacity and use, for /health."""
+        return {
+            "queued_jobs": self._queued,
+            "cpu_slots": {"capacity": self.cpu_slots, "used": self._used_slots},
+            "memory_mb": {"capacity": self.memory_mb, "used": self._used_memory},
+            "cpu_slots_by_event_type": dict(self._slots_by_type),
+        }
@@ -0,0 +1,125 @@
+import json
+import sys
+from command_template import CommandTemplate
+
+
+class Subscription:
+    """
+    One (username, event_type) subscription with its compiled command, and its filter,
+    declared resources and result cache policy (stored JSON or None).
+    """
+
+    __slots__ = ("username", "event_type", "command", "created_at", "updated_at", "filter_expression", "resources",
+                 "result_cache")
+
+    def __init__(self, username, event_type, command, created_at=None, updated_at=None, filter_expression=None,
+                 resources=None, result_cache=None):
+        self.username = username
+        self.event_type = event_type
+        self.command = command
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.filter_expression = filter_expression
+        self.resources = resources
+        self.result_cache = result_cache
+
+    def to_dict(self):
+        return {
+            "username": self.username,
+            "event_type": self.event_type,
+            "command": self.command.source,
+            "filter": json.loads(self.filter_expression) if self.filter_expression else None,
+            "resources": json.loads(self.resources) if self.resources else None,
+            "result_cache": json.loads(self.result_cache) if self.result_cache else None,
+            "created_at": str(self.created_at),
+            "updated_at": str(self.updated_at),
+        }
+
+
+class SubscriptionIndex:
+    """
+    In-memory subscriptions, indexed both ways.
+
+        by_event_type: event_type -> {username: Subscription}
+        by_username:   username -> {event_type: Subscription}
+
+    Lookups, per-user listings and per-event-type fan-out are dict lookups.
+    Usernames and event types are interned, so each name is stored once no
+    matter how many subscriptions share it, and records use __slots__.
+    Commands are compiled once and only recompiled when their source changes.
+    """
+
+    __slots__ = ("by_event_type", "by_username")
+
+    def __init__(self, records=()):
+        self.by_event_type = {}
+        self.by_username = {}
+        for record in records:
+            self.put(record["username"], record["event_type"], record["command"],
+                     record.get("created_at"), record.get("updated_at"), record.get("filter_expression"),
+                     record.get("resources"), record.get("result_cache"))
+
+    def get(self, username, event_type):
+        """The Subscription for (username, event_type), or None."""
+        return self.by_event_type.get(event_type, {}).get(username)
+
+    def put(self, username, event_type, command, created_at=None, updated_at=None, filter_expression=None,
+            resources=None, result_cache=None):
+        """
+        Adds or updates a subscription.
+
+        Returns:
+            bool: True if the command, filter, resources or cache policy changed (or the subscription is new).
+        """
+        subscription = self.get(username, event_type)
+        if subscription is not None:
+            changed = ((subscription.filter_expression, subscription.resources, subscription.result_cache)
+                       != (filter_expression, resources, result_cache))
+            subscription.filter_expression = filter_expression
+            subscription.resources = resources
+            subscription.result_cache = result_cache
+            if subscription.command.source != command:
+                subscription.command = CommandTemplate(command)
+                changed = True
+            subscription.created_at = created_at or subscription.created_at
+            subscription.updated_at = updated_at or subscription.updated_at
+            return changed
+        username = sys.intern(username)
+        event_type = sys.intern(event_type)
+        subscription = Subscription(username, event_type, CommandTemplate(command), created_at, updated_at,
+                                    filter_expression, resources, result_cache)
+        self.by_event_type.setdefault(event_type, {})[username] = subscription
+        self.by_username.setdefault(username, {})[event_type] = subscription
+        return True
+
+    def remove(self, username, event_type):
+        """Removes a subscription; returns False if there was none."""
+        users = self.by_event_type.get(event_type)
+        if not users or users.pop(username, None) is None:
+            return False
+        if not users:
+            del self.by_event_type[event_type]
+        event_types = self.by_username[username]
+        del event_types[event_type]
+        if not event_types:
+            del self.by_username[username]
+        return True
+
+    def subscribers(self, event_type):
+        """Subscriptions to event_type, keyed by username."""
+        return self.by_event_type.get(event_type, {})
+
+    def list(self, username=None, event_type=None):
+        """Subscriptions for a username and/or event_type."""
+        if username is None:
+            return list(self.subscribers(event_type).values())
+        if event_type is None:
+            return list(self.by_username.get(username, {}).values())
+        subscription = self.get(username, event_type)
+        return [subscription] if subscription else []
+
+    def __len__(self):
+        return sum(len(users) for users in self.by_event_type.values())
+
+    def __repr__(self):
+        return f"SubscriptionIndex({len(self)} subscriptions, {len(self.by_event_type)} event types)"
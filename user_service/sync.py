@@ -0,0 +1,101 @@
+import datetime
+import time
+from tornado.ioloop import PeriodicCallback
+from config import SUBSCRIPTION_SYNC_INTERVAL, SUBSCRIPTION_SYNC_OVERLAP_SECONDS, TOMBSTONE_RETENTION_DAYS
+from instrumentation import SUBSCRIPTION_SYNC_CHANGES, logger
+
+# Tombstones are purged at most this often (seconds)
+PURGE_INTERVAL = 3600
+
+
+class SubscriptionSync:
+    """
+    Keeps the in-memory SubscriptionIndex in step with the `subscriptions` table.
+
+    Every replica polls for rows whose `updated_at` is at or after its watermark
+    and for tombstones left by deletes, and applies just those deltas. The
+    watermark is read from the database clock (the one `updated_at` uses) before
+    each poll, and every poll re-reads an overlap window so rows written by
+    transactions that committed late are not missed. Re-applying a change is a
+    no-op. A replica whose watermark is older than the tombstone retention
+    cannot see every delete, so it reloads in full instead.
+    """
+
+    def __init__(self, db, interval=SUBSCRIPTION_SYNC_INTERVAL,
+                 overlap_seconds=SUBSCRIPTION_SYNC_OVERLAP_SECONDS, retention_days=TOMBSTONE_RETENTION_DAYS):
+        self.db = db
+        self.subscriptions = None
+        self.interval = interval
+        self.overlap = datetime.timedelta(seconds=overlap_seconds)
+        self.retention = datetime.timedelta(days=retention_days)
+        self.watermark = None
+        self._callback = None
+        self._last_purge = 0.0
+
+    def load(self):
+        """
+        Full load; the watermark is taken first so nothing written meanwhile is skipped.
+
+        The index is filled in place, so references held by the application stay valid.
+        """
+        watermark = self.db.current_timestamp()
+        self._replace(self.db.load_subscription_index(), watermark)
+        return self.subscriptions
+
+    def _replace(self, loaded, watermark):
+        if self.subscriptions is None:
+            self.subscriptions = loaded
+        else:
+            self.subscriptions.by_event_type = loaded.by_event_type
+            self.subscriptions.by_username = loaded.by_username
+        self.watermark = watermark
+
+    def apply(self, upserts, tombstones):
+        """
+        Applies changed and deleted subscriptions to the index.
+
+        Returns:
+            int: Number of subscriptions that were added, changed or removed.
+        """
+        changed = 0
+        for record in tombstones:
+            if self.subscriptions.remove(record["username"], record["event_type"]):
+                changed += 1
+                SUBSCRIPTION_SYNC_CHANGES.inc(kind="delete")
+        for record in upserts:
+            if self.subscriptions.put(record["username"], record["event_type"], record["command"],
+                                      record["created_at"], record["updated_at"], record["filter_expression"],
+                                      record["resources"], record["result_cache"]):
+                changed += 1
+                SUBSCRIPTION_SYNC_CHANGES.inc(kind="upsert")
+        return changed
+
+    async def poll(self):
+        """Fetches and applies the changes since the last poll (on the query executor)."""
+        db = self.db
+        now = await db.run(db.current_timestamp)
+        if self.watermark is None or now - self.watermark > self.retention:
+            logger.warning("Subscription index is older than the tombstone retention; reloading in full")
+            # Load on the executor, swap on the IOLoop so handlers never see a half-replaced index
+            self._replace(await db.run(db.load_subscription_index), now)
+            return
+        upserts, tombstones = await db.run(db.fetch_subscription_changes, self.watermark - self.overlap)
+        changed = self.apply(upserts, tombstones)
+        self.watermark = now
+        if changed:
+            print(f"🔄 Synced {changed} subscription change(s) from the database")
+        if time.monotonic() - self._last_purge > PURGE_INTERVAL:
+            self._last_purge = time.monotonic()
+            await db.run(db.purge_tombstones, now - self.retention)
+
+    def start(self):
+        """Polls every `interval` seconds on the current IOLoop (no-op when the interval is 0)."""
+        if self.interval <= 0:
+            return
+        self._callback = PeriodicCallback(self.poll, self.interval * 1000)
+        self._callback.start()
+
+    def stop(self):
+        if self._callback:
+            self._callback.stop()
+            self._callback = None
@@ -1,18 +1,48 @@
 import os
 import subprocess
+from config import COMMAND_OUTPUT_DIR
+from instrumentation import COMMAND_SPAWN_SECONDS
 
-def execute_cmd(cmd, wait=False):
-    proc = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        shell=True,
-        start_new_session=True
-    )
+
+def output_path(job_id):
+    """Where the command of job_id writes its stdout and stderr, or None to discard them."""
+    return os.path.join(COMMAND_OUTPUT_DIR, f"{job_id}.log") if COMMAND_OUTPUT_DIR else None
+
+
+def execute_cmd(cmd, wait=False, env=None, preexec_fn=None, output=None):
+    """
+    Spawn cmd in its own session; env entries are added to the service's environment
+    and preexec_fn (see limits.preexec) runs in the child before the shell.
+
+    Unless waited for, the command's stdout and stderr go to the file `output`
+    (appended) or are discarded: a pipe nobody reads would block the command once
+    it fills up, and it would never exit.
+    """
+    if wait:
+        stdout, stderr = subprocess.PIPE, subprocess.PIPE
+    elif output:
+        stdout, stderr = open(output, "ab"), subprocess.STDOUT
+    else:
+        stdout, stderr = subprocess.DEVNULL, subprocess.DEVNULL
+    try:
+        with COMMAND_SPAWN_SECONDS.time(mode="shell"):
+            proc = subprocess.Popen(
+                cmd,
+                stdout=stdout,
+                stderr=stderr,
+                shell=True,
+                start_new_session=True,
+                preexec_fn=preexec_fn,
+                env={**os.environ, **env} if env else None
+            )
+    finally:
+        # The child has its own copy of the log file's descriptor
+        if hasattr(stdout, "close"):
+            stdout.close()
     if wait:
         stdout, stderr = proc.communicate()
         if stdout:
             print(f"[STDOUT] {stdout.decode().strip()}")
         if stderr:
             print(f"[STDERR] {stderr.decode().strip()}")
-
+    return proc
@@ -0,0 +1,319 @@
+import functools
+import json
+import os
+import re
+import shlex
+import shutil
+import socket
+import subprocess
+import time
+from tornado.ioloop import IOLoop
+from config import WARM_POOL_MODULES, WARM_POOL_PYTHON, WARM_POOL_SIZE, WARM_POOL_START_TIMEOUT
+from instrumentation import COMMAND_SPAWN_SECONDS, logger
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "warm_worker.py")
+# "package.module:function", as in console_scripts entry points
+ENTRY_POINT = re.compile(r"^[A-Za-z_][\w.]*:[A-Za-z_]\w*$")
+# Left to the shell: expansions, globs, redirections, pipes, lists, subshells
+SHELL_SYNTAX = re.compile(r"[$`*?\[\]{}~|&;<>()\\#\n]")
+# Interpreter options that do not change how the command runs
+IGNORED_OPTIONS = {"-u"}
+# Seconds between attempts to restart a pool that died
+RESTART_INTERVAL = 10
+
+
+@functools.lru_cache(maxsize=64)
+def _interpreter(name):
+    """Real path of an interpreter as the shell would find it, or None."""
+    path = shutil.which(name)
+    return os.path.realpath(path) if path else None
+
+
+def parse_invocation(command, python=WARM_POOL_PYTHON):
+    """
+    How the pool can run a rendered command, or None if it needs the shell.
+
+    Runnable in the pool are
+        python <script> <args...>          kind "script"
+        python -m <module> <args...>       kind "module"
+        package.module:function <args...>  kind "entry": sys.argv is [module, args...]
+                                           and the exit code is function()'s result
+    where python is any name that resolves to the pool's interpreter. Anything the
+    shell would interpret (variables, globs, redirections, pipes, `;`, `&&`) is
+    left to the shell; values rendered into the command are quoted, so they only
+    send it to the shell if they contain such characters.
+
+    Returns:
+        tuple: (kind, target, argv)
+    """
+    if SHELL_SYNTAX.search(command):
+        return None
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        return None
+    if not words:
+        return None
+    if ENTRY_POINT.match(words[0]):
+        return "entry", words[0], words[1:]
+    if _interpreter(words[0]) is None or _interpreter(words[0]) != _interpreter(python):
+        return None
+    rest = words[1:]
+    while rest and rest[0] in IGNORED_OPTIONS:
+        rest = rest[1:]
+    if len(rest) >= 2 and rest[0] == "-m":
+        return "module", rest[1], rest[2:]
+    if rest and not rest[0].startswith("-"):
+        return "script", rest[0], rest[1:]
+    return None
+
+
+def shell_command(command, python=WARM_POOL_PYTHON):
+    """
+    The command for the shell: entry points ("package.module:function args") become
+    an equivalent `python -c`, so they also run without the pool; others are unchanged.
+    """
+    words = command.split(None, 1)
+    if not words or not ENTRY_POINT.match(words[0]):
+        return command
+    module, _, function = words[0].partition(":")
+    code = f"import sys; from {module} import {function}; sys.argv[0] = {module!r}; sys.exit({function}())"
+    return " ".join([shlex.quote(python), "-c", shlex.quote(code)] + words[1:])
+
+
+class WarmProcess:
+    """
+    A command handed to the pool, with the Popen methods JobRegistry uses. Its pid
+    is None until the pool reports that a worker runs it.
+    """
+
+    def __init__(self, pool, job_id, on_start, on_fail):
+        self.pool = pool
+        self.job_id = job_id
+        self.pid = None
+        self.returncode = None
+        # Set when the zygote that would report the exit code went away
+        self.lost = False
+        self.sent_at = time.monotonic()
+        self.on_start = on_start
+        self.on_fail = on_fail
+
+    def poll(self):
+        if self.returncode is None:
+            self.returncode = self.pool.exit_code(self)
+        return self.returncode
+
+
+class WarmPool:
+    """
+    A pool of pre-forked Python workers for subscription commands (see warm_worker.py).
+
+    A zygote process imports `modules` once and keeps `size` children forked ahead of
+    time; each child runs one command and exits, so commands share the imported
+    modules copy-on-write but no state. A command starts without an interpreter
+    startup or its heavy imports, and without a fork of user_service itself.
+
+    Nothing here blocks the IOLoop: requests are written and replies read as the
+    control socket allows (see start). Until the zygote is ready, and while it is
+    down, run() returns None and the command goes to the shell as usual.
+    """
+
+    def __init__(self, size=WARM_POOL_SIZE, modules=WARM_POOL_MODULES, python=WARM_POOL_PYTHON,
+                 start_timeout=WARM_POOL_START_TIMEOUT):
+        self.size = size
+        self.modules = list(modules)
+        self.python = python
+        self.start_timeout = start_timeout
+        self._process = None
+        self._control = None
+        self._io_loop = None
+        self._buffer = b""
+        self._outgoing = b""
+        self._writing = False  # Whether the IOLoop waits for the socket to take _outgoing
+        self._ready = False
+        self._started_at = 0.0
+        self._starting = {}  # job_id -> WarmProcess, until the zygote reports its pid
+        self._exit_codes = {}  # job_id -> exit code, until collected
+        self._running = {}  # job_id -> WarmProcess
+
+    def start(self):
+        """
+        Starts the zygote; it reports ready once the modules are imported. Its replies
+        are read by the current IOLoop as they arrive, and by check().
+        """
+        parent, child = socket.socketpair()
+        self._started_at = time.monotonic()
+        self._process = subprocess.Popen(
+            [self.python, WORKER_SCRIPT, str(child.fileno()), str(self.size), *self.modules],
+            pass_fds=[child.fileno()],
+            stdin=subprocess.DEVNULL,
+            # Not in the service's process group, so a Ctrl-C of the service does not kill running commands
+            start_new_session=True,
+        )
+        child.close()
+        parent.setblocking(False)
+        self._control = parent
+        self._buffer = b""
+        self._outgoing = b""
+        self._writing = False
+        self._ready = False
+        self._io_loop = IOLoop.current()
+        self._io_loop.add_handler(parent.fileno(), self._on_control, IOLoop.READ)
+        print(f"🔥 Warm pool starting (pid={self._process.pid}, size={self.size}, modules={self.modules})")
+
+    def close(self):
+        """Stops the zygote and its idle workers; running commands finish on their own."""
+        if self._control is not None:
+            self._io_loop.remove_handler(self._control.fileno())
+            self._control.close()
+            self._control = None
+        for process in self._running.values():
+            process.lost = True
+        starting, self._starting = self._starting, {}
+        for process in starting.values():
+            # Whether it started is unknown: fail it rather than risk running it twice
+            process.on_fail(process, False)
+        if self._process is not None:
+            # It exits once it sees the control socket closed
+            try:
+                self._process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+            self._process = None
+        self._ready = False
+
+    def _alive(self):
+        if self._process is not None and self._process.poll() is None:
+            return True
+        if self._process is not None:
+            logger.warning("Warm pool exited with %s; commands run through the shell until it restarts",
+                           self._process.returncode)
+            self.close()
+        if time.monotonic() - self._started_at >= RESTART_INTERVAL:
+            self.start()
+        return False
+
+    def run(self, job_id, command, env=None, memory_mb=0, cpus=None, cgroup=None, output=None,
+            on_start=None, on_fail=None):
+        """
+        Hands a rendered command to a pre-forked worker, with the scheduler's limits.
+        It returns at once; the command starts when a worker picks it up.
+
+        Args:
+            output (str): File for the command's stdout and stderr, None to discard them
+            on_start (callable): Called with the WarmProcess once it runs (its pid is set)
+            on_fail (callable): Called with the WarmProcess and whether the command
+                certainly did not run (so it may go to the shell instead) if it did not
+                start within start_timeout or the pool refused it
+
+        Returns:
+            WarmProcess: The command, or None if it is not for the pool
+                (see parse_invocation) or the pool is not ready
+        """
+        invocation = parse_invocation(command, self.python)
+        if invocation is None or not self._alive():
+            return None
+        self._drain()
+        if not self._ready:
+            return None
+        kind, target, argv = invocation
+        request = {"id": job_id, "kind": kind, "target": target, "argv": argv, "env": env or {},
+                   "memory_mb": memory_mb, "cpus": list(cpus or ()), "cgroup": cgroup, "output": output}
+        process = WarmProcess(self, job_id, on_start, on_fail)
+        self._starting[job_id] = process
+        self._send(request)
+        return process
+
+    def check(self):
+        """Reads the zygote's replies and fails commands it did not start within start_timeout."""
+        if self._control is not None:
+            self._drain()
+        deadline = time.monotonic() - self.start_timeout
+        for process in [process for process in self._starting.values() if process.sent_at <= deadline]:
+            del self._starting[process.job_id]
+            logger.warning("Warm pool did not start job %s within %ss", process.job_id, self.start_timeout)
+            # The command may still start: fail it rather than run it a second time through the shell
+            process.on_fail(process, False)
+
+    def _on_control(self, fd, events):
+        if events & IOLoop.WRITE:
+            self._flush()
+        if events & IOLoop.READ and self._control is not None:
+            self._drain()
+
+    def _send(self, message):
+        self._outgoing += (json.dumps(message) + "\n").encode()
+        self._flush()
+
+    def _flush(self):
+        """Writes what the socket takes now; the IOLoop writes the rest once it can."""
+        if self._control is None:
+            return
+        try:
+            sent = self._control.send(self._outgoing) if self._outgoing else 0
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.close()
+            return
+        self._outgoing = self._outgoing[sent:]
+        if bool(self._outgoing) != self._writing:
+            self._writing = bool(self._outgoing)
+            self._io_loop.update_handler(self._control.fileno(),
+                                         IOLoop.READ | (IOLoop.WRITE if self._writing else 0))
+
+    def _drain(self):
+        """Reads the zygote's messages; False once it has gone away."""
+        while self._control is not None:
+            try:
+                data = self._control.recv(65536)
+            except BlockingIOError:
+                return True
+            except OSError:
+                data = b""
+            if not data:
+                self.close()
+                return False
+            self._buffer += data
+            *lines, self._buffer = self._buffer.split(b"\n")
+            for line in lines:
+                self._handle(json.loads(line))
+        return False
+
+    def _handle(self, message):
+        if message.get("ready"):
+            self._ready = True
+            print(f"🔥 Warm pool ready: imported {message['modules']}"
+                  + (f", could not import {message['failed']}" if message["failed"] else ""))
+        elif "pid" in message:
+            process = self._starting.pop(message["id"], None)
+            if process is None:
+                return  # Given up on (see check); it runs unobserved
+            process.pid = message["pid"]
+            self._running[process.job_id] = process
+            COMMAND_SPAWN_SECONDS.observe(time.monotonic() - process.sent_at, mode="warm")
+            process.on_start(process)
+        elif "error" in message:
+            process = self._starting.pop(message["id"], None)
+            if process is not None:
+                logger.warning("Warm pool could not start job %s: %s", process.job_id, message["error"])
+                process.on_fail(process, True)
+        elif "exit_code" in message and message["id"] in self._running:
+            self._exit_codes[message["id"]] = message["exit_code"]
+
+    def exit_code(self, process):
+        """The exit code of a command run by the pool, or None while it runs."""
+        if self._control is not None and not process.lost:
+            self._drain()
+        if process.job_id in self._exit_codes:
+            del self._running[process.job_id]
+            return self._exit_codes.pop(process.job_id)
+        if process.lost:
+            # Only whether the command still runs is known; -1 once it has exited
+            try:
+                os.kill(process.pid, 0)
+            except OSError:
+                self._running.pop(process.job_id, None)
+                return -1
+        return None
@@ -0,0 +1,204 @@
+"""
+Zygote of the warm Python worker pool (see warm_pool.py), started by user_service as
+
+    python warm_worker.py <control fd> <pool size> [module ...]
+
+It imports the modules once, then keeps <pool size> children forked ahead of time,
+each waiting for one command. Requests arrive as JSON lines on the control socket:
+
+    {"id": "<job_id>", "kind": "script" | "module" | "entry", "target": "...",
+     "argv": [...], "env": {...}, "memory_mb": 0, "cpus": [...], "cgroup": "...",
+     "output": "<log file>" | null}
+
+and are answered with {"id", "pid"} once a child runs the command and {"id",
+"exit_code"} when it exits; {"ready": true, ...} is sent after the imports.
+
+Only the standard library is imported here: whatever this process imports is
+already loaded in every command, and must not shadow the commands' own modules.
+"""
+import json
+import os
+import resource
+import runpy
+import select
+import socket
+import sys
+import traceback
+
+# Seconds between checks for exited children when no request arrives
+REAP_INTERVAL = 0.1
+
+
+def send(control, message):
+    control.sendall((json.dumps(message) + "\n").encode())
+
+
+def redirect_output(path):
+    """As user_service's execute_cmd: stdout and stderr to the job's log file, or discarded."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    fd = os.open(path or os.devnull, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    os.dup2(fd, 1)
+    os.dup2(fd, 2)
+    os.close(fd)
+
+
+def apply_limits(request):
+    """As user_service's limits.preexec, in the child before the command runs."""
+    cgroup = request.get("cgroup")
+    if cgroup:
+        with open(os.path.join(cgroup, "cgroup.procs"), "w") as f:
+            f.write(str(os.getpid()))
+    memory_mb = request.get("memory_mb") or 0
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if request.get("cpus"):
+        try:
+            os.sched_setaffinity(0, request["cpus"])
+        except OSError:
+            pass
+
+
+def run(request):
+    """Runs the command as `python <script>`, `python -m <module>` or an entry point would. Returns its exit code."""
+    redirect_output(request.get("output"))
+    os.environ.update(request.get("env") or {})
+    apply_limits(request)
+    kind, target, argv = request["kind"], request["target"], request["argv"]
+    try:
+        if kind == "script":
+            sys.argv = [target, *argv]
+            sys.path[0] = os.path.dirname(os.path.abspath(target))
+            runpy.run_path(target, run_name="__main__")
+        elif kind == "module":
+            sys.argv = [target, *argv]
+            runpy.run_module(target, run_name="__main__", alter_sys=True)
+        else:
+            module, _, function = target.partition(":")
+            sys.argv = [module, *argv]
+            __import__(module)
+            sys.exit(getattr(sys.modules[module], function)())
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def child(read_fd, inherited):
+    """A forked worker: waits for its command, runs it and exits without returning."""
+    code = 1
+    try:
+        os.setsid()
+        for fd in inherited:
+            os.close(fd)
+        with os.fdopen(read_fd, "rb") as f:
+            data = f.read()
+        if data:
+            # Like `python <script>`: imports relative to the working directory, not this file
+            sys.path[0] = os.getcwd()
+            code = run(json.loads(data))
+        else:
+            code = 0  # The pool is shutting down
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+class Zygote:
+    def __init__(self, control, size):
+        self.control = control
+        self.size = size
+        self.idle = []  # (pid, write_fd) of children waiting for a command
+        self.running = {}  # pid -> request id
+
+    def fork(self):
+        read_fd, write_fd = os.pipe()
+        inherited = [self.control.fileno(), write_fd] + [fd for _, fd in self.idle]
+        pid = os.fork()
+        if pid == 0:
+            child(read_fd, inherited)
+        os.close(read_fd)
+        return pid, write_fd
+
+    def refill(self):
+        while len(self.idle) < self.size:
+            self.idle.append(self.fork())
+
+    def start(self, request):
+        pid, write_fd = self.idle.pop(0) if self.idle else self.fork()
+        try:
+            with os.fdopen(write_fd, "wb") as f:
+                f.write(json.dumps(request).encode())
+        except OSError as e:
+            send(self.control, {"id": request["id"], "error": str(e)})
+            return
+        self.running[pid] = request["id"]
+        send(self.control, {"id": request["id"], "pid": pid})
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.running:
+                send(self.control, {"id": self.running.pop(pid), "exit_code": os.waitstatus_to_exitcode(status)})
+            else:
+                # An idle child died (killed from outside): replace it
+                for worker in self.idle:
+                    if worker[0] == pid:
+                        self.idle.remove(worker)
+                        os.close(worker[1])
+                        break
+
+    def serve(self):
+        buffer = b""
+        while True:
+            self.refill()
+            readable, _, _ = select.select([self.control], [], [], REAP_INTERVAL)
+            if readable:
+                data = self.control.recv(65536)
+                if not data:
+                    break  # user_service is gone
+                buffer += data
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if line.strip():
+                        self.start(json.loads(line))
+            self.reap()
+        for _, write_fd in self.idle:
+            os.close(write_fd)
+
+
+def main(argv):
+    control = socket.socket(fileno=int(argv[1]))
+    size = int(argv[2])
+    # The commands' imports resolve from the working directory, as for `python <script>`
+    sys.path[0] = os.getcwd()
+    imported, failed = [], []
+    for module in argv[3:]:
+        try:
+            __import__(module)
+            imported.append(module)
+        except Exception as e:
+            print(f"warm_worker: could not import {module}: {e}", file=sys.stderr)
+            failed.append(module)
+    zygote = Zygote(control, size)
+    zygote.refill()
+    send(control, {"ready": True, "pid": os.getpid(), "modules": imported, "failed": failed})
+    zygote.serve()
+
+
+if __name__ == "__main__":
+    main(sys.argv)